@@ -7,13 +7,37 @@ import io
 import re
 import json
 import time
-
-import requests
+import hashlib
+import queue
+import random
+import asyncio
+import threading
+import concurrent.futures
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+import httpx
 import streamlit as st
 from PIL import Image
 
-from config import GARBAGE_TITLES, ANALYZE_PROMPT, STRATEGY_PROMPT, POLISH_PROMPT
-from utils import get_api_key, make_session, log_event, friendly_api_error
+from config import (
+    GARBAGE_TITLES, ANALYZE_PROMPT, STRATEGY_PROMPT, ANALYZE_STRATEGY_PROMPT, POLISH_PROMPT,
+    EXTRACT_MAX_CONCURRENCY, EXTRACT_PER_HOST, IMAGE_DOWNLOAD_WORKERS, IMAGE_MAX_BYTES,
+    EXTRACT_CACHE_TTL, EXTRACT_NEGATIVE_TTL, EXTRACT_NOTE_TIMEOUT,
+    EXTRACT_COMPLETENESS, EXTRACT_STRATEGY_ALPHA, EXTRACT_STRATEGY_MIN_SAMPLES,
+    EXTRACT_STRATEGY_EXPLORE, EXTRACT_RACE_BELOW, DEEPSEEK_BASE_URL, LLM_TIMEOUT,
+    LLM_BATCH_CONCURRENCY, LLM_BATCH_TPM, LLM_CACHE_TTL, CHAIN_FUSED_RATIO,
+    SHORT_LINK_CACHE_SIZE, SHORT_LINK_TTL,
+)
+from utils import (
+    get_api_key, make_async_client, log_event, friendly_api_error,
+    get_extract_cache, save_extract_cache, get_short_link, save_short_link,
+    put_image_bytes, load_image, lookup_image_url,
+    record_strategy_result, get_strategy_stats,
+    make_llm_http_client, get_llm_pool_stats, get_llm_cache, save_llm_cache,
+)
 
 
 def parse_ai_json(raw_text: str) -> dict | None:
@@ -51,23 +75,318 @@ def _is_useful_title(t: str) -> bool:
     return bool(t) and t.strip() not in GARBAGE_TITLES and len(t.strip()) > 3
 
 
-def _resolve_short_url(url: str) -> str:
-    """展开 xhslink.com 短链接为完整URL"""
+_NOTE_ID_RE = re.compile(r'/(?:explore|discovery/item)/([a-f0-9]{24})')
+
+
+def _canonical_url(url: str) -> str:
+    """去掉参数和锚点的 域名/路径，用作缓存键"""
+    parts = urlsplit(url)
+    return f"{(parts.hostname or '').lower()}{parts.path.rstrip('/')}"
+
+
+def _extract_cache_keys(*urls: str, note_id: str = "") -> list:
+    """提取缓存键：能解析出笔记ID的用 note:<ID>，否则用去掉参数的 url:<域名/路径>"""
+    keys = [f"note:{note_id}"] if note_id else []
+    for u in urls:
+        m = _NOTE_ID_RE.search(u or "")
+        if m:
+            keys.append(f"note:{m.group(1)}")
+        elif u:
+            keys.append(f"url:{_canonical_url(u)}")
+    return list(dict.fromkeys(keys))
+
+
+# ── 异步抓取引擎 ──
+# 所有抓取协程都跑在同一个后台线程的事件循环上（进程内共享），几十篇笔记、上百张图片
+# 并发时也只占一个线程。Streamlit 脚本线程经 _run_on_engine 提交协程并阻塞等待；
+# 进度事件放进队列，回到调用线程再触发回调（widget / session_state 只能在脚本线程操作）。
+
+class _AsyncEngine:
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="xhs-engine", daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+_engine = _AsyncEngine()
+
+
+def _run_on_engine(coro, events: queue.Queue | None = None, on_event=None):
+    """在引擎循环上运行协程并阻塞等待结果；等待期间把 events 中的事件逐个交给 on_event
+    （在调用线程执行）。调用线程被中断（如 Streamlit 重跑）时取消协程"""
+    future = _engine.submit(coro)
+    try:
+        while True:
+            if events is not None:
+                while True:
+                    try:
+                        event = events.get_nowait()
+                    except queue.Empty:
+                        break
+                    on_event(event)
+            if future.done():
+                return future.result()
+            concurrent.futures.wait([future], timeout=0.1 if events is not None else None)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+# ── 抓取限流 ──
+# 进程内所有会话共享：同一域名最多 limit 个在途请求（页面默认 EXTRACT_PER_HOST，
+# 图床用 IMAGE_DOWNLOAD_WORKERS），全部域名合计最多 EXTRACT_MAX_CONCURRENCY 个。
+# 先占域名名额再占全局名额。信号量只在引擎循环里使用，不需要加锁。
+
+_global_slots: asyncio.Semaphore | None = None
+_host_slots: dict[str, asyncio.Semaphore] = {}
+
+
+@asynccontextmanager
+async def _host_slot(url: str, limit: int = EXTRACT_PER_HOST):
+    """占用一个对该 URL 域名的请求名额，离开时归还"""
+    global _global_slots
+    if _global_slots is None:
+        _global_slots = asyncio.Semaphore(EXTRACT_MAX_CONCURRENCY)
+    host = (urlsplit(url).hostname or "").lower()
+    sem = _host_slots.get(host)
+    if sem is None:
+        sem = _host_slots[host] = asyncio.Semaphore(limit)
+    async with sem, _global_slots:
+        yield
+
+
+# ── 短链接展开缓存 ──
+# 内存 LRU（带 TTL）→ SQLite short_link_cache → 联网展开。
+# 同一短链并发展开时只跑一个查库 / 请求任务，其余协程等它的结果。
+
+class _ShortLinkCache:
+
+    def __init__(self, max_size: int, ttl: int):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def _get(self, key: str) -> str:
+        entry = self._entries.get(key)
+        if entry is None:
+            return ""
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return ""
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _put(self, key: str, resolved: str, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, resolved)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    async def _load(self, key: str, url: str, fetch) -> str:
+        row = await asyncio.to_thread(get_short_link, key)
+        if row:
+            self._put(key, row[0], row[1])
+            return row[0]
+        resolved = await fetch(url)
+        if "xiaohongshu.com" in resolved:
+            await asyncio.to_thread(save_short_link, key, resolved, self._ttl)
+            self._put(key, resolved, self._ttl)
+        return resolved
+
+    async def resolve(self, url: str, fetch) -> str:
+        key = _canonical_url(url)
+        hit = self._get(key)
+        if hit:
+            return hit
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._load(key, url, fetch))
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        # shield：某个等待方被取消时，不影响其他等待同一短链的协程
+        return await asyncio.shield(task)
+
+
+_short_links = _ShortLinkCache(SHORT_LINK_CACHE_SIZE, SHORT_LINK_TTL)
+
+
+@contextmanager
+def _timed(timings: dict | None, stage: str):
+    """把这一段的耗时（毫秒）累加到 timings[stage]；timings 为 None 时不计时"""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+
+async def _resolve_short_url(url: str) -> str:
+    """展开 xhslink.com 短链接为完整URL（先查短链缓存）"""
     if "xhslink.com" not in url:
         return url
+    return await _short_links.resolve(url, _fetch_short_url)
+
+
+async def _fetch_short_url(url: str) -> str:
+    """联网展开短链接：先 HEAD，拿不到落地页再 GET"""
     try:
-        s = make_session()
-        r = s.head(url, timeout=10, allow_redirects=True)
-        if r.url and "xiaohongshu.com" in r.url:
-            return r.url
-        r = s.get(url, timeout=10, allow_redirects=True)
-        return r.url
+        async with make_async_client() as client:
+            async with _host_slot(url):
+                r = await client.head(url, timeout=10)
+            if "xiaohongshu.com" in str(r.url):
+                return str(r.url)
+            async with _host_slot(url):
+                r = await client.get(url, timeout=10)
+            return str(r.url)
     except Exception:
         return url
 
 
-def try_extract_xhs(raw_input: str, progress_callback=None):
-    """多策略提取小红书内容，返回 (title, text, image_urls, logs)"""
+# ── 页面解析 ──
+# <head> 里的 meta / <title> 用 HTMLParser 单遍收集，遇到 </head> 或 <body> 即停；
+# INITIAL_STATE 用括号配对截取（跳过字符串字面量），不再对整页反复跑正则。
+
+class _HeadDone(Exception):
+    pass
+
+
+class _HeadMetaParser(HTMLParser):
+    """收集 meta[property|name] → content（同名取第一个）、全部 og:image 和 <title> 文本"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.meta: dict[str, str] = {}
+        self.images: list[str] = []
+        self.title = ""
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "meta":
+            a = dict(attrs)
+            key = (a.get("property") or a.get("name") or "").lower()
+            content = a.get("content")
+            if not key or content is None:
+                return
+            if key == "og:image" and content and content not in self.images:
+                self.images.append(content)
+            self.meta.setdefault(key, content)
+        elif tag == "title":
+            self._in_title = True
+        elif tag == "body":
+            raise _HeadDone
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag == "head":
+            raise _HeadDone
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+
+
+def _parse_head(html: str) -> _HeadMetaParser:
+    parser = _HeadMetaParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except _HeadDone:
+        pass
+    return parser
+
+
+_STATE_MARKER = "window.__INITIAL_STATE__"
+_STATE_ASSIGN_RE = re.compile(r'\s*=\s*\{')
+_STATE_TOKEN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}]|\bundefined\b')
+_STATE_MAX_CHARS = 5 * 1024 * 1024
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _replace_bare_undefined(src: str) -> str | None:
+    """把字符串字面量之外的 undefined 换成 null（按引号奇偶判断是否在字符串内）。
+    含转义反斜杠时奇偶不可靠，返回 None 交给 _scan_initial_state 逐词处理"""
+    if "undefined" not in src:
+        return src
+    if "\\\\" in src:
+        return None
+    parts, last, quotes = [], 0, 0
+    pos = src.find("undefined")
+    while pos >= 0:
+        quotes += src.count('"', last, pos) - src.count('\\"', last, pos)
+        if quotes % 2 == 0:
+            parts.append(src[last:pos])
+            parts.append("null")
+        else:
+            parts.append(src[last:pos + 9])
+        last = pos + 9
+        pos = src.find("undefined", last)
+    parts.append(src[last:])
+    return "".join(parts)
+
+
+def _scan_initial_state(html: str, begin: int) -> str:
+    """从 begin 处的 { 开始括号配对截取对象字面量（跳过字符串），字符串外的 undefined
+    换成 null；最多扫描 _STATE_MAX_CHARS 个字符，找不到完整对象返回空串"""
+    last = begin
+    depth, parts = 0, []
+    for tok in _STATE_TOKEN_RE.finditer(html, begin, min(len(html), begin + _STATE_MAX_CHARS)):
+        t = tok.group()
+        if t == "{":
+            depth += 1
+        elif t == "}":
+            depth -= 1
+            if depth == 0:
+                parts.append(html[last:tok.end()])
+                return "".join(parts)
+        elif t == "undefined":
+            parts.append(html[last:tok.start()])
+            parts.append("null")
+            last = tok.end()
+    return ""
+
+
+def _load_initial_state(html: str) -> dict | None:
+    """解析 window.__INITIAL_STATE__；页面没有时返回 None，内容损坏时抛 JSONDecodeError。
+    快速路径：截到 </script> 为止，替换 undefined 后由 raw_decode 自己找到对象结尾；
+    失败再走逐词的括号配对扫描"""
+    pos = html.find(_STATE_MARKER)
+    if pos < 0:
+        return None
+    m = _STATE_ASSIGN_RE.match(html, pos + len(_STATE_MARKER))
+    if not m:
+        return None
+    begin = m.end() - 1
+    end = html.find("</script>", begin, begin + _STATE_MAX_CHARS)
+    region = _replace_bare_undefined(html[begin:end if end >= 0 else begin + _STATE_MAX_CHARS])
+    if region is not None:
+        try:
+            return _JSON_DECODER.raw_decode(region)[0]
+        except json.JSONDecodeError:
+            pass
+    return json.loads(_scan_initial_state(html, begin) or "{")
+
+
+async def _extract_xhs(raw_input: str, progress_callback=None, use_cache: bool = True,
+                       timings: dict | None = None):
+    """try_extract_xhs 的提取部分（协程，不读 session_state，在引擎循环中运行）。
+    先查提取缓存，未命中才联网；返回 (title, text, image_urls, logs, from_cache)"""
     logs = []
     url = _extract_url(raw_input)
     share_title = _extract_share_title(raw_input)
@@ -75,175 +394,614 @@ def try_extract_xhs(raw_input: str, progress_callback=None):
         logs.append(f"从分享文本识别标题片段：「{share_title[:40]}」")
     if not url.startswith("http"):
         logs.append("未找到有效链接")
-        return share_title, "", [], logs
+        return share_title, "", [], logs, False
+
+    cached = None
+    if use_cache:
+        with _timed(timings, "cache_lookup"):
+            cached = await asyncio.to_thread(get_extract_cache, _extract_cache_keys(url))
+    if cached:
+        title, text, images = cached["title"], cached["text"], cached["image_urls"]
+        logs.append(f"命中提取缓存（{cached['created_at']} UTC 提取），未重新请求")
+        logs.extend(cached["logs"])
+        if not cached["success"]:
+            logs.append(f"该链接近期提取失败，{EXTRACT_NEGATIVE_TTL // 60} 分钟内不重复请求")
+    else:
+        fetch_logs = []
+        title, text, images, note_id, resolved, page_reached = await _fetch_note(
+            url, fetch_logs, progress_callback, timings,
+        )
+        logs.extend(fetch_logs)
+        # 超时 / 网络异常不缓存；页面能打开却提取不到内容才做失败缓存
+        if use_cache and (title or text or page_reached):
+            with _timed(timings, "cache_store"):
+                await asyncio.to_thread(
+                    save_extract_cache,
+                    _extract_cache_keys(url, resolved, note_id=note_id),
+                    {"title": title, "text": text, "image_urls": images,
+                     "logs": fetch_logs, "note_id": note_id},
+                    success=bool(title or text),
+                    ttl=EXTRACT_CACHE_TTL if (title or text) else EXTRACT_NEGATIVE_TTL,
+                )
+
+    if share_title and (not _is_useful_title(title) or len(share_title) > len(title) * 2):
+        logs.append(f"使用分享文本标题（替代「{title}」）")
+        title = share_title
 
+    logs.append(
+        f"最终结果：标题{len(title)}字，正文{len(text)}字，{len(images)}张图"
+        if (title or text) else "所有策略均未成功"
+    )
+    return title, text, images, logs, bool(cached)
+
+
+# ── 提取策略调度 ──
+# 抓取策略（page / page_retry / explore）负责拿到页面，解析策略（og_tags /
+# initial_state / title_tag）从页面里取内容。每个策略的成功率和耗时按滑动平均统计并
+# 持久化；调度时按「预期耗时 / 成功率」排序，结果完整度达到 EXTRACT_COMPLETENESS
+# 即停止。首选抓取策略近期成功率低于 EXTRACT_RACE_BELOW 时与下一个策略并发，先达标者胜。
+
+class _StrategyStats:
+    """各策略的滑动平均成功率 / 耗时（只在引擎循环里读写），首次使用时从数据库恢复"""
+
+    def __init__(self):
+        self._stats: dict[str, list] | None = None  # name → [成功率, 耗时ms, 样本数]
+
+    async def ensure_loaded(self):
+        if self._stats is None:
+            rows = await asyncio.to_thread(get_strategy_stats)
+            self._stats = {k: [v["ewma_success"], v["ewma_ms"], v["attempts"]] for k, v in rows.items()}
+
+    def success_rate(self, name: str) -> float:
+        s = self._stats.get(name)
+        return s[0] if s and s[2] >= EXTRACT_STRATEGY_MIN_SAMPLES else 1.0
+
+    def order(self, names: list) -> list:
+        """样本都足够时按预期耗时（耗时 / 成功率）升序，否则保持默认顺序"""
+        if random.random() < EXTRACT_STRATEGY_EXPLORE:
+            return list(names)
+        stats = [self._stats.get(n) for n in names]
+        if any(s is None or s[2] < EXTRACT_STRATEGY_MIN_SAMPLES for s in stats):
+            return list(names)
+        cost = {n: s[1] / max(s[0], 0.05) for n, s in zip(names, stats)}
+        return sorted(names, key=cost.__getitem__)
+
+    def record(self, name: str, ok: bool, elapsed_ms: float):
+        s = self._stats.get(name)
+        if s is None or not s[2]:
+            s = self._stats[name] = [float(ok), elapsed_ms, 0]
+        else:
+            s[0] += EXTRACT_STRATEGY_ALPHA * (float(ok) - s[0])
+            s[1] += EXTRACT_STRATEGY_ALPHA * (elapsed_ms - s[1])
+        s[2] += 1
+        # 落库交给单线程执行器（保持顺序），不在引擎循环里做 SQLite 写入或等写入队列
+        _stats_executor.submit(record_strategy_result, name, ok, elapsed_ms, s[0], s[1])
+
+
+_strategy_stats = _StrategyStats()
+_stats_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="strategy-stats")
+
+
+class _Extraction:
+    """一次笔记提取中各策略共同填充的结果"""
+
+    def __init__(self, url: str, logs: list, progress_callback, timings: dict | None):
+        self.url = url
+        self.logs = logs
+        self.progress_callback = progress_callback
+        self.timings = timings
+        self.title, self.text, self.images = "", "", []
+        m = _NOTE_ID_RE.search(url)
+        self.note_id = m.group(1) if m else ""
+        self.page_reached = False
+        self.fetches = 0
+
+    def completeness(self) -> float:
+        return ((0.4 if _is_useful_title(self.title) else 0.0)
+                + (0.4 if len(self.text) > 10 else 0.0)
+                + (0.2 if self.images else 0.0))
+
+    def complete(self) -> bool:
+        return self.completeness() >= EXTRACT_COMPLETENESS
+
+    def add_images(self, urls):
+        for u in urls:
+            if u and u not in self.images:
+                self.images.append(u)
+
+
+# ── 解析策略：从一个页面中取内容，返回是否取到了东西 ──
+
+def _page_head(ex: _Extraction, page: dict) -> _HeadMetaParser:
+    if page.get("head") is None:
+        with _timed(ex.timings, "parse_head"):
+            page["head"] = _parse_head(page["html"])
+    return page["head"]
+
+
+def _parse_og_tags(ex: _Extraction, page: dict) -> bool:
+    head = _page_head(ex, page)
+    title = head.meta.get("og:title", "")
+    text = max((head.meta.get(k, "") for k in ("og:description", "description")), key=len)
+    if title and not _is_useful_title(ex.title):
+        ex.title = title
+    if len(text) > len(ex.text):
+        ex.text = text
+    ex.add_images(head.images)
+    if not ((_is_useful_title(title) and text) or len(text) > 10 or head.images):
+        return False
+    ex.logs.append(f"og:tags 提取成功（标题{len(title)}字，正文{len(text)}字，{len(head.images)}张图）")
+    return True
+
+
+def _parse_initial_state(ex: _Extraction, page: dict) -> bool:
+    try:
+        with _timed(ex.timings, "parse_state"):
+            data = _load_initial_state(page["html"])
+    except json.JSONDecodeError:
+        ex.logs.append("INITIAL_STATE JSON解析失败")
+        return False
+    if not data:
+        return False
+    _note = None
+    nd = data.get("noteData", {})
+    nd_inner = nd.get("data", {}).get("noteData", {})
+    if nd_inner and nd_inner.get("title"):
+        _note = nd_inner
+    if not _note:
+        preload = nd.get("normalNotePreloadData", {})
+        if preload and preload.get("title"):
+            _note = preload
+    if not _note:
+        note_map = data.get("note", {}).get("noteDetailMap", {})
+        if note_map:
+            _note = list(note_map.values())[0].get("note", {})
+    if not (_note and (_note.get("title") or _note.get("desc"))):
+        return False
+    ex.title = _note.get("title", "") or ex.title
+    ex.text = _note.get("desc", "") or ex.text
+    ex.add_images(img.get("url") or img.get("urlDefault") or img.get("urlSizeLarge") or ""
+                  for img in (_note.get("imageList", []) or _note.get("imagesList", [])))
+    ex.logs.append(f"INITIAL_STATE 提取成功（标题{len(ex.title)}字，正文{len(ex.text)}字，{len(ex.images)}张图）")
+    return True
+
+
+def _parse_title_tag(ex: _Extraction, page: dict) -> bool:
+    head = _page_head(ex, page)
+    if not head.title.strip() or _is_useful_title(ex.title):
+        return False
+    raw_t = re.sub(r'\s*[-–—|]\s*小红书.*$', '', head.title.strip())
+    if not _is_useful_title(raw_t):
+        return False
+    ex.title = raw_t
+    ex.logs.append(f"从 <title> 提取：「{raw_t[:30]}」")
+    return True
+
+
+_PARSE_STRATEGIES = {
+    "og_tags": _parse_og_tags,
+    "initial_state": _parse_initial_state,
+    "title_tag": _parse_title_tag,
+}
+
+
+def _apply_parsers(ex: _Extraction, html: str):
+    """按调度顺序跑解析策略，完整度达标即停"""
+    page = {"html": html, "head": None}
+    for name in _strategy_stats.order(list(_PARSE_STRATEGIES)):
+        start = time.perf_counter()
+        found = _PARSE_STRATEGIES[name](ex, page)
+        _strategy_stats.record(name, found, (time.perf_counter() - start) * 1000)
+        if ex.complete():
+            return
+
+
+# ── 抓取策略：(进度文案, 是否需要笔记ID) ──
+
+_FETCH_STRATEGIES = {
+    "page": ("策略1：模拟手机浏览器访问…", False),
+    "page_retry": ("策略1：更换浏览器指纹重试…", False),
+    "explore": ("策略2：尝试备用接口…", True),
+}
+
+
+async def _fetch_page(ex: _Extraction, name: str) -> str | None:
+    """执行一个抓取策略，返回页面 HTML；状态码非 200 或请求失败返回 None"""
+    if name == "explore":
+        target = f"https://www.xiaohongshu.com/explore/{ex.note_id}"
+        referer, stage = "https://www.xiaohongshu.com/", "fallback"
+    else:
+        target, referer, stage = ex.url, "", "fetch"
+    try:
+        if name == "page_retry" and ex.fetches:
+            with _timed(ex.timings, "retry_wait"):
+                await asyncio.sleep(0.5)
+            ex.logs.append("重试（更换浏览器指纹）")
+        # 每个策略用新的客户端（新指纹、空 cookie），连接仍走共享池
+        with _timed(ex.timings, stage):
+            async with make_async_client(referer=referer) as client, _host_slot(target):
+                resp = await client.get(target, timeout=15)
+    except httpx.TimeoutException:
+        ex.logs.append(f"[{name}] 请求超时")
+        return None
+    except Exception as e:
+        ex.logs.append(f"[{name}] 异常：{type(e).__name__}")
+        return None
+    finally:
+        ex.fetches += 1
+    final_url = str(resp.url)
+    ex.logs.append(f"[{name}] 最终URL：{final_url}（状态码 {resp.status_code}）")
+    if resp.status_code in (404, 410):
+        ex.page_reached = True
+    if resp.status_code != 200:
+        return None
+    ex.page_reached = True
+    if not ex.note_id:
+        nid = _NOTE_ID_RE.search(final_url)
+        if nid:
+            ex.note_id = nid.group(1)
+            ex.logs.append(f"笔记ID：{ex.note_id}")
+    return resp.text
+
+
+def _can_fetch(ex: _Extraction, name: str) -> bool:
+    if not _FETCH_STRATEGIES[name][1]:
+        return True
+    # 链接本身就是 /explore/<ID> 时备用接口等同于重试，不再单独请求
+    return bool(ex.note_id) and _canonical_url(ex.url) != f"www.xiaohongshu.com/explore/{ex.note_id}"
+
+
+async def _run_fetch_strategy(ex: _Extraction, name: str, step: int) -> bool:
+    if ex.progress_callback:
+        ex.progress_callback(min(0.1 + 0.15 * step, 0.6), _FETCH_STRATEGIES[name][0])
+    start = time.perf_counter()
+    html = await _fetch_page(ex, name)
+    if html:
+        _apply_parsers(ex, html)
+    ok = ex.complete()
+    _strategy_stats.record(name, ok, (time.perf_counter() - start) * 1000)
+    if ok:
+        ex.logs.append(f"[{name}] 结果完整度 {ex.completeness():.1f}，停止后续策略")
+    return ok
+
+
+async def _fetch_note(url: str, logs: list, progress_callback=None, timings: dict | None = None) -> tuple:
+    """联网提取一篇笔记（按策略统计调度抓取 / 解析策略，完整度达标即停）。
+    返回 (title, text, image_urls, note_id, 展开后的URL, 页面是否可访问)"""
     # 展开短链接
     if "xhslink.com" in url:
         logs.append("检测到短链接，正在展开…")
-        url = _resolve_short_url(url)
+        with _timed(timings, "resolve_short"):
+            url = await _resolve_short_url(url)
         logs.append(f"展开后：{url}")
 
     logs.append(f"提取到链接：{url}")
-    session = make_session()
-    title, text, images, note_id = "", "", [], ""
-
-    for attempt in range(2):
-        try:
-            if attempt > 0:
-                session = make_session()
-                time.sleep(0.5)
-                logs.append(f"重试第 {attempt + 1} 次（更换浏览器指纹）")
-            if progress_callback:
-                progress_callback(0.1 + attempt * 0.1, f"策略1：模拟手机浏览器访问（第{attempt+1}次）…")
-
-            resp = session.get(url, timeout=15, allow_redirects=True)
-            final_url = resp.url
-            logs.append(f"最终URL：{final_url}（状态码 {resp.status_code}）")
-            if resp.status_code != 200:
-                continue
-
-            html = resp.text
-            nid = re.search(r'/(?:explore|discovery/item)/([a-f0-9]{24})', final_url)
-            if nid:
-                note_id = nid.group(1)
-                logs.append(f"笔记ID：{note_id}")
-
-            for pat in [
-                r'<meta[^>]+property="og:title"[^>]+content="([^"]*)"',
-                r'<meta[^>]+content="([^"]*)"[^>]+property="og:title"',
-            ]:
-                t = re.search(pat, html)
-                if t:
-                    title = t.group(1)
-                    break
-            for pat in [
-                r'<meta[^>]+property="og:description"[^>]+content="([^"]*)"',
-                r'<meta[^>]+name="description"[^>]+content="([^"]*)"',
-                r'<meta[^>]+content="([^"]*)"[^>]+property="og:description"',
-            ]:
-                d = re.search(pat, html)
-                if d and len(d.group(1)) > len(text):
-                    text = d.group(1)
-            for pat in [
-                r'<meta[^>]+property="og:image"[^>]+content="([^"]*)"',
-                r'<meta[^>]+content="([^"]*)"[^>]+property="og:image"',
-            ]:
-                for m in re.finditer(pat, html):
-                    if m.group(1) and m.group(1) not in images:
-                        images.append(m.group(1))
-
-            if (_is_useful_title(title) and text) or len(text) > 10 or images:
-                logs.append(f"og:tags 提取成功（标题{len(title)}字，正文{len(text)}字，{len(images)}张图）")
-                break
-
-            state = re.search(
-                r'window\.__INITIAL_STATE__\s*=\s*(\{.+?\})\s*</script>',
-                html, re.DOTALL,
-            )
-            if state:
-                raw_json = re.sub(r":\s*undefined", ": null", state.group(1))
-                try:
-                    data = json.loads(raw_json)
-                    _note = None
-                    nd = data.get("noteData", {})
-                    nd_inner = nd.get("data", {}).get("noteData", {})
-                    if nd_inner and nd_inner.get("title"):
-                        _note = nd_inner
-                    if not _note:
-                        preload = nd.get("normalNotePreloadData", {})
-                        if preload and preload.get("title"):
-                            _note = preload
-                    if not _note:
-                        note_map = data.get("note", {}).get("noteDetailMap", {})
-                        if note_map:
-                            _note = list(note_map.values())[0].get("note", {})
-                    if _note and (_note.get("title") or _note.get("desc")):
-                        title = _note.get("title", "") or title
-                        text = _note.get("desc", "") or text
-                        for img in (_note.get("imageList", []) or _note.get("imagesList", [])):
-                            u = img.get("url") or img.get("urlDefault") or img.get("urlSizeLarge") or ""
-                            if u and u not in images:
-                                images.append(u)
-                        logs.append(f"INITIAL_STATE 提取成功（标题{len(title)}字，正文{len(text)}字，{len(images)}张图）")
+    ex = _Extraction(url, logs, progress_callback, timings)
+    await _strategy_stats.ensure_loaded()
+    pending = _strategy_stats.order(list(_FETCH_STRATEGIES))
+    if pending != list(_FETCH_STRATEGIES):
+        logs.append(f"策略顺序：{' → '.join(pending)}")
+    step = 0
+    while pending and not ex.complete():
+        # 需要笔记ID的策略等前面的策略拿到ID再跑，到最后仍没有ID就跳过
+        runnable = [n for n in pending if _can_fetch(ex, n)]
+        if not runnable:
+            break
+        name = runnable[0]
+        pending.remove(name)
+        group = [name]
+        if len(runnable) > 1 and _strategy_stats.success_rate(name) < EXTRACT_RACE_BELOW:
+            group.append(runnable[1])
+            pending.remove(runnable[1])
+            logs.append(f"{name} 近期成功率低，与 {runnable[1]} 并发执行")
+        if len(group) == 1:
+            await _run_fetch_strategy(ex, name, step)
+        else:
+            tasks = [asyncio.ensure_future(_run_fetch_strategy(ex, n, step)) for n in group]
+            try:
+                for fut in asyncio.as_completed(tasks):
+                    if await fut:
                         break
-                except json.JSONDecodeError:
-                    logs.append("INITIAL_STATE JSON解析失败")
-
-            title_tag = re.search(r'<title[^>]*>([^<]+)</title>', html)
-            if title_tag and not _is_useful_title(title):
-                raw_t = re.sub(r'\s*[-–—|]\s*小红书.*$', '', title_tag.group(1).strip())
-                if _is_useful_title(raw_t):
-                    title = raw_t
-                    logs.append(f"从 <title> 提取：「{title[:30]}」")
-
-        except requests.exceptions.Timeout:
-            logs.append(f"第{attempt+1}次请求超时")
-        except Exception as e:
-            logs.append(f"第{attempt+1}次异常：{type(e).__name__}")
+            finally:
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        step += len(group)
 
-    if not title and not text and note_id:
-        if progress_callback:
-            progress_callback(0.5, "策略2：尝试备用接口…")
-        try:
-            s2 = make_session()
-            s2.headers["Referer"] = "https://www.xiaohongshu.com/"
-            r2 = s2.get(f"https://www.xiaohongshu.com/explore/{note_id}", timeout=15, allow_redirects=True)
-            if r2.status_code == 200:
-                for pat in [
-                    r'<meta[^>]+property="og:title"[^>]+content="([^"]*)"',
-                    r'<meta[^>]+(?:property="og:description"|name="description")[^>]+content="([^"]*)"',
-                ]:
-                    m2 = re.search(pat, r2.text)
-                    if m2:
-                        if "title" in pat:
-                            title = m2.group(1)
-                        else:
-                            text = m2.group(1)
-                if title or text:
-                    logs.append("备用接口提取成功")
-        except Exception:
-            logs.append("备用接口未成功")
+    return ex.title, ex.text, ex.images, ex.note_id, url, ex.page_reached
 
-    if share_title and (not _is_useful_title(title) or len(share_title) > len(title) * 2):
-        logs.append(f"使用分享文本标题（替代「{title}」）")
-        title = share_title
 
-    logs.append(
-        f"最终结果：标题{len(title)}字，正文{len(text)}字，{len(images)}张图"
-        if (title or text) else "所有策略均未成功"
-    )
+def _log_extract_event(title: str, text: str, images: list, from_cache: bool = False):
     log_event(
         st.session_state.get("invite_code", ""),
         "extract_link",
         industry_id=st.session_state.get("industry_id", ""),
         mode="rewrite",
-        detail=json.dumps({"title_len": len(title), "text_len": len(text), "img_count": len(images)}),
+        detail=json.dumps({"title_len": len(title), "text_len": len(text),
+                           "img_count": len(images), "cached": from_cache}),
         success=bool(title or text),
     )
+
+
+async def _extract_note(raw_input: str, progress_callback=None, use_cache: bool = True,
+                        timings: dict | None = None):
+    """_extract_xhs 加总耗时上限：超过 EXTRACT_NOTE_TIMEOUT 秒取消在途请求，按提取失败返回"""
+    try:
+        return await asyncio.wait_for(
+            _extract_xhs(raw_input, progress_callback, use_cache, timings), EXTRACT_NOTE_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        return "", "", [], [f"提取超时（超过 {EXTRACT_NOTE_TIMEOUT} 秒），已取消"], False
+
+
+def try_extract_xhs(raw_input: str, progress_callback=None, use_cache: bool = True,
+                    timings: dict | None = None):
+    """多策略提取小红书内容，返回 (title, text, image_urls, logs)
+    timings 传入 dict 时按阶段累加耗时（毫秒）：cache_lookup / resolve_short / fetch /
+    retry_wait / parse_head / parse_state / fallback / cache_store"""
+    events = queue.Queue() if progress_callback else None
+    title, text, images, logs, from_cache = _run_on_engine(
+        _extract_note(raw_input, events and (lambda pct, msg: events.put((pct, msg))), use_cache, timings),
+        events, lambda e: progress_callback(*e),
+    )
+    _log_extract_event(title, text, images, from_cache)
     return title, text, images, logs
 
 
-def download_image_url(url: str):
+_IMAGE_REFERER = "https://www.xiaohongshu.com/"
+
+
+def _store_image_bytes(data: bytes, source_url: str = "") -> Image.Image:
+    """解码图片字节（RGB）并写入图片存储；返回的图 info["blob"] 为存储句柄（digest）"""
+    src = Image.open(io.BytesIO(data))
+    img = src.convert("RGB")
+    img.info["blob"] = put_image_bytes(data, source_url, src)
+    return img
+
+
+async def _fetch_image(client: httpx.AsyncClient, url: str) -> tuple:
+    """下载一张图片，返回 (Image | None, 错误信息)。下载过的 URL 直接从图片存储读盘；
+    否则流式下载，超过 IMAGE_MAX_BYTES 即中止，解码和落盘放到线程池"""
     try:
-        s = make_session()
-        s.headers["Referer"] = "https://www.xiaohongshu.com/"
-        r = s.get(url, timeout=15)
-        r.raise_for_status()
-        return Image.open(io.BytesIO(r.content)).convert("RGB")
-    except Exception:
-        return None
+        digest = await asyncio.to_thread(lookup_image_url, url)
+        if digest:
+            img = await asyncio.to_thread(load_image, digest)
+            if img:
+                return img, ""
+        async with _host_slot(url, IMAGE_DOWNLOAD_WORKERS):
+            async with client.stream("GET", url, timeout=15) as r:
+                r.raise_for_status()
+                declared = int(r.headers.get("Content-Length") or 0)
+                if declared > IMAGE_MAX_BYTES:
+                    return None, f"图片过大（{declared // 1024}KB）"
+                buf = io.BytesIO()
+                async for chunk in r.aiter_bytes(64 * 1024):
+                    buf.write(chunk)
+                    if buf.tell() > IMAGE_MAX_BYTES:
+                        return None, f"图片超过 {IMAGE_MAX_BYTES // 1024 // 1024}MB，已中止下载"
+        return await asyncio.to_thread(_store_image_bytes, buf.getvalue(), url), ""
+    except httpx.TimeoutException:
+        return None, "下载超时"
+    except httpx.HTTPError as e:
+        return None, f"下载失败：{type(e).__name__}"
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None, "图片无法解码"
+
+
+async def _download_images(urls: list, progress_callback=None) -> list:
+    """并发下载一篇笔记的全部图片（共用一个客户端，单个图床域名最多 IMAGE_DOWNLOAD_WORKERS 个在途）"""
+    done = 0
+
+    async def _one(client, url: str):
+        nonlocal done
+        result = await _fetch_image(client, url)
+        done += 1
+        if progress_callback:
+            progress_callback(done, len(urls))
+        return result
+
+    async with make_async_client(referer=_IMAGE_REFERER) as client:
+        return list(await asyncio.gather(*(_one(client, u) for u in urls)))
+
+
+def download_image_url(url: str):
+    async def _one():
+        async with make_async_client(referer=_IMAGE_REFERER) as client:
+            return await _fetch_image(client, url)
+
+    img, _err = _run_on_engine(_one())
+    return img
+
+
+def download_images(urls: list, progress_callback=None) -> list:
+    """并发下载一篇笔记的全部图片，返回与 urls 顺序一致的 [(Image | None, 错误信息), ...]；
+    progress_callback(done, total) 在调用线程中触发"""
+    if not urls:
+        return []
+    events = queue.Queue() if progress_callback else None
+    return _run_on_engine(
+        _download_images(urls, events and (lambda k, total: events.put((k, total)))),
+        events, lambda e: progress_callback(*e),
+    )
+
+
+async def _extract_batch(raw_inputs: list, emit, fetch_images: bool) -> list:
+    """extract_batch 的协程部分：每条链接一个协程，限流由 _host_slot 负责。
+    emit((idx, pct, msg, result)) 报告进度，result 只在该条完成时给出"""
+
+    async def _one(idx: int, raw: str) -> dict:
+        try:
+            title, text, image_urls, logs, from_cache = await _extract_note(
+                raw, lambda pct, msg: emit((idx, pct * 0.7, msg, None)),
+            )
+        except Exception as e:
+            title, text, image_urls, logs, from_cache = "", "", [], [f"提取异常：{type(e).__name__}"], False
+        images = []
+        if fetch_images and image_urls:
+            emit((idx, 0.7, f"下载图片（共 {len(image_urls)} 张）…", None))
+            downloaded = await _download_images(
+                image_urls,
+                lambda k, total: emit((idx, 0.7 + 0.3 * k / total, f"下载图片 {k}/{total}", None)),
+            )
+            for k, (im, err) in enumerate(downloaded):
+                if im:
+                    images.append(im)
+                else:
+                    logs.append(f"第 {k + 1} 张图片未下载：{err}")
+        result = {"url": raw, "title": title, "text": text, "image_urls": image_urls,
+                  "images": images, "image_blobs": [im.info.get("blob", "") for im in images],
+                  "logs": logs, "from_cache": from_cache}
+        emit((idx, 1.0, "完成", result))
+        return result
+
+    return list(await asyncio.gather(*(_one(i, raw) for i, raw in enumerate(raw_inputs))))
+
+
+def extract_batch(raw_inputs: list, progress_callback=None, fetch_images: bool = True) -> list:
+    """并发提取多条链接（请求经 _host_slot 限流），结果顺序与输入一致。
+    每条返回 {"url", "title", "text", "image_urls", "images", "image_blobs", "logs", "from_cache"}，
+    image_blobs 为 images 在图片存储中的句柄（load_image 可重新读出）；
+    progress_callback(pct, msg) 约定同 try_extract_xhs，pct 为整批进度，只在调用线程中触发"""
+    n = len(raw_inputs)
+    if not n:
+        return []
+    events: queue.Queue = queue.Queue()
+    progress = [0.0] * n
+
+    def _on_event(event):
+        idx, pct, msg, result = event
+        progress[idx] = max(progress[idx], pct)
+        if result is not None:
+            # 埋点要读 session_state，放在调用线程里记
+            _log_extract_event(result["title"], result["text"], result["image_urls"], result["from_cache"])
+        if progress_callback:
+            progress_callback(min(sum(progress) / n, 0.99), f"[{idx + 1}/{n}] {msg}")
+
+    return _run_on_engine(_extract_batch(raw_inputs, events.put, fetch_images), events, _on_event)
 
 
 # ═══════════════════════════════════════════════════════
-#  DeepSeek 文案生成
+#  大模型客户端
 # ═══════════════════════════════════════════════════════
+# OpenAI / Anthropic / genai 客户端按 (服务商, API Key) 在进程内缓存复用。
+# OpenAI 与 Anthropic 共用 make_llm_http_client() 的连接池（限额、超时见 config），
+# 三步链式生成的各步复用同一条 keep-alive 连接；genai.Client 自带连接池，缓存客户端即可。
+
+class _LLMClients:
+
+    def __init__(self):
+        self._clients: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, provider: str, api_key: str):
+        key = (provider, api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._hits += 1
+                return client
+        client = self._build(provider, api_key)
+        with self._lock:
+            self._misses += 1
+            return self._clients.setdefault(key, client)
+
+    @staticmethod
+    def _sdk_client(cls, **kwargs):
+        try:
+            return cls(http_client=make_llm_http_client(), **kwargs)
+        except TypeError:
+            # SDK 不接受 httpx.Client（换了自带的 HTTP 库）时用它自己的连接池，客户端缓存后同样复用
+            return cls(timeout=LLM_TIMEOUT, **kwargs)
 
-def rewrite_with_deepseek(title: str, text: str, industry: dict, city: str,
-                          content_strategy: dict | None = None) -> str:
-    """Mode A：调用 DeepSeek 改写竞品文案"""
-    from openai import OpenAI
-    api_key = get_api_key("DEEPSEEK_API_KEY")
-    client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
+    def _build(self, provider: str, api_key: str):
+        if provider == "deepseek":
+            from openai import OpenAI
+            return self._sdk_client(OpenAI, api_key=api_key, base_url=DEEPSEEK_BASE_URL)
+        if provider == "anthropic":
+            import anthropic
+            return self._sdk_client(anthropic.Anthropic, api_key=api_key)
+        if provider == "gemini":
+            from google import genai
+            return genai.Client(api_key=api_key)
+        raise ValueError(f"未知的模型服务商：{provider}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "clients": len(self._clients)}
+
+
+_llm_clients = _LLMClients()
+
+
+def _deepseek():
+    return _llm_clients.get("deepseek", get_api_key("DEEPSEEK_API_KEY"))
+
+
+def _claude():
+    """Claude 客户端；未配置 ANTHROPIC_API_KEY 时返回 None"""
+    api_key = get_api_key("ANTHROPIC_API_KEY")
+    return _llm_clients.get("anthropic", api_key) if api_key else None
+
+
+def get_llm_client_stats() -> dict:
+    """大模型客户端缓存命中次数 + 各 API 域名的连接复用统计"""
+    return {"clients": _llm_clients.stats(), "connections": get_llm_pool_stats()}
+
+
+# ── 响应缓存 ──
+# 键为 (服务商, 发给 SDK 的请求参数：模型 / 消息 / temperature / max_tokens / response_format)
+# 的 SHA-256，响应文本存 SQLite llm_cache（TTL + 行数上限）。是否启用由各调用点决定，
+# 命中 / 未命中按调用点计数。
+
+_llm_cache_counts: dict[str, list] = {}
+_llm_cache_lock = threading.Lock()
+
+
+def _llm_cache_key(provider: str, request: dict) -> str:
+    return hashlib.sha256(
+        json.dumps([provider, request], ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _lookup_llm_cache(site: str, provider: str, request: dict) -> str | None:
+    cached = get_llm_cache(_llm_cache_key(provider, request))
+    with _llm_cache_lock:
+        counts = _llm_cache_counts.setdefault(site, [0, 0])
+        counts[0 if cached is not None else 1] += 1
+    return cached
+
+
+def _cached_completion(site: str, provider: str, request: dict, call, enabled: bool, valid=None) -> str:
+    """enabled 时先查缓存；未命中再 call()，结果非空且通过 valid 校验才写入缓存"""
+    if not enabled:
+        return call()
+    cached = _lookup_llm_cache(site, provider, request)
+    if cached is not None:
+        return cached
+    text = call()
+    if text and (valid is None or valid(text)):
+        save_llm_cache(_llm_cache_key(provider, request), provider, request["model"], text, LLM_CACHE_TTL)
+    return text
+
+
+def get_llm_cache_stats() -> dict:
+    """各调用点的响应缓存命中情况 {调用点: {"hits", "misses", "hit_rate"}}"""
+    with _llm_cache_lock:
+        return {
+            site: {"hits": h, "misses": m, "hit_rate": h / (h + m) if h + m else 0.0}
+            for site, (h, m) in _llm_cache_counts.items()
+        }
+
+
+# ═══════════════════════════════════════════════════════
+#  文案提示词
+# ═══════════════════════════════════════════════════════
+
+def _rewrite_prompt(title: str, text: str, industry: dict, city: str,
+                    content_strategy: dict | None = None) -> tuple[str, str]:
+    """Mode A 的 (system, user)"""
     system = industry["system_prompt"] + f"\n\n目标城市：{city}"
     if content_strategy:
         strategy_text = json.dumps(content_strategy, ensure_ascii=False)
@@ -252,24 +1010,11 @@ def rewrite_with_deepseek(title: str, text: str, industry: dict, city: str,
             f"请严格按照以下策略改写：\n{strategy_text}\n"
             f"改写时必须体现策略中的切入角度和差异化卖点。"
         )
-    resp = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": f"原标题：{title}\n\n原正文：{text}"},
-        ],
-        temperature=0.8,
-        max_tokens=2000,
-    )
-    return resp.choices[0].message.content
+    return system, f"原标题：{title}\n\n原正文：{text}"
 
 
-def generate_original_content(store_profile: dict, brief: str, industry: dict, city: str) -> str:
-    """Mode B：根据店铺信息生成原创文案"""
-    from openai import OpenAI
-    api_key = get_api_key("DEEPSEEK_API_KEY")
-    client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
-
+def _create_prompt(store_profile: dict, brief: str, industry: dict, city: str) -> tuple[str, str]:
+    """Mode B 的 (system, user)"""
     lines = []
     for field in industry.get("profile_fields", []):
         val = store_profile.get(field["key"], "").strip()
@@ -278,215 +1023,406 @@ def generate_original_content(store_profile: dict, brief: str, industry: dict, c
     store_info = "\n".join(lines) if lines else "（未填写店铺信息）"
 
     system = industry["create_system_prompt"] + f"\n\n目标城市：{city}"
-    user_content = f"店铺信息：\n{store_info}\n\n今日发帖主题：{brief}"
+    return system, f"店铺信息：\n{store_info}\n\n今日发帖主题：{brief}"
 
-    resp = client.chat.completions.create(
+
+# ═══════════════════════════════════════════════════════
+#  DeepSeek 文案生成
+# ═══════════════════════════════════════════════════════
+
+def _deepseek_text(site: str, system: str, user: str, temperature: float,
+                   usage: dict | None = None, cache: bool = False) -> str:
+    """usage 传入 dict 时写入本次实际消耗的 token 数（usage["tokens"]，命中缓存为 0）"""
+    request = {
+        "model": "deepseek-chat",
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ],
+        "temperature": temperature,
+        "max_tokens": 2000,
+    }
+    if usage is not None:
+        usage["tokens"] = 0
+
+    def _call():
+        resp = _deepseek().chat.completions.create(**request)
+        if usage is not None and resp.usage:
+            usage["tokens"] = resp.usage.total_tokens
+        return resp.choices[0].message.content
+
+    return _cached_completion(site, "deepseek", request, _call, cache)
+
+
+def _deepseek_stream(system: str, user: str, temperature: float):
+    """逐段 yield 生成的文本；调用方提前停止迭代时关闭响应"""
+    stream = _deepseek().chat.completions.create(
         model="deepseek-chat",
         messages=[
             {"role": "system", "content": system},
-            {"role": "user", "content": user_content},
+            {"role": "user", "content": user},
         ],
-        temperature=0.85,
+        temperature=temperature,
         max_tokens=2000,
+        stream=True,
     )
-    return resp.choices[0].message.content
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+
+
+def rewrite_with_deepseek(title: str, text: str, industry: dict, city: str,
+                          content_strategy: dict | None = None, cache: bool = False) -> str:
+    """Mode A：调用 DeepSeek 改写竞品文案；cache=True 时相同输入直接返回上次的结果"""
+    system, user = _rewrite_prompt(title, text, industry, city, content_strategy)
+    return _deepseek_text("rewrite", system, user, temperature=0.8, cache=cache)
+
+
+def stream_rewrite_with_deepseek(title: str, text: str, industry: dict, city: str,
+                                 content_strategy: dict | None = None):
+    """Mode A 流式版：逐段 yield 改写文本"""
+    system, user = _rewrite_prompt(title, text, industry, city, content_strategy)
+    yield from _deepseek_stream(system, user, temperature=0.8)
+
+
+def generate_original_content(store_profile: dict, brief: str, industry: dict, city: str,
+                              cache: bool = False) -> str:
+    """Mode B：根据店铺信息生成原创文案"""
+    system, user = _create_prompt(store_profile, brief, industry, city)
+    return _deepseek_text("create", system, user, temperature=0.85, cache=cache)
+
+
+def stream_generate_original_content(store_profile: dict, brief: str, industry: dict, city: str):
+    """Mode B 流式版：逐段 yield 原创文本"""
+    system, user = _create_prompt(store_profile, brief, industry, city)
+    yield from _deepseek_stream(system, user, temperature=0.85)
 
 
 # ═══════════════════════════════════════════════════════
 #  Claude 文案生成（企业版专属）
 # ═══════════════════════════════════════════════════════
 
-def rewrite_with_claude(title: str, text: str, industry: dict, city: str,
-                        content_strategy: dict | None = None) -> str:
-    """企业版 Mode A：调用 Claude 改写竞品文案"""
-    import anthropic
-    api_key = get_api_key("ANTHROPIC_API_KEY")
-    if not api_key:
+def _claude_required():
+    client = _claude()
+    if client is None:
         raise ValueError("未配置 ANTHROPIC_API_KEY，请联系管理员")
-    client = anthropic.Anthropic(api_key=api_key)
-    system = industry["system_prompt"] + f"\n\n目标城市：{city}"
-    if content_strategy:
-        strategy_text = json.dumps(content_strategy, ensure_ascii=False)
-        system += (
-            f"\n\n【内容策略指导】\n"
-            f"请严格按照以下策略改写：\n{strategy_text}\n"
-            f"改写时必须体现策略中的切入角度和差异化卖点。"
-        )
-    resp = client.messages.create(
+    return client
+
+
+def _claude_text(site: str, system: str, user: str, temperature: float,
+                 usage: dict | None = None, cache: bool = False) -> str:
+    """参数同 _deepseek_text"""
+    client = _claude_required()
+    request = {
+        "model": "claude-sonnet-4-20250514",
+        "max_tokens": 2000,
+        "system": system,
+        "messages": [
+            {"role": "user", "content": user},
+        ],
+        "temperature": temperature,
+    }
+    if usage is not None:
+        usage["tokens"] = 0
+
+    def _call():
+        resp = client.messages.create(**request)
+        if usage is not None and resp.usage:
+            usage["tokens"] = resp.usage.input_tokens + resp.usage.output_tokens
+        return resp.content[0].text
+
+    return _cached_completion(site, "anthropic", request, _call, cache)
+
+
+def _claude_stream(system: str, user: str, temperature: float):
+    """逐段 yield 生成的文本；退出 with 时关闭响应"""
+    with _claude_required().messages.stream(
         model="claude-sonnet-4-20250514",
         max_tokens=2000,
         system=system,
         messages=[
-            {"role": "user", "content": f"原标题：{title}\n\n原正文：{text}"},
+            {"role": "user", "content": user},
         ],
-        temperature=0.8,
-    )
-    return resp.content[0].text
+        temperature=temperature,
+    ) as stream:
+        yield from stream.text_stream
 
 
-def generate_original_with_claude(store_profile: dict, brief: str, industry: dict, city: str) -> str:
+def rewrite_with_claude(title: str, text: str, industry: dict, city: str,
+                        content_strategy: dict | None = None, cache: bool = False) -> str:
+    """企业版 Mode A：调用 Claude 改写竞品文案；cache 同 rewrite_with_deepseek"""
+    system, user = _rewrite_prompt(title, text, industry, city, content_strategy)
+    return _claude_text("rewrite", system, user, temperature=0.8, cache=cache)
+
+
+def stream_rewrite_with_claude(title: str, text: str, industry: dict, city: str,
+                               content_strategy: dict | None = None):
+    """企业版 Mode A 流式版：逐段 yield 改写文本"""
+    system, user = _rewrite_prompt(title, text, industry, city, content_strategy)
+    yield from _claude_stream(system, user, temperature=0.8)
+
+
+def generate_original_with_claude(store_profile: dict, brief: str, industry: dict, city: str,
+                                  cache: bool = False) -> str:
     """企业版 Mode B：调用 Claude 根据店铺信息生成原创文案"""
-    import anthropic
-    api_key = get_api_key("ANTHROPIC_API_KEY")
-    if not api_key:
-        raise ValueError("未配置 ANTHROPIC_API_KEY，请联系管理员")
-    client = anthropic.Anthropic(api_key=api_key)
+    system, user = _create_prompt(store_profile, brief, industry, city)
+    return _claude_text("create", system, user, temperature=0.85, cache=cache)
 
-    lines = []
-    for field in industry.get("profile_fields", []):
-        val = store_profile.get(field["key"], "").strip()
-        if val:
-            lines.append(f"{field['label']}：{val}")
-    store_info = "\n".join(lines) if lines else "（未填写店铺信息）"
 
-    system = industry["create_system_prompt"] + f"\n\n目标城市：{city}"
-    user_content = f"店铺信息：\n{store_info}\n\n今日发帖主题：{brief}"
+def stream_generate_original_with_claude(store_profile: dict, brief: str, industry: dict, city: str):
+    """企业版 Mode B 流式版：逐段 yield 原创文本"""
+    system, user = _create_prompt(store_profile, brief, industry, city)
+    yield from _claude_stream(system, user, temperature=0.85)
 
-    resp = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=2000,
-        system=system,
-        messages=[
-            {"role": "user", "content": user_content},
-        ],
-        temperature=0.85,
-    )
-    return resp.content[0].text
+
+# ═══════════════════════════════════════════════════════
+#  批量改写
+# ═══════════════════════════════════════════════════════
+
+class _ProviderLimit:
+    """单个服务商的限流：并发槽位 + 每分钟 token 额度（滑动 60 秒窗口）"""
+
+    def __init__(self, concurrency: int, tpm: int):
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._tpm = tpm
+        self._window: deque = deque()   # [预占时间, token 数]
+        self._cond = threading.Condition()
+
+    def _reserve(self, estimate: int) -> list:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._window and now - self._window[0][0] >= 60:
+                    self._window.popleft()
+                used = sum(tokens for _, tokens in self._window)
+                # 窗口为空时总要放行，单个超大请求不至于永远排不上
+                if not self._window or used + estimate <= self._tpm:
+                    entry = [now, estimate]
+                    self._window.append(entry)
+                    return entry
+                self._cond.wait(timeout=self._window[0][0] + 60 - now)
+
+    @contextmanager
+    def slot(self, estimate: int):
+        """占一个并发槽位并预占 estimate 个 token；yield 的 dict 里写入实际用量后按实际值结算"""
+        with self._slots:
+            entry = self._reserve(estimate)
+            usage = {"tokens": estimate}
+            try:
+                yield usage
+            finally:
+                with self._cond:
+                    entry[1] = usage["tokens"]
+                    self._cond.notify_all()
+
+
+_provider_limits = {
+    name: _ProviderLimit(LLM_BATCH_CONCURRENCY[name], LLM_BATCH_TPM[name])
+    for name in LLM_BATCH_CONCURRENCY
+}
+
+
+def rewrite_batch(notes: list, industry: dict, city: str, use_claude: bool = False,
+                  progress_callback=None, cache: bool = False) -> list:
+    """并发改写多条笔记（notes 每项含 "title"、"text"），受 _provider_limits 限流。
+    返回与 notes 顺序一致的 [{"rewrite": str, "error": Exception | None}, ...]，
+    单条失败不影响其它条；progress_callback(idx, item, done, total) 在每条完成时于调用线程中触发"""
+    n = len(notes)
+    if not n:
+        return []
+    provider = "anthropic" if use_claude else "deepseek"
+    limit = _provider_limits[provider]
+    complete = _claude_text if use_claude else _deepseek_text
+
+    def _one(note: dict) -> str:
+        system, user = _rewrite_prompt(note["title"], note["text"], industry, city)
+        with limit.slot(len(system) + len(user) + 2000) as usage:
+            return complete("rewrite", system, user, temperature=0.8, usage=usage, cache=cache)
+
+    results: list = [None] * n
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(n, LLM_BATCH_CONCURRENCY[provider]), thread_name_prefix="llm-batch",
+    ) as pool:
+        futures = {pool.submit(_one, note): i for i, note in enumerate(notes)}
+        for done, fut in enumerate(concurrent.futures.as_completed(futures), 1):
+            idx = futures[fut]
+            try:
+                results[idx] = {"rewrite": fut.result(), "error": None}
+            except Exception as e:
+                results[idx] = {"rewrite": "", "error": e}
+            if progress_callback:
+                progress_callback(idx, results[idx], done, n)
+    return results
 
 
 # ═══════════════════════════════════════════════════════
 #  三步链式生成 + AI 润色
 # ═══════════════════════════════════════════════════════
 
-def analyze_competitor(note_title: str, note_text: str, use_claude: bool = False) -> dict | None:
-    """Step 1: 分析竞品笔记的爆款元素，返回分析 dict 或 None"""
-    content = f"标题：{note_title}\n\n正文：{note_text}"
-    prompt = ANALYZE_PROMPT.format(note_content=content)
-
+def _json_request(prompt: str, temperature: float, max_tokens: int, use_claude: bool) -> tuple:
+    """JSON 步骤发给 SDK 的 (服务商, 请求参数)，也是响应缓存的键"""
+    if use_claude:
+        return "anthropic", {
+            "model": "claude-sonnet-4-20250514",
+            "max_tokens": max_tokens,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+        }
+    return "deepseek", {
+        "model": "deepseek-chat",
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "response_format": {"type": "json_object"},
+    }
+
+
+def _json_step(site: str, prompt: str, temperature: float, max_tokens: int,
+               use_claude: bool, cache: bool, valid=None) -> dict | None:
+    """单条提示词 → JSON 结果；cache 时只缓存能解析出 JSON（且通过 valid 校验）的响应"""
+    provider, request = _json_request(prompt, temperature, max_tokens, use_claude)
     if use_claude:
-        import anthropic
-        api_key = get_api_key("ANTHROPIC_API_KEY")
-        if not api_key:
+        client = _claude()
+        if client is None:
             return None
-        client = anthropic.Anthropic(api_key=api_key)
-        resp = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1000,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-        )
-        raw = resp.content[0].text
+
+        def _call():
+            return client.messages.create(**request).content[0].text
     else:
-        from openai import OpenAI
-        api_key = get_api_key("DEEPSEEK_API_KEY")
-        client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
-        resp = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-            max_tokens=1000,
-            response_format={"type": "json_object"},
-        )
-        raw = resp.choices[0].message.content
+        client = _deepseek()
 
+        def _call():
+            return client.chat.completions.create(**request).choices[0].message.content
+
+    def _ok(text: str) -> bool:
+        data = parse_ai_json(text)
+        return data is not None and (valid is None or valid(data))
+
+    raw = _cached_completion(site, provider, request, _call, cache, valid=_ok)
     return parse_ai_json(raw)
 
 
+def _store_section(store_profile: dict | None) -> str:
+    if not store_profile:
+        return ""
+    label_map = {"store_name": "名称", "core_selling_points": "核心卖点", "target_audience": "目标客群"}
+    parts = []
+    for key in ("store_name", "core_selling_points", "target_audience"):
+        val = store_profile.get(key, "").strip()
+        if val:
+            parts.append(f"- {label_map.get(key, key)}：{val}")
+    return "店铺信息：\n" + "\n".join(parts) if parts else ""
+
+
+def _extra_section(extra_requirements: str) -> str:
+    return f"补充要求：{extra_requirements}" if extra_requirements.strip() else ""
+
+
+_ANALYZE_PARAMS = (0.3, 1000)   # 竞品分析的 (temperature, max_tokens)，合并模式写回分析缓存时要一致
+
+
+def _note_content(note_title: str, note_text: str) -> str:
+    return f"标题：{note_title}\n\n正文：{note_text}"
+
+
+def analyze_competitor(note_title: str, note_text: str, use_claude: bool = False,
+                       cache: bool = True) -> dict | None:
+    """Step 1: 分析竞品笔记的爆款元素，返回分析 dict 或 None。
+    默认走响应缓存：同一篇笔记换语气重新生成时直接复用上次的分析"""
+    prompt = ANALYZE_PROMPT.format(note_content=_note_content(note_title, note_text))
+    return _json_step("analyze", prompt, *_ANALYZE_PARAMS, use_claude, cache)
+
+
 def plan_content_strategy(analysis: dict, store_profile: dict | None,
                           post_goal: str, tone_style: str,
                           extra_requirements: str = "",
-                          use_claude: bool = False) -> dict | None:
-    """Step 2: 基于竞品分析制定差异化内容策略"""
-    store_section = ""
-    if store_profile:
-        parts = []
-        for key in ("store_name", "core_selling_points", "target_audience"):
-            val = store_profile.get(key, "").strip()
-            if val:
-                label_map = {"store_name": "名称", "core_selling_points": "核心卖点",
-                             "target_audience": "目标客群"}
-                parts.append(f"- {label_map.get(key, key)}：{val}")
-        if parts:
-            store_section = "店铺信息：\n" + "\n".join(parts)
-
-    extra_section = f"补充要求：{extra_requirements}" if extra_requirements.strip() else ""
-
+                          use_claude: bool = False, cache: bool = True) -> dict | None:
+    """Step 2: 基于竞品分析制定差异化内容策略（默认走响应缓存）"""
     prompt = STRATEGY_PROMPT.format(
         analysis_json=json.dumps(analysis, ensure_ascii=False),
-        store_section=store_section,
+        store_section=_store_section(store_profile),
         post_goal=post_goal,
         tone_style=tone_style,
-        extra_requirements_section=extra_section,
+        extra_requirements_section=_extra_section(extra_requirements),
     )
+    return _json_step("strategy", prompt, 0.4, 1000, use_claude, cache)
 
-    if use_claude:
-        import anthropic
-        api_key = get_api_key("ANTHROPIC_API_KEY")
-        if not api_key:
-            return None
-        client = anthropic.Anthropic(api_key=api_key)
-        resp = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1000,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.4,
-        )
-        raw = resp.content[0].text
-    else:
-        from openai import OpenAI
-        api_key = get_api_key("DEEPSEEK_API_KEY")
-        client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
-        resp = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.4,
-            max_tokens=1000,
-            response_format={"type": "json_object"},
-        )
-        raw = resp.choices[0].message.content
 
-    return parse_ai_json(raw)
+def _is_fused_result(data: dict) -> bool:
+    return (isinstance(data.get("analysis"), dict) and isinstance(data.get("strategy"), dict)
+            and bool(data["strategy"].get("angle")))
 
 
-def polish_content(title: str, body: str, tone_style: str,
-                   use_claude: bool = False) -> dict | None:
-    """AI 润色：保留用户修改意图，优化小红书风格表达"""
-    prompt = POLISH_PROMPT.format(title=title, body=body, tone_style=tone_style)
+def analyze_and_plan(note_title: str, note_text: str, store_profile: dict | None,
+                     post_goal: str, tone_style: str, extra_requirements: str = "",
+                     use_claude: bool = False, cache: bool = True) -> tuple:
+    """合并模式：一次调用同时返回竞品分析和内容策略，返回 (analysis | None, strategy | None, 实际模式)。
+    - 这篇笔记已有缓存的分析（只换了语气 / 目标）：只调一次策略，模式记为 fused_cached
+    - 冷启动：合并调用，分析部分同时写入 analyze_competitor 的缓存键，模式记为 fused
+    - 合并结果缺字段或解析失败：退回分步两次调用，模式记为 fused_fallback"""
+    content = _note_content(note_title, note_text)
 
-    if use_claude:
-        import anthropic
-        api_key = get_api_key("ANTHROPIC_API_KEY")
-        if not api_key:
-            return None
-        client = anthropic.Anthropic(api_key=api_key)
-        resp = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.6,
-        )
-        raw = resp.content[0].text
-    else:
-        from openai import OpenAI
-        api_key = get_api_key("DEEPSEEK_API_KEY")
-        client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
-        resp = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.6,
-            max_tokens=2000,
-            response_format={"type": "json_object"},
-        )
-        raw = resp.choices[0].message.content
+    def _plan(analysis: dict, mode: str) -> tuple:
+        try:
+            strategy = plan_content_strategy(analysis, store_profile, post_goal, tone_style,
+                                             extra_requirements, use_claude=use_claude, cache=cache)
+        except Exception:
+            strategy = None  # 与分步模式一致：策略失败时只带分析结果往下走
+        return analysis, strategy, mode
 
-    return parse_ai_json(raw)
+    analyze_provider, analyze_request = _json_request(
+        ANALYZE_PROMPT.format(note_content=content), *_ANALYZE_PARAMS, use_claude,
+    )
+    if cache:
+        cached = _lookup_llm_cache("analyze", analyze_provider, analyze_request)
+        analysis = parse_ai_json(cached) if cached else None
+        if analysis:
+            return _plan(analysis, "fused_cached")
+
+    prompt = ANALYZE_STRATEGY_PROMPT.format(
+        note_content=content,
+        store_section=_store_section(store_profile),
+        post_goal=post_goal,
+        tone_style=tone_style,
+        extra_requirements_section=_extra_section(extra_requirements),
+    )
+    try:
+        data = _json_step("analyze_plan", prompt, 0.4, 2000, use_claude, cache, valid=_is_fused_result)
+    except Exception:
+        data = None
+    if data and _is_fused_result(data):
+        if cache:
+            save_llm_cache(_llm_cache_key(analyze_provider, analyze_request), analyze_provider,
+                           analyze_request["model"], json.dumps(data["analysis"], ensure_ascii=False),
+                           LLM_CACHE_TTL)
+        return data["analysis"], data["strategy"], "fused"
+
+    analysis = analyze_competitor(note_title, note_text, use_claude=use_claude, cache=cache)
+    if not analysis:
+        return None, None, "fused_fallback"
+    return _plan(analysis, "fused_fallback")
+
+
+def choose_chain_mode(invite_code: str) -> str:
+    """按邀请码哈希分桶，返回 "fused" 或 "split"；同一用户结果固定"""
+    bucket = int(hashlib.sha256(invite_code.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return "fused" if bucket < CHAIN_FUSED_RATIO else "split"
+
+
+def polish_content(title: str, body: str, tone_style: str,
+                   use_claude: bool = False, cache: bool = False) -> dict | None:
+    """AI 润色：保留用户修改意图，优化小红书风格表达。
+    再次点击润色通常是想换个说法，默认不走缓存"""
+    prompt = POLISH_PROMPT.format(title=title, body=body, tone_style=tone_style)
+    return _json_step("polish", prompt, 0.6, 2000, use_claude, cache)
 
 
 def generate_dynamic_image_prompt(copy_text: str, industry: dict) -> str:
     """Mode B：根据已生成的文案，动态生成 Gemini 图片处理提示词"""
-    from openai import OpenAI
-    api_key = get_api_key("DEEPSEEK_API_KEY")
-    client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
+    client = _deepseek()
 
     system = (
         "You are an expert at writing Gemini image editing prompts for social media content.\n"
@@ -536,18 +1472,16 @@ def _build_scene_system_prompt(industry: dict, is_pro: bool) -> str:
 
 def generate_scene_nano_banana(copy_text: str, industry: dict) -> tuple:
     """体验版/达人版：Imagen 4 Fast 文生图（9:16竖图）
-    返回 (images: list[PIL.Image], scene_prompt: str, error_msg: str)
+    返回 (images: list[PIL.Image], scene_prompt: str, error_msg: str)，图片已写入图片存储（info["blob"]）
     """
-    from openai import OpenAI
     try:
-        from google import genai
         from google.genai import types
     except ImportError:
         return [], "", "请先安装 google-genai 库"
 
     # Step 1: DeepSeek 生成英文场景描述
     try:
-        ds_client = OpenAI(api_key=get_api_key("DEEPSEEK_API_KEY"), base_url="https://api.deepseek.com")
+        ds_client = _deepseek()
         ds_resp = ds_client.chat.completions.create(
             model="deepseek-chat",
             messages=[
@@ -566,7 +1500,7 @@ def generate_scene_nano_banana(copy_text: str, industry: dict) -> tuple:
     if not gai_key:
         return [], scene_prompt, "未配置 Google API Key"
 
-    g_client = genai.Client(api_key=gai_key)
+    g_client = _llm_clients.get("gemini", gai_key)
     images = []
     last_err = ""
     try:
@@ -580,7 +1514,7 @@ def generate_scene_nano_banana(copy_text: str, industry: dict) -> tuple:
             ),
         )
         for gen_img in response.generated_images:
-            images.append(Image.open(io.BytesIO(gen_img.image.image_bytes)).convert("RGB"))
+            images.append(_store_image_bytes(gen_img.image.image_bytes))
     except Exception as e:
         err = str(e)
         if "quota" in err.lower() or "429" in err:
@@ -597,18 +1531,16 @@ def generate_scene_nano_banana(copy_text: str, industry: dict) -> tuple:
 
 def generate_scene_with_imagen4(copy_text: str, industry: dict) -> tuple:
     """商家版：Imagen 4 Ultra 文生图（9:16竖图，最高画质，消耗Pro配额）
-    返回 (images: list[PIL.Image], scene_prompt: str, error_msg: str)
+    返回 (images: list[PIL.Image], scene_prompt: str, error_msg: str)，图片已写入图片存储（info["blob"]）
     """
-    from openai import OpenAI
     try:
-        from google import genai
         from google.genai import types
     except ImportError:
         return [], "", "请先安装 google-genai 库"
 
     # Step 1: DeepSeek 生成英文场景描述（Pro风格提示词）
     try:
-        ds_client = OpenAI(api_key=get_api_key("DEEPSEEK_API_KEY"), base_url="https://api.deepseek.com")
+        ds_client = _deepseek()
         ds_resp = ds_client.chat.completions.create(
             model="deepseek-chat",
             messages=[
@@ -627,7 +1559,7 @@ def generate_scene_with_imagen4(copy_text: str, industry: dict) -> tuple:
     if not gai_key:
         return [], scene_prompt, "未配置 Google API Key"
 
-    g_client = genai.Client(api_key=gai_key)
+    g_client = _llm_clients.get("gemini", gai_key)
     images = []
     last_err = ""
     try:
@@ -641,7 +1573,7 @@ def generate_scene_with_imagen4(copy_text: str, industry: dict) -> tuple:
             ),
         )
         for gen_img in response.generated_images:
-            images.append(Image.open(io.BytesIO(gen_img.image.image_bytes)).convert("RGB"))
+            images.append(_store_image_bytes(gen_img.image.image_bytes))
     except Exception as e:
         err = str(e)
         if "quota" in err.lower() or "429" in err:
@@ -739,9 +1671,8 @@ def remove_watermark_and_protect(image: Image.Image) -> tuple:
 
 
 def edit_image_with_gemini(image: Image.Image, prompt: str):
-    """调用 Gemini 编辑/美化图片，返回 (PIL.Image | None, error_msg)"""
+    """调用 Gemini 编辑/美化图片，返回 (PIL.Image | None, error_msg)；结果写入图片存储（info["blob"]）"""
     try:
-        from google import genai
         from google.genai import types
     except ImportError:
         return None, "请先安装 google-genai 库"
@@ -750,7 +1681,7 @@ def edit_image_with_gemini(image: Image.Image, prompt: str):
     if not api_key:
         return None, "未配置 Google API Key"
 
-    client = genai.Client(api_key=api_key)
+    client = _llm_clients.get("gemini", api_key)
     img_copy = image.copy()
     img_copy.thumbnail((1024, 1024))
     buf = io.BytesIO()
@@ -780,7 +1711,7 @@ def edit_image_with_gemini(image: Image.Image, prompt: str):
                         and part.inline_data
                         and getattr(part.inline_data, "mime_type", "").startswith("image/")
                     ):
-                        return Image.open(io.BytesIO(part.inline_data.data)).convert("RGB"), ""
+                        return _store_image_bytes(part.inline_data.data), ""
             last_error = "图片引擎：返回响应但无图片数据"
         except Exception as e:
             err = str(e)
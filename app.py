@@ -6,9 +6,9 @@
 import streamlit as st
 import re
 import json
+import time
 import pandas as pd
 from datetime import datetime, timedelta
-from PIL import Image
 try:
     from pillow_heif import register_heif_opener
     register_heif_opener()
@@ -18,29 +18,33 @@ except ImportError:
 from config import (
     INDUSTRIES, INDUSTRY_ICONS, ICON_ATTRS, DEFAULTS,
     INDUSTRY_EN_NAMES, INDUSTRY_EMOJIS,
-    PRO_GEN_LIMIT, ADMIN_CODES,
+    PRO_GEN_LIMIT, ADMIN_CODES, ADMIN_LIST_LIMIT,
     TIER_PLANS, PAYMENT_CONTACT_WECHAT,
     POST_GOALS, TONE_STYLES,
 )
 from utils import (
     init_db, log_event, save_generation, get_history, get_db,
+    admin_query, admin_scalar, invalidate_admin_cache, ADMIN_SQL,
     friendly_api_error, img_cols,
     get_pro_used, has_pro_quota,
-    add_pro_quota, get_user_tier,
+    add_pro_quota, get_account_snapshot,
     check_invite_code, validate_phone, register_or_login, get_all_users,
     make_zip, make_batch_zip,
     save_store_profile, load_store_profile,
-    try_use_pro_quota, refund_pro_quota,
+    reserve_pro_quota, refund_pro_quota,
+    put_image, put_image_bytes, load_image,
 )
 from api import (
-    try_extract_xhs, download_image_url,
-    rewrite_with_deepseek, generate_original_content,
-    rewrite_with_claude, generate_original_with_claude,
+    extract_batch,
+    rewrite_batch,
+    stream_rewrite_with_deepseek, stream_generate_original_content,
+    stream_rewrite_with_claude, stream_generate_original_with_claude,
     generate_dynamic_image_prompt,
     edit_image_with_gemini,
     remove_watermark_and_protect,
     stealth_anti_hash,
     analyze_competitor, plan_content_strategy, polish_content,
+    analyze_and_plan, choose_chain_mode,
 )
 
 
@@ -80,35 +84,18 @@ def render_admin_panel():
     )
 
     # ── 指标卡片 ──
-    conn = None
     try:
-        conn = get_db()
         _today = datetime.now().strftime("%Y-%m-%d")
         _7days_ago = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
 
-        total_users = conn.execute(
-            "SELECT COUNT(DISTINCT invite_code) FROM event_log"
-        ).fetchone()[0]
-        total_gens = conn.execute(
-            "SELECT COUNT(*) FROM generation_history"
-        ).fetchone()[0]
-        today_gens = conn.execute(
-            "SELECT COUNT(*) FROM generation_history WHERE created_at >= ?",
-            (_today,)
-        ).fetchone()[0]
-        week_gens = conn.execute(
-            "SELECT COUNT(*) FROM generation_history WHERE created_at >= ?",
-            (_7days_ago,)
-        ).fetchone()[0]
-        total_feedbacks = conn.execute(
-            "SELECT COUNT(*) FROM feedback"
-        ).fetchone()[0]
-        extract_total = conn.execute(
-            "SELECT COUNT(*) FROM event_log WHERE event_type = 'extract_link'"
-        ).fetchone()[0]
-        extract_ok = conn.execute(
-            "SELECT COUNT(*) FROM event_log WHERE event_type = 'extract_link' AND success = 1"
-        ).fetchone()[0]
+        # 统计数据读汇总表（gen_*_rollup / event_*），由插入触发器增量维护
+        total_users = admin_scalar("metrics", ADMIN_SQL["total_users"])
+        total_gens = admin_scalar("metrics", ADMIN_SQL["total_gens"])
+        today_gens = admin_scalar("metrics", ADMIN_SQL["gens_since"], (_today,))
+        week_gens = admin_scalar("metrics", ADMIN_SQL["gens_since"], (_7days_ago,))
+        total_feedbacks = admin_scalar("metrics", ADMIN_SQL["feedback_count"])
+        extract_total = admin_scalar("metrics", ADMIN_SQL["extract_total"])
+        extract_ok = admin_scalar("metrics", ADMIN_SQL["extract_ok"])
         extract_rate = f"{extract_ok / extract_total * 100:.0f}%" if extract_total > 0 else "—"
 
         row1 = (
@@ -136,12 +123,7 @@ def render_admin_panel():
             unsafe_allow_html=True,
         )
         _30days_ago = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
-        daily_rows = conn.execute(
-            "SELECT DATE(created_at) as day, COUNT(*) as cnt "
-            "FROM generation_history WHERE created_at >= ? "
-            "GROUP BY DATE(created_at) ORDER BY day",
-            (_30days_ago,)
-        ).fetchall()
+        daily_rows = admin_query("trend", ADMIN_SQL["daily_trend"], (_30days_ago,))
         if daily_rows:
             df_daily = pd.DataFrame([dict(r) for r in daily_rows])
             df_daily.columns = ["日期", "生成次数"]
@@ -184,10 +166,7 @@ def render_admin_panel():
 
         # ── 预查询：会员配额（Tab 1 和 Tab 3 共用） ──
         _tier_labels = {k: v["name"] for k, v in TIER_PLANS.items()}
-        quota_rows = conn.execute(
-            "SELECT invite_code, pro_gen_used, tier, updated_at "
-            "FROM quota_usage ORDER BY pro_gen_used DESC"
-        ).fetchall()
+        quota_rows = admin_query("quota", ADMIN_SQL["quota_list"])
         df_quota = None
         if quota_rows:
             df_quota = pd.DataFrame([
@@ -229,7 +208,11 @@ def render_admin_panel():
                     for u in all_users
                 ])
                 st.dataframe(df_reg, use_container_width=True, hide_index=True)
-                st.caption(f"共 {len(all_users)} 个注册用户")
+                _reg_total = admin_scalar("users", ADMIN_SQL["registered_users"]) or len(all_users)
+                if _reg_total > len(all_users):
+                    st.caption(f"共 {_reg_total} 个注册用户（显示最近登录的 {len(all_users)} 个）")
+                else:
+                    st.caption(f"共 {_reg_total} 个注册用户")
             else:
                 st.caption("暂无注册用户")
 
@@ -239,16 +222,7 @@ def render_admin_panel():
                 '<div style="font-size:11px;color:#86868b;margin-bottom:8px;">User Activity Ranking</div>',
                 unsafe_allow_html=True,
             )
-            user_rows = conn.execute(
-                "SELECT g.invite_code, COUNT(*) as gen_count, "
-                "MAX(g.created_at) as last_active, "
-                "COUNT(DISTINCT g.industry_id) as industry_count, "
-                "COALESCE(u.phone, '—') as phone "
-                "FROM generation_history g "
-                "LEFT JOIN users u ON g.invite_code = u.invite_code "
-                "GROUP BY g.invite_code "
-                "ORDER BY gen_count DESC LIMIT 20"
-            ).fetchall()
+            user_rows = admin_query("users", ADMIN_SQL["user_ranking"])
             if user_rows:
                 df_users = pd.DataFrame([
                     {
@@ -272,6 +246,8 @@ def render_admin_panel():
             )
             if df_quota is not None:
                 st.dataframe(df_quota, use_container_width=True, hide_index=True)
+                if len(quota_rows) >= ADMIN_LIST_LIMIT:
+                    st.caption(f"仅显示已用次数最多的 {ADMIN_LIST_LIMIT} 个邀请码")
             else:
                 st.caption("暂无数据")
 
@@ -282,10 +258,7 @@ def render_admin_panel():
                 '<div style="font-size:11px;color:#86868b;margin-bottom:8px;">Industry Popularity</div>',
                 unsafe_allow_html=True,
             )
-            industry_rows = conn.execute(
-                "SELECT industry_id, COUNT(*) as cnt FROM generation_history "
-                "GROUP BY industry_id ORDER BY cnt DESC"
-            ).fetchall()
+            industry_rows = admin_query("industry", ADMIN_SQL["industry"])
             if industry_rows:
                 labels = []
                 counts = []
@@ -305,9 +278,7 @@ def render_admin_panel():
                     '<div style="font-size:11px;color:#86868b;margin-bottom:8px;">Mode Distribution</div>',
                     unsafe_allow_html=True,
                 )
-                mode_rows = conn.execute(
-                    "SELECT mode, COUNT(*) as cnt FROM generation_history GROUP BY mode"
-                ).fetchall()
+                mode_rows = admin_query("industry", ADMIN_SQL["mode"])
                 if mode_rows:
                     mode_map = {"rewrite": "竞品参考", "original": "原创生成"}
                     df_mode = pd.DataFrame([
@@ -324,10 +295,7 @@ def render_admin_panel():
                     '<div style="font-size:11px;color:#86868b;margin-bottom:8px;">Image Tier</div>',
                     unsafe_allow_html=True,
                 )
-                tier_rows = conn.execute(
-                    "SELECT image_tier, COUNT(*) as cnt FROM generation_history "
-                    "WHERE image_tier != '' GROUP BY image_tier ORDER BY cnt DESC"
-                ).fetchall()
+                tier_rows = admin_query("industry", ADMIN_SQL["image_tier"])
                 if tier_rows:
                     tier_map = {"free": "免费", "pro": "Pro"}
                     df_tier = pd.DataFrame([
@@ -344,35 +312,16 @@ def render_admin_panel():
                 '<div style="font-size:11px;color:#86868b;margin-bottom:8px;">Custom Industry Usage</div>',
                 unsafe_allow_html=True,
             )
-            custom_rows = conn.execute(
-                "SELECT input_profile, COUNT(*) as cnt, MAX(created_at) as last_used "
-                "FROM generation_history WHERE industry_id = 'custom' AND input_profile != '' "
-                "GROUP BY input_profile ORDER BY cnt DESC"
-            ).fetchall()
+            custom_rows = admin_query("industry", ADMIN_SQL["custom_industry"])
             if custom_rows:
-                _custom_data = []
-                for cr in custom_rows:
-                    try:
-                        _prof = json.loads(cr["input_profile"])
-                        _ind_name = _prof.get("industry_name", "未填写")
-                    except (json.JSONDecodeError, TypeError):
-                        _ind_name = "未填写"
-                    _custom_data.append({
-                        "行业名称": _ind_name,
+                df_custom = pd.DataFrame([
+                    {
+                        "行业名称": cr["industry_name"],
                         "使用次数": cr["cnt"],
                         "最近使用": cr["last_used"][:16] if cr["last_used"] else "—",
-                    })
-                _merged = {}
-                for d in _custom_data:
-                    name = d["行业名称"]
-                    if name in _merged:
-                        _merged[name]["使用次数"] += d["使用次数"]
-                        if d["最近使用"] > _merged[name]["最近使用"]:
-                            _merged[name]["最近使用"] = d["最近使用"]
-                    else:
-                        _merged[name] = d
-                df_custom = pd.DataFrame(list(_merged.values()))
-                df_custom = df_custom.sort_values("使用次数", ascending=False).reset_index(drop=True)
+                    }
+                    for cr in custom_rows
+                ])
                 st.dataframe(df_custom, use_container_width=True, hide_index=True)
             else:
                 st.caption("暂无自定义行业使用记录")
@@ -432,6 +381,8 @@ def render_admin_panel():
             )
             if df_quota is not None:
                 st.dataframe(df_quota, use_container_width=True, hide_index=True)
+                if len(quota_rows) >= ADMIN_LIST_LIMIT:
+                    st.caption(f"仅显示已用次数最多的 {ADMIN_LIST_LIMIT} 个邀请码")
             else:
                 st.caption("暂无数据")
 
@@ -442,9 +393,7 @@ def render_admin_panel():
                 '<div style="font-size:11px;color:#86868b;margin-bottom:8px;">Recent Feedback</div>',
                 unsafe_allow_html=True,
             )
-            recent_fb = conn.execute(
-                "SELECT * FROM feedback ORDER BY created_at DESC LIMIT 15"
-            ).fetchall()
+            recent_fb = admin_query("feedback", ADMIN_SQL["recent_feedback"])
             if recent_fb:
                 df_fb = pd.DataFrame([
                     {
@@ -467,12 +416,7 @@ def render_admin_panel():
                 '<div style="font-size:11px;color:#86868b;margin-bottom:8px;">Event Log</div>',
                 unsafe_allow_html=True,
             )
-            event_rows = conn.execute(
-                "SELECT e.*, COALESCE(u.phone, '—') as phone "
-                "FROM event_log e "
-                "LEFT JOIN users u ON e.invite_code = u.invite_code "
-                "ORDER BY e.created_at DESC LIMIT 50"
-            ).fetchall()
+            event_rows = admin_query("logs", ADMIN_SQL["recent_events"])
             if event_rows:
                 df_events = pd.DataFrame([
                     {
@@ -496,10 +440,7 @@ def render_admin_panel():
                 '<div style="font-size:11px;color:#86868b;margin-bottom:8px;">Hourly Activity</div>',
                 unsafe_allow_html=True,
             )
-            hourly_rows = conn.execute(
-                "SELECT CAST(strftime('%H', created_at) AS INTEGER) as hour, COUNT(*) as cnt "
-                "FROM generation_history GROUP BY hour ORDER BY hour"
-            ).fetchall()
+            hourly_rows = admin_query("logs", ADMIN_SQL["hourly"])
             if hourly_rows:
                 hour_data = {r["hour"]: r["cnt"] for r in hourly_rows}
                 df_hour = pd.DataFrame([
@@ -512,9 +453,6 @@ def render_admin_panel():
 
     except Exception as e:
         st.error(f"数据库读取失败：{e}")
-    finally:
-        if conn:
-            conn.close()
 
 
 def render_progress_bar(steps: list[str], current_step: int):
@@ -584,6 +522,51 @@ def render_continue_button(next_step_name: str, button_key: str):
     )
 
 
+def render_text_stream(placeholder, chunks, interval: float = 0.05) -> str:
+    """把流式生成的文本逐段渲染到 placeholder（与结果区同样的代码块样式），返回完整文本。
+    按 interval 节流刷新，避免每个 token 都触发一次前端重绘。"""
+    text, last = "", 0.0
+    for chunk in chunks:
+        text += chunk
+        now = time.monotonic()
+        if now - last >= interval:
+            placeholder.code(text + "▌", language=None)
+            last = now
+    placeholder.code(text, language=None)
+    return text
+
+
+def store_uploaded_images(files) -> list[str]:
+    """上传的图片按原始字节存入图片存储，返回 digest 列表（解析失败的跳过）"""
+    digests = []
+    for f in files:
+        digest = put_image_bytes(f.getvalue())
+        if digest:
+            digests.append(digest)
+    return digests
+
+
+def store_image(img) -> str | None:
+    """处理后的图片写入图片存储，返回 digest；None（处理失败）原样返回"""
+    if img is None:
+        return None
+    return img.info.get("blob") or put_image(img) or None
+
+
+def load_images(digests) -> list:
+    """按 digest 从图片存储读出图片（session_state 只存 digest）。
+    返回与 digests 等长的列表：失败（None）或已失效的位置为 None，下标与原图一一对应"""
+    return [load_image(d) if d else None for d in digests]
+
+
+def render_image(img, caption: str):
+    """显示一张图；已从图片存储失效的给出提示"""
+    if img is None:
+        st.caption(f"{caption}：图片已失效，请重新上传或提取")
+    else:
+        st.image(img, caption=caption, use_container_width=True)
+
+
 st.set_page_config(
     page_title="小红书内容Agent",
     page_icon="📱",
@@ -1330,10 +1313,9 @@ with st.sidebar:
 
     # 会员额度显示
     _code = st.session_state.invite_code
-    _user_tier_now = get_user_tier(_code)
-    _tier_label_now = TIER_PLANS.get(_user_tier_now, TIER_PLANS["free"])["name"]
-    _pro_used = get_pro_used(_code)
-    _pro_left = PRO_GEN_LIMIT - _pro_used
+    _account = get_account_snapshot(_code)
+    _tier_label_now = _account["plan"]["name"]
+    _pro_left = _account["remaining"]
     st.markdown(f"**💎 {_tier_label_now}** · 配图额度")
     if _pro_left > 10:
         st.success(f"剩余 **{_pro_left}** 次")
@@ -1442,6 +1424,7 @@ with st.sidebar:
                          st.session_state.get("industry_id", ""), "sidebar"),
                     )
                     _fb_conn.commit()
+                    invalidate_admin_cache("feedback", "metrics")
                 except Exception:
                     pass
                 finally:
@@ -1825,32 +1808,24 @@ if mode == "rewrite":
             batch = []
             all_logs = []
 
-            for idx, raw_url in enumerate(urls):
-                base_pct = idx / len(urls)
-                step_pct = 1.0 / len(urls)
-
-                def _cb(pct, msg):
-                    prog.progress(min(base_pct + pct * step_pct * 0.7, 0.99),
-                                  text=f"[{idx+1}/{len(urls)}] {msg}")
-
-                title, text, img_urls, logs = try_extract_xhs(raw_url, _cb)
-                all_logs.append(f"── 第 {idx+1} 条 ──\n" + "\n".join(logs))
+            # 多条链接并发提取（按域名限流），结果顺序与输入一致
+            extracted = extract_batch(
+                urls, lambda pct, msg: prog.progress(pct, text=msg),
+            )
 
-                prog.progress(min(base_pct + step_pct * 0.7, 0.99),
-                              text=f"[{idx+1}/{len(urls)}] 下载图片…")
-                downloaded = []
-                for i, u in enumerate(img_urls or []):
-                    im = download_image_url(u)
-                    if im:
-                        downloaded.append(im)
+            for idx, item in enumerate(extracted):
+                raw_url, title, text = item["url"], item["title"], item["text"]
+                all_logs.append(f"── 第 {idx+1} 条 ──\n" + "\n".join(item["logs"]))
+                # session_state 只保存图片 digest，渲染/处理时再从图片存储读出
+                downloaded = [
+                    d for d in (blob or put_image(img)
+                                for img, blob in zip(item["images"], item["image_blobs"]))
+                    if d
+                ]
 
                 # 单条模式：追加用户手动上传的图片
                 if not is_batch and extra_imgs:
-                    for f in extra_imgs:
-                        try:
-                            downloaded.append(Image.open(f).convert("RGB"))
-                        except (OSError, ValueError):
-                            pass
+                    downloaded.extend(store_uploaded_images(extra_imgs))
 
                 batch.append({
                     "url": raw_url,
@@ -1943,13 +1918,7 @@ if mode == "rewrite":
                 if manual_title.strip() or manual_text.strip():
                     st.session_state.note_title = manual_title.strip()
                     st.session_state.note_text = manual_text.strip()
-                    imgs = []
-                    if manual_imgs:
-                        for f in manual_imgs:
-                            try:
-                                imgs.append(Image.open(f).convert("RGB"))
-                            except (OSError, ValueError):
-                                pass
+                    imgs = store_uploaded_images(manual_imgs) if manual_imgs else []
                     st.session_state.note_images = imgs
                     st.session_state.batch_results = [{
                         "url": "",
@@ -1992,15 +1961,14 @@ if mode == "rewrite":
             if st.button("💾 更新内容"):
                 st.session_state.note_title = edit_title.strip()
                 st.session_state.note_text = edit_text.strip()
-                if add_imgs:
-                    new_imgs = [Image.open(f).convert("RGB") for f in add_imgs]
-                    if new_imgs:
-                        st.session_state.note_images = new_imgs
+                new_imgs = store_uploaded_images(add_imgs) if add_imgs else []
+                if new_imgs:
+                    st.session_state.note_images = new_imgs
                 # 同步到 batch_results
                 if st.session_state.batch_results:
                     st.session_state.batch_results[0]["title"] = edit_title.strip()
                     st.session_state.batch_results[0]["text"] = edit_text.strip()
-                    if add_imgs and new_imgs:
+                    if new_imgs:
                         st.session_state.batch_results[0]["images"] = new_imgs
                 st.session_state.rewrite_done = False
                 st.session_state.images_done = False
@@ -2012,11 +1980,12 @@ if mode == "rewrite":
                 st.rerun()
 
             if st.session_state.note_images:
-                _nc = img_cols(len(st.session_state.note_images))
+                _note_imgs = load_images(st.session_state.note_images)
+                _nc = img_cols(len(_note_imgs))
                 _columns = st.columns(_nc)
-                for i, img in enumerate(st.session_state.note_images):
+                for i, img in enumerate(_note_imgs):
                     with _columns[i % _nc]:
-                        st.image(img, caption=f"原图 {i+1}", use_container_width=True)
+                        render_image(img, f"原图 {i+1}")
 
     elif st.session_state.content_ready and _is_batch:
         # 批量模式：用 tabs 展示每条提取结果
@@ -2088,19 +2057,15 @@ else:
         key="create_img_upload",
     )
     if uploaded_imgs:
-        imgs = []
-        for f in uploaded_imgs:
-            try:
-                imgs.append(Image.open(f).convert("RGB"))
-            except (OSError, ValueError):
-                pass
-        if imgs:
-            st.session_state.create_images = imgs
+        digests = store_uploaded_images(uploaded_imgs)
+        if digests:
+            st.session_state.create_images = digests
+            imgs = load_images(digests)
             _nc = img_cols(len(imgs))
             _columns = st.columns(_nc)
             for i, img in enumerate(imgs):
                 with _columns[i % _nc]:
-                    st.image(img, caption=f"图片 {i+1}", use_container_width=True)
+                    render_image(img, f"图片 {i+1}")
 
     if st.button("✅ 确认，开始生成", type="primary"):
         if not brief.strip():
@@ -2251,88 +2216,137 @@ if st.session_state.content_ready:
             st.error("请填写今日主题")
         else:
             with st.status("AI 正在创作…", expanded=True) as _gen_status:
+                # 单条生成的草稿区：文本边生成边显示
+                _draft = st.empty()
                 try:
                     # 检查用户等级，企业版用 Claude
-                    _user_tier = get_user_tier(st.session_state.invite_code)
+                    _user_tier = get_account_snapshot(st.session_state.invite_code)["tier"]
                     _use_claude = (_user_tier == "promax")
                     _brain_name = "高级语言模型" if _use_claude else "语言模型"
-                    _rewrite_fn = rewrite_with_claude if _use_claude else rewrite_with_deepseek
-                    _create_fn = generate_original_with_claude if _use_claude else generate_original_content
+                    _stream_rewrite_fn = stream_rewrite_with_claude if _use_claude else stream_rewrite_with_deepseek
+                    _stream_create_fn = stream_generate_original_with_claude if _use_claude else stream_generate_original_content
 
                     if mode == "rewrite" and _is_batch_mode:
-                        # --- 批量改写 ---
-                        for bi, br in enumerate(_batch):
-                            _gen_status.update(label=f"{_brain_name} 正在改写第 {bi+1}/{len(_batch)} 条…")
-                            result = _rewrite_fn(
-                                br["title"], br["text"], industry, st.session_state.city,
-                            )
-                            br["rewrite"] = result
-                            save_generation(
-                                invite_code=st.session_state.invite_code,
-                                industry_id=st.session_state.industry_id,
-                                mode="rewrite",
-                                input_title=br["title"],
-                                input_text=br["text"],
-                                input_profile="",
-                                output_text=result,
-                                image_count=len(br["images"]),
-                                city=st.session_state.city,
-                            )
+                        # --- 批量改写：并发执行，按服务商限流，每完成一条即保存 ---
+                        _gen_status.update(label=f"{_brain_name} 正在改写 {len(_batch)} 条笔记…")
+
+                        def _on_rewritten(bi, item, done, total):
+                            br = _batch[bi]
+                            br["rewrite"] = item["rewrite"]
+                            br["rewrite_error"] = friendly_api_error(item["error"]) if item["error"] else ""
+                            if item["error"]:
+                                st.write(f"✗ 笔记 {bi+1}：{br['rewrite_error']}")
+                            else:
+                                st.write(f"✓ 笔记 {bi+1} 改写完成")
+                                save_generation(
+                                    invite_code=st.session_state.invite_code,
+                                    industry_id=st.session_state.industry_id,
+                                    mode="rewrite",
+                                    input_title=br["title"],
+                                    input_text=br["text"],
+                                    input_profile="",
+                                    output_text=item["rewrite"],
+                                    image_count=len(br["images"]),
+                                    city=st.session_state.city,
+                                )
+                            _gen_status.update(label=f"{_brain_name} 正在改写：已完成 {done}/{total} 条…")
+
+                        _batch_out = rewrite_batch(
+                            _batch, industry, st.session_state.city,
+                            use_claude=_use_claude, progress_callback=_on_rewritten,
+                        )
+                        _failed = [r for r in _batch_out if r["error"]]
+                        # 兼容：第一条改写成功的结果同步到旧变量，全部失败才清空
+                        st.session_state.rewrite_result = next(
+                            (r["rewrite"] for r in _batch_out if r["rewrite"]), "",
+                        )
+                        if len(_failed) == len(_batch_out):
+                            raise _failed[0]["error"]
                         log_event(st.session_state.invite_code, "generate_text",
                                    st.session_state.industry_id, "rewrite",
-                                   detail=json.dumps({"batch_count": len(_batch), "brain": _brain_name}))
-                        # 兼容：第一条同步到旧变量
-                        st.session_state.rewrite_result = _batch[0]["rewrite"]
+                                   detail=json.dumps({"batch_count": len(_batch), "failed": len(_failed),
+                                                      "brain": _brain_name}))
                     elif mode == "rewrite":
-                        # ── 三步链式生成 ──
+                        # ── 三步链式生成（分析 + 策略可合并为一次调用，按用户分桶）──
                         _step1_ok = False
                         _step2_ok = False
+                        _chain_mode = choose_chain_mode(st.session_state.invite_code)
+                        _chain_t0 = time.monotonic()
+                        _total_steps = 2 if _chain_mode == "fused" else 3
+
+                        # 构建店铺资料
+                        _store_data = None
+                        _sp_name = st.session_state.get("sp_store_name", "").strip()
+                        _sp_selling = st.session_state.get("sp_core_selling", "").strip()
+                        _sp_audience = st.session_state.get("sp_target_audience", "").strip()
+                        if _sp_name or _sp_selling or _sp_audience:
+                            _store_data = {
+                                "store_name": _sp_name,
+                                "core_selling_points": _sp_selling,
+                                "target_audience": _sp_audience,
+                            }
 
-                        # Step 1: 竞品分析
-                        _gen_status.update(label="Step 1/3：分析竞品笔记…")
-                        try:
-                            analysis = analyze_competitor(
-                                st.session_state.note_title,
-                                st.session_state.note_text,
-                                use_claude=_use_claude,
-                            )
-                            if analysis:
-                                st.session_state.competitor_analysis = analysis
-                                _step1_ok = True
-                        except Exception:
-                            pass  # Step1 失败 → 降级为单步
-
-                        # Step 2: 差异化策略
-                        if _step1_ok:
-                            _gen_status.update(label="Step 2/3：制定差异化策略…")
-                            # 构建店铺资料
-                            _store_data = None
-                            _sp_name = st.session_state.get("sp_store_name", "").strip()
-                            _sp_selling = st.session_state.get("sp_core_selling", "").strip()
-                            _sp_audience = st.session_state.get("sp_target_audience", "").strip()
-                            if _sp_name or _sp_selling or _sp_audience:
-                                _store_data = {
-                                    "store_name": _sp_name,
-                                    "core_selling_points": _sp_selling,
-                                    "target_audience": _sp_audience,
-                                }
+                        if _chain_mode == "fused":
+                            # Step 1+2 合并：一次调用返回分析和策略，解析失败时内部退回分步调用
+                            _gen_status.update(label="Step 1/2：分析竞品并制定差异化策略…")
+                            _chain_mode = "fused_fallback"
                             try:
-                                strategy = plan_content_strategy(
-                                    analysis=st.session_state.competitor_analysis,
+                                analysis, strategy, _chain_mode = analyze_and_plan(
+                                    st.session_state.note_title,
+                                    st.session_state.note_text,
                                     store_profile=_store_data,
                                     post_goal=st.session_state.get("post_goal", "种草案例"),
                                     tone_style=st.session_state.get("tone_style", "温暖亲切"),
                                     extra_requirements=st.session_state.get("extra_requirements", ""),
                                     use_claude=_use_claude,
                                 )
-                                if strategy:
+                                if analysis:
+                                    st.session_state.competitor_analysis = analysis
+                                    _step1_ok = True
+                                if analysis and strategy:
                                     st.session_state.content_strategy = strategy
                                     _step2_ok = True
                             except Exception:
-                                pass  # Step2 失败 → 跳过策略
+                                pass  # 分析失败 → 降级为单步
+                        else:
+                            # Step 1: 竞品分析
+                            _gen_status.update(label="Step 1/3：分析竞品笔记…")
+                            try:
+                                analysis = analyze_competitor(
+                                    st.session_state.note_title,
+                                    st.session_state.note_text,
+                                    use_claude=_use_claude,
+                                )
+                                if analysis:
+                                    st.session_state.competitor_analysis = analysis
+                                    _step1_ok = True
+                            except Exception:
+                                pass  # Step1 失败 → 降级为单步
+
+                            # Step 2: 差异化策略
+                            if _step1_ok:
+                                _gen_status.update(label="Step 2/3：制定差异化策略…")
+                                try:
+                                    strategy = plan_content_strategy(
+                                        analysis=st.session_state.competitor_analysis,
+                                        store_profile=_store_data,
+                                        post_goal=st.session_state.get("post_goal", "种草案例"),
+                                        tone_style=st.session_state.get("tone_style", "温暖亲切"),
+                                        extra_requirements=st.session_state.get("extra_requirements", ""),
+                                        use_claude=_use_claude,
+                                    )
+                                    if strategy:
+                                        st.session_state.content_strategy = strategy
+                                        _step2_ok = True
+                                except Exception:
+                                    pass  # Step2 失败 → 跳过策略
+                        _chain_ms = int((time.monotonic() - _chain_t0) * 1000)
 
                         # Step 3: 生成内容
-                        _gen_status.update(label="Step 3/3：生成改写内容…" if _step1_ok else f"{_brain_name} 正在改写文案…")
+                        _gen_status.update(
+                            label=f"Step {_total_steps}/{_total_steps}：生成改写内容…" if _step1_ok
+                            else f"{_brain_name} 正在改写文案…"
+                        )
                         # 降级逻辑：Step2失败但Step1成功时，将分析结果转为简化策略注入
                         _strategy_param = None
                         if _step2_ok:
@@ -2347,13 +2361,13 @@ if st.session_state.content_ready:
                                 "tone_guide": f"借鉴竞品的情绪触发点：{'、'.join(_analysis.get('emotional_triggers', [])[:3])}",
                             }
                         try:
-                            result = _rewrite_fn(
+                            result = render_text_stream(_draft, _stream_rewrite_fn(
                                 st.session_state.note_title,
                                 st.session_state.note_text,
                                 industry,
                                 st.session_state.city,
                                 content_strategy=_strategy_param,
-                            )
+                            ))
                         except Exception as step3_err:
                             # Step3 失败：不消耗配额，提示重试
                             refund_pro_quota(st.session_state.invite_code)
@@ -2374,15 +2388,17 @@ if st.session_state.content_ready:
                         )
                         log_event(st.session_state.invite_code, "generate_text",
                                    st.session_state.industry_id, mode,
-                                   detail=json.dumps({"chain": _step1_ok, "strategy": _step2_ok, "brain": _brain_name}))
+                                   detail=json.dumps({"chain": _step1_ok, "strategy": _step2_ok, "brain": _brain_name,
+                                                      "chain_mode": _chain_mode, "chain_ms": _chain_ms,
+                                                      "total_ms": int((time.monotonic() - _chain_t0) * 1000)}))
                     else:
                         _gen_status.update(label=f"{_brain_name} 正在创作文案…")
-                        result = _create_fn(
+                        result = render_text_stream(_draft, _stream_create_fn(
                             st.session_state.store_profile,
                             st.session_state.daily_brief,
                             industry,
                             st.session_state.city,
-                        )
+                        ))
                         st.session_state.rewrite_result = result
                         save_generation(
                             invite_code=st.session_state.invite_code,
@@ -2408,6 +2424,7 @@ if st.session_state.content_ready:
                     _gen_status.update(label="生成完成！", state="complete", expanded=False)
                     st.rerun()
                 except Exception as e:
+                    _draft.empty()
                     _gen_status.update(label="生成失败", state="error")
                     st.error(friendly_api_error(e))
 
@@ -2424,7 +2441,10 @@ if st.session_state.content_ready:
                         st.info(f"**{br['title']}**\n\n{br['text']}")
                     with c2:
                         st.markdown("**改写后** （右上角可复制）")
-                        st.code(br["rewrite"], language=None)
+                        if br.get("rewrite_error"):
+                            st.error(f"这条改写失败：{br['rewrite_error']}，可重新生成")
+                        else:
+                            st.code(br["rewrite"], language=None)
         elif mode == "rewrite":
             # --- 单条 Mode A 结果展示（升级版）---
 
@@ -2489,12 +2509,14 @@ if st.session_state.content_ready:
 
             # AI 润色按钮
             if st.button("✨ AI 润色一下（消耗1次配额）", key="btn_polish"):
-                if not try_use_pro_quota(st.session_state.invite_code):
+                _polish_quota = reserve_pro_quota(st.session_state.invite_code)
+                if not _polish_quota:
                     st.error("配额不足，无法润色")
                 else:
-                    with st.spinner("AI 正在润色…"):
+                    # 未 commit 的预留在离开 with 块时自动退还
+                    with _polish_quota, st.spinner("AI 正在润色…"):
                         try:
-                            _user_tier = get_user_tier(st.session_state.invite_code)
+                            _user_tier = get_account_snapshot(st.session_state.invite_code)["tier"]
                             polished = polish_content(
                                 title=st.session_state.get("edited_title", ""),
                                 body=st.session_state.get("edited_body", ""),
@@ -2502,16 +2524,15 @@ if st.session_state.content_ready:
                                 use_claude=(_user_tier == "promax"),
                             )
                             if polished and polished.get("title") and polished.get("body"):
+                                _polish_quota.commit()
                                 st.session_state["edited_title"] = polished["title"]
                                 st.session_state["edited_body"] = polished["body"]
                                 # 同步更新 rewrite_result 用于后续流程
                                 st.session_state.rewrite_result = f"【标题】{polished['title']}\n\n【正文】{polished['body']}"
                                 st.rerun()
                             else:
-                                refund_pro_quota(st.session_state.invite_code)
                                 st.warning("润色失败，可直接使用当前内容")
                         except Exception:
-                            refund_pro_quota(st.session_state.invite_code)
                             st.warning("润色失败，可直接使用当前内容")
         else:
             st.markdown("**生成结果** （右上角可复制）")
@@ -2578,11 +2599,14 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
                 _warnings = []
                 with st.spinner(f"正在处理 {_total_imgs} 张图片（AI去水印 + 隐形防查重）..."):
                     for bi, br in enumerate(_batch):
-                        imgs = br.get("images", [])
+                        imgs = load_images(br.get("images", []))
                         edited_list = []
                         for img in imgs:
+                            if img is None:
+                                edited_list.append(None)
+                                continue
                             result_img, err = remove_watermark_and_protect(img)
-                            edited_list.append(result_img if result_img else stealth_anti_hash(img))
+                            edited_list.append(store_image(result_img if result_img else stealth_anti_hash(img)))
                             if err:
                                 _warnings.append(err)
                         br["edited_images"] = edited_list
@@ -2602,9 +2626,12 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
                 _warnings = []
                 with st.spinner("正在处理图片（AI去水印 + 隐形防查重）..."):
                     edited = []
-                    for img in st.session_state.note_images:
+                    for img in load_images(st.session_state.note_images):
+                        if img is None:
+                            edited.append(None)
+                            continue
                         result_img, err = remove_watermark_and_protect(img)
-                        edited.append(result_img if result_img else stealth_anti_hash(img))
+                        edited.append(store_image(result_img if result_img else stealth_anti_hash(img)))
                         if err:
                             _warnings.append(err)
                 st.session_state.edited_images = edited
@@ -2627,17 +2654,19 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
                 _img_tabs = st.tabs(_img_tab_names)
                 for bi, (tab, br) in enumerate(zip(_img_tabs, _batch)):
                     with tab:
-                        _ed = br.get("edited_images", [])
-                        _orig = br.get("images", [])
+                        _ed = load_images(br.get("edited_images", []))
+                        _orig = load_images(br.get("images", []))
                         if not _orig:
                             st.caption("此笔记无图片")
                             continue
                         for i, (orig, ed) in enumerate(zip(_orig, _ed)):
                             c1, c2 = st.columns(2)
                             with c1:
-                                st.image(orig, caption=f"原图 {i+1}", use_container_width=True)
+                                render_image(orig, f"原图 {i+1}")
                             with c2:
-                                st.image(ed, caption=f"处理后 {i+1}", use_container_width=True)
+                                render_image(ed, f"处理后 {i+1}")
+                                if ed is None:
+                                    continue
                                 _ec1, _ec2 = st.columns([3, 1])
                                 with _ec1:
                                     _req = st.text_input("修改", key=f"edit_bwm_{bi}_{i}",
@@ -2650,7 +2679,7 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
                                     with st.spinner(f"正在修改笔记{bi+1}第{i+1}张…"):
                                         _new, _err = edit_image_with_gemini(ed, _req)
                                     if _new:
-                                        st.session_state.batch_results[bi]["edited_images"][i] = _new
+                                        st.session_state.batch_results[bi]["edited_images"][i] = store_image(_new)
                                         del st.session_state[f"edit_bwm_{bi}_{i}"]
                                         st.success("修改成功！")
                                         st.rerun()
@@ -2658,13 +2687,15 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
                                         st.error(f"修改失败：{_err}")
             else:
                 for i, (orig, ed) in enumerate(
-                    zip(st.session_state.note_images, st.session_state.edited_images)
+                    zip(load_images(st.session_state.note_images), load_images(st.session_state.edited_images))
                 ):
                     c1, c2 = st.columns(2)
                     with c1:
-                        st.image(orig, caption=f"原图 {i+1}", use_container_width=True)
+                        render_image(orig, f"原图 {i+1}")
                     with c2:
-                        st.image(ed, caption=f"处理后 {i+1}", use_container_width=True)
+                        render_image(ed, f"处理后 {i+1}")
+                        if ed is None:
+                            continue
                         _ec1, _ec2 = st.columns([3, 1])
                         with _ec1:
                             _req = st.text_input("修改", key=f"edit_wm_{i}",
@@ -2677,7 +2708,7 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
                             with st.spinner(f"正在修改第 {i+1} 张…"):
                                 _new, _err = edit_image_with_gemini(ed, _req)
                             if _new:
-                                st.session_state.edited_images[i] = _new
+                                st.session_state.edited_images[i] = store_image(_new)
                                 del st.session_state[f"edit_wm_{i}"]
                                 st.success("修改成功！")
                                 st.rerun()
@@ -2767,10 +2798,14 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
                 n = len(st.session_state.note_images)
                 prog2 = st.progress(0, text="准备处理…")
                 edited, errors = [], []
-                for i, img in enumerate(st.session_state.note_images):
+                for i, img in enumerate(load_images(st.session_state.note_images)):
                     prog2.progress(i / n, text=f"正在处理第 {i+1}/{n} 张…")
+                    if img is None:
+                        edited.append(None)
+                        errors.append(f"图片 {i+1}：原图已失效")
+                        continue
                     result_img, err_msg = edit_image_with_gemini(img, img_prompt_a)
-                    edited.append(result_img)
+                    edited.append(store_image(result_img))
                     if err_msg:
                         errors.append(f"图片 {i+1}：{err_msg}")
                 prog2.progress(1.0, text="处理完成！")
@@ -2794,11 +2829,11 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
 
             if st.session_state.images_done:
                 for i, (orig, ed) in enumerate(
-                    zip(st.session_state.note_images, st.session_state.edited_images)
+                    zip(load_images(st.session_state.note_images), load_images(st.session_state.edited_images))
                 ):
                     c1, c2 = st.columns(2)
                     with c1:
-                        st.image(orig, caption=f"原图 {i+1}", use_container_width=True)
+                        render_image(orig, f"原图 {i+1}")
                     with c2:
                         if ed:
                             st.image(ed, caption=f"美化后 {i+1}", use_container_width=True)
@@ -2814,7 +2849,7 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
                                 with st.spinner(f"正在修改第 {i+1} 张…"):
                                     _new, _err = edit_image_with_gemini(ed, _req)
                                 if _new:
-                                    st.session_state.edited_images[i] = _new
+                                    st.session_state.edited_images[i] = store_image(_new)
                                     del st.session_state[f"edit_bt_{i}"]
                                     st.success("修改成功！")
                                     st.rerun()
@@ -2828,14 +2863,14 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
                     if st.button("🔄 重试失败的图片", key="btn_retry"):
                         prog3 = st.progress(0, text="重试中…")
                         for i, (img, ed) in enumerate(
-                            zip(st.session_state.note_images, st.session_state.edited_images)
+                            zip(load_images(st.session_state.note_images), st.session_state.edited_images)
                         ):
-                            if ed is None:
+                            if ed is None and img is not None:
                                 prog3.progress(i / len(st.session_state.note_images),
                                                text=f"重试第 {i+1} 张…")
                                 new_img, _ = edit_image_with_gemini(img, img_prompt_a)
                                 if new_img:
-                                    st.session_state.edited_images[i] = new_img
+                                    st.session_state.edited_images[i] = store_image(new_img)
                         prog3.progress(1.0, text="重试完成")
                         st.rerun()
 
@@ -2958,10 +2993,14 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
                 n = len(st.session_state.note_images)
                 prog_b = st.progress(0, text="准备场景换装…")
                 scene_results, scene_errors = [], []
-                for i, img in enumerate(st.session_state.note_images):
+                for i, img in enumerate(load_images(st.session_state.note_images)):
                     prog_b.progress(i / n, text=f"正在为第 {i+1}/{n} 张换装场景…")
+                    if img is None:
+                        scene_results.append(None)
+                        scene_errors.append(f"图片 {i+1}：原图已失效")
+                        continue
                     result_img, err_msg = edit_image_with_gemini(img, _scene_prompt_b)
-                    scene_results.append(result_img)
+                    scene_results.append(store_image(result_img))
                     if err_msg:
                         scene_errors.append(f"图片 {i+1}：{err_msg}")
                 prog_b.progress(1.0, text="场景换装完成！")
@@ -2986,11 +3025,11 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
 
             if st.session_state.scene_images and st.session_state.get("scene_tier") == "scene_b":
                 for i, (orig, sc) in enumerate(
-                    zip(st.session_state.note_images, st.session_state.scene_images)
+                    zip(load_images(st.session_state.note_images), load_images(st.session_state.scene_images))
                 ):
                     c1, c2 = st.columns(2)
                     with c1:
-                        st.image(orig, caption=f"原图 {i+1}", use_container_width=True)
+                        render_image(orig, f"原图 {i+1}")
                     with c2:
                         if sc:
                             st.image(sc, caption=f"场景换装 {i+1}", use_container_width=True)
@@ -3006,7 +3045,7 @@ if st.session_state.rewrite_done and (_has_any_images or mode == "create"):
                                 with st.spinner(f"正在修改第 {i+1} 张…"):
                                     _new, _err = edit_image_with_gemini(sc, _req)
                                 if _new:
-                                    st.session_state.scene_images[i] = _new
+                                    st.session_state.scene_images[i] = store_image(_new)
                                     del st.session_state[f"edit_sc_{i}"]
                                     st.success("修改成功！")
                                     st.rerun()
@@ -3092,7 +3131,7 @@ if st.session_state.rewrite_done:
 
         with c2:
             if st.session_state.images_done:
-                good_imgs = [x for x in st.session_state.edited_images if x]
+                good_imgs = [x for x in load_images(st.session_state.edited_images) if x]
                 if good_imgs:
                     zip_data = make_zip(
                         st.session_state.rewrite_result[:60],
@@ -3112,7 +3151,7 @@ if st.session_state.rewrite_done:
                 zip_orig = make_zip(
                     st.session_state.rewrite_result[:60],
                     st.session_state.rewrite_result,
-                    st.session_state.note_images,
+                    [x for x in load_images(st.session_state.note_images) if x],
                 )
                 st.download_button(
                     "📦 文案+原图（ZIP）",
@@ -3129,7 +3168,7 @@ if st.session_state.rewrite_done:
             zip_scene = make_zip(
                 st.session_state.rewrite_result[:60],
                 st.session_state.rewrite_result,
-                st.session_state.scene_images,
+                [x for x in load_images(st.session_state.scene_images) if x],
             )
             tier_label = "精品版" if st.session_state.get("scene_tier") == "pro" else "体验版"
             st.download_button(
@@ -3281,6 +3320,7 @@ if st.session_state.rewrite_done and not st.session_state.feedback_submitted:
                      st.session_state.get("industry_id", ""), st.session_state.get("selected_mode", "")),
                 )
                 conn.commit()
+                invalidate_admin_cache("feedback", "metrics")
             except Exception:
                 pass
             finally:
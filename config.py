@@ -3,13 +3,43 @@
 行业配置 · SVG图标 · 常量 · Session State 默认值
 """
 
+import os
 from pathlib import Path
 
 
 # ═══════════════════════════════════════════════════════
 #  数据库路径
 # ═══════════════════════════════════════════════════════
-DB_PATH = Path(__file__).parent / "xhs_agent.db"
+# 本地调试/回放可用 XHS_DB_PATH 指向临时库，避免运行时写入仓库里跟踪的 xhs_agent.db
+DB_PATH = Path(os.environ.get("XHS_DB_PATH") or Path(__file__).parent / "xhs_agent.db")
+DB_POOL_SIZE = 8            # 进程内 SQLite 连接池上限（所有 Streamlit 会话共享）
+DB_POOL_TIMEOUT = 10        # 连接池耗尽时最长等待秒数
+
+# 后台批量写入（埋点等非关键写入不阻塞用户请求）
+DB_WRITE_BEHIND = True      # False = 同步直写（测试/调试用）
+DB_WRITE_QUEUE_SIZE = 10000 # 内存队列上限，满了之后丢弃并计数
+DB_WRITE_BATCH_SIZE = 200   # 单次事务最多写入条数
+DB_WRITE_FLUSH_MS = 500     # 最长攒批时间（毫秒）
+
+# Pro 配额账本：计数常驻内存，每隔 N 秒把增量合并写入 quota_usage
+QUOTA_FLUSH_INTERVAL = 2.0
+ACCOUNT_SNAPSHOT_TTL = 30   # 会员等级/额度快照缓存秒数（配额变动时立即失效）
+
+# 管理后台各面板查询缓存秒数：过期后先返回旧数据，同时后台刷新
+ADMIN_PANEL_TTLS = {
+    "metrics": 30,      # 指标卡片
+    "trend": 120,       # 每日生成趋势
+    "quota": 30,        # 会员配额
+    "users": 60,        # 注册用户 / 活跃排行
+    "industry": 300,    # 行业 / 模式 / 图片档位 / 自定义行业
+    "feedback": 60,     # 最近反馈
+    "logs": 15,         # 事件日志 / 每小时分布
+}
+ADMIN_DEFAULT_TTL = 60
+ADMIN_LIST_LIMIT = 500      # 配额榜 / 注册用户列表最多显示条数（沿排序索引只读前 N 行）
+
+# 生成记录大文本字段超过此字节数时 zlib 压缩存储（BLOB + 编码标记）
+HISTORY_COMPRESS_MIN_BYTES = 512
 
 
 # ═══════════════════════════════════════════════════════
@@ -129,6 +159,29 @@ STRATEGY_PROMPT = (
     "只返回JSON，不要其他文字。"
 )
 
+# 合并模式：一次调用同时完成竞品分析和内容策略（字段与 ANALYZE_PROMPT / STRATEGY_PROMPT 一致）
+ANALYZE_STRATEGY_PROMPT = (
+    "你是小红书爆款内容分析专家兼内容策略师。先分析以下竞品笔记为什么能火，"
+    "再基于分析结果制定一篇新笔记的内容策略。\n\n"
+    "笔记内容：\n{note_content}\n\n"
+    "{store_section}\n\n"
+    "发帖目的：{post_goal}\n"
+    "语气风格：{tone_style}\n"
+    "{extra_requirements_section}\n\n"
+    "请用JSON格式返回，包含 analysis 和 strategy 两个对象：\n"
+    "analysis：\n"
+    "- hooks: 数组，列出标题和开头使用的吸引注意力的手法（如悬念、数字、情绪词）\n"
+    "- structure: 字符串，描述内容结构（如\"痛点→方案→效果\"或\"清单→对比→推荐\"）\n"
+    "- emotional_triggers: 数组，列出触发用户互动的情绪点（如焦虑、好奇、共鸣、羡慕）\n"
+    "- weaknesses: 数组，列出可以改进的地方（如缺少具体数据、图文不匹配、CTA弱）\n"
+    "strategy：\n"
+    "- angle: 字符串，这篇笔记的切入角度（要与竞品形成差异）\n"
+    "- differentiators: 数组，与竞品的差异化卖点（如果没有店铺资料则基于行业通用优势）\n"
+    "- structure_plan: 字符串，推荐的内容结构（如\"个人体验→产品测评→购买建议\"）\n"
+    "- tone_guide: 字符串，具体的语气指导（基于选择的语气风格，给出用词和句式建议）\n\n"
+    "只返回JSON，不要其他文字。"
+)
+
 POLISH_PROMPT = (
     "你是小红书文案润色专家。用户已经手动编辑了一篇小红书笔记，请在保留用户修改意图的前提下优化文案。\n\n"
     "语气风格要求：{tone_style}\n\n"
@@ -906,6 +959,69 @@ USER_AGENTS = [
     "discover/8.49.0 (iPhone13,4; iOS 17.4; Scale/3.0)",
 ]
 
+# 批量提取并发：全局同时在途请求上限（进程内所有会话共享）+ 单域名上限
+EXTRACT_MAX_CONCURRENCY = 16
+EXTRACT_PER_HOST = 3        # 笔记页 / 短链域名
+
+# 笔记图片下载：同一篇笔记的图片并发下载，流式读取，超过上限直接放弃
+IMAGE_DOWNLOAD_WORKERS = 9  # 单篇笔记并发数，也是单个图床域名的在途上限
+IMAGE_MAX_BYTES = 20 * 1024 * 1024
+
+# 图片内容寻址存储：按编码后字节的 SHA-256 存盘（两级分片目录），总大小超限按最近访问淘汰
+IMAGE_STORE_DIR = Path(__file__).parent / "image_store"
+IMAGE_STORE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+IMAGE_STORE_EVICT_EVERY = 50        # 每写入 N 张检查一次总大小
+IMAGE_TOUCH_INTERVAL = 60           # 读图时同一张图最多每 N 秒回写一次 last_access
+IMAGE_PIN_TTL = 6 * 3600            # 本进程 N 秒内读写过的图片视为仍被会话引用，淘汰时跳过
+
+# 链接提取结果缓存（SQLite extract_cache 表）：同一篇笔记重复粘贴时不再请求小红书
+EXTRACT_CACHE_TTL = 24 * 3600       # 提取成功的结果保留秒数
+EXTRACT_NEGATIVE_TTL = 10 * 60      # 明确失败（页面可访问但无内容）的结果保留秒数
+EXTRACT_CACHE_PURGE_EVERY = 200     # 每写入 N 次清理一次过期行
+
+# 共享 HTTP 连接池：make_async_client() 创建的所有客户端共用，keep-alive 连接跨请求复用
+HTTP_MAX_CONNECTIONS = 64           # 同时打开的连接总数上限（所有域名合计）
+HTTP_MAX_KEEPALIVE = 32             # 最多保留的空闲连接数（笔记页、短链、几个图床 CDN）
+HTTP_KEEPALIVE_EXPIRY = 30          # 空闲连接保留秒数
+
+# 大模型 API 连接池：DeepSeek / Claude 客户端按 (服务商, API Key) 缓存，共用一个连接池
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+LLM_MAX_CONNECTIONS = 32            # 同时打开的连接总数上限
+LLM_MAX_KEEPALIVE = 16              # 最多保留的空闲连接数
+LLM_KEEPALIVE_EXPIRY = 120          # 空闲连接保留秒数（生成步骤之间的间隔通常在这之内）
+LLM_TIMEOUT = 120                   # 单次请求读超时秒数（长文案生成）
+LLM_CONNECT_TIMEOUT = 10
+
+# 批量改写限流（按服务商，进程内所有会话共用）：同时在途请求数 + 每分钟 token 上限（滑动 60 秒窗口）。
+# 请求前按「提示词字数 + max_tokens」预占额度，返回后按实际用量结算
+LLM_BATCH_CONCURRENCY = {"deepseek": 8, "anthropic": 4}
+LLM_BATCH_TPM = {"deepseek": 300_000, "anthropic": 80_000}   # 按账号额度调整
+
+# 大模型响应缓存（SQLite llm_cache 表）：键为 (服务商, 模型, 提示词, temperature, max_tokens,
+# response_format) 的哈希。竞品分析 / 内容策略默认开启，改写 / 创作类调用需显式传 cache=True
+LLM_CACHE_TTL = 7 * 24 * 3600       # 条目保留秒数
+LLM_CACHE_MAX_ROWS = 5000           # 超出后按最近访问淘汰（随过期清理一起执行）
+
+# Mode A 链式生成：分析 + 策略分两次调用（split）或合并为一次调用（fused，解析失败自动退回 split；
+# 该笔记已有缓存的分析时只调一次策略）。
+# 按邀请码哈希分桶，同一用户始终同一模式；生成事件里记录模式和耗时，便于对比
+CHAIN_FUSED_RATIO = 0.5             # 使用合并模式的用户比例，0 关闭，1 全量
+
+# 单条笔记提取（含重试、备用接口、短链展开）的总耗时上限，超时即取消
+EXTRACT_NOTE_TIMEOUT = 60
+
+# 提取策略调度：各策略成功率 / 耗时按滑动平均统计（持久化到 extract_strategy_stats），
+# 按「预期耗时 / 成功率」排序，结果完整度达到阈值即停止
+EXTRACT_COMPLETENESS = 0.8          # 完整度 = 有效标题 0.4 + 正文 0.4 + 图片 0.2
+EXTRACT_STRATEGY_ALPHA = 0.2        # 滑动平均中最新一次结果的权重
+EXTRACT_STRATEGY_MIN_SAMPLES = 20   # 任一策略样本不足时按默认顺序执行
+EXTRACT_STRATEGY_EXPLORE = 0.05     # 按默认顺序执行的概率（让排在后面的策略也能更新统计）
+EXTRACT_RACE_BELOW = 0.5            # 首选抓取策略成功率低于此值时与下一个策略并发执行
+
+# xhslink 短链接展开缓存：进程内 LRU + SQLite short_link_cache 表
+SHORT_LINK_CACHE_SIZE = 2000        # 内存中最多保留条数
+SHORT_LINK_TTL = 24 * 3600          # 展开结果保留秒数（展开后的链接带 xsec_token，不宜过久）
+
 
 # ═══════════════════════════════════════════════════════
 #  无效标题过滤集合
@@ -0,0 +1,432 @@
+"""
+SQLite 数据层压测
+按指定规模生成合成的 users / quota_usage / generation_history / event_log / feedback /
+store_profiles 数据（生成记录为真实长度的中文正文），再用多线程并发调用 utils.py 的
+真实函数和管理后台查询，输出每个函数的 p50/p95/p99 延迟、吞吐量、连接池等待次数和错误数。
+
+用法：
+    python scripts/bench_db.py --users 100000 --events 10000000 --threads 16 --duration 30
+    python scripts/bench_db.py --db /tmp/bench.db --skip-seed      # 复用已生成的库
+    python scripts/bench_db.py --json before.json                  # 保存结果，改动前后对比
+
+默认在临时目录建库；--db 指定路径时保留数据库文件，方便多次压测复用。
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import utils  # noqa: E402
+from config import INDUSTRIES, TIER_PLANS  # noqa: E402
+from check_query_plans import HOT_QUERIES  # noqa: E402
+
+
+# ═══════════════════════════════════════════════════════
+#  合成数据
+# ═══════════════════════════════════════════════════════
+
+_PHRASES = [
+    "姐妹们今天必须给你们安利这家宝藏小店", "真的是我最近挖到的最惊喜的一家",
+    "环境干净又有氛围感，随手一拍都是大片", "老板人超级nice，全程耐心讲解",
+    "价格也很友好，学生党完全可以冲", "第一次来就被种草了，已经约了下次",
+    "位置在地铁口出来步行五分钟", "周末人比较多，建议提前预约",
+    "体验下来整体非常满意，细节做得很到位", "之前踩过很多坑，这次终于找对地方了",
+    "效果肉眼可见，朋友都问我最近做了什么", "强烈推荐给同样有需求的宝子们",
+    "一定要收藏起来，以后用得上", "有问题可以评论区问我，看到都会回",
+    "这里的服务流程特别规范，一点都不敷衍", "性价比真的绝了，比我之前去的好太多",
+    "分享一下我的真实体验和一些小建议", "适合新手入门，不用担心跟不上",
+    "团队很专业，每一步都会提前沟通", "最打动我的是他们对细节的坚持",
+]
+_TAGS = ["#宝藏店铺", "#探店", "#种草", "#本地生活", "#好物分享", "#周末去哪儿", "#避坑指南"]
+_EMOJI = ["✨", "🔥", "💯", "👍", "🌟", "💕", "📍", "🙌"]
+_CITIES = ["上海", "北京", "杭州", "成都", "深圳", "广州", "南京", "武汉", ""]
+_CUSTOM_NAMES = ["花艺工作室", "陶艺体验", "宠物摄影", "私房烘焙", "中医推拿", "琴行"]
+_EVENT_TYPES = [
+    ("generate_text", 30), ("extract_link", 25), ("login", 20),
+    ("edit_image", 15), ("scene_change_b", 7), ("feedback", 3),
+]
+
+_EVENT_SQL = (
+    "INSERT INTO event_log "
+    "(invite_code, event_type, industry_id, mode, detail, success, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+_HISTORY_SQL = (
+    "INSERT INTO generation_history "
+    "(invite_code, industry_id, mode, input_title, input_text, input_profile, "
+    " output_text, image_count, image_tier, city, custom_industry, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def user_phone(i: int) -> str:
+    return f"13{i:09d}"
+
+
+def user_code(i: int) -> str:
+    return f"BU{i:07d}"
+
+
+def chinese_text(rnd: random.Random, lo: int, hi: int) -> str:
+    """拼接一段长度在 [lo, hi] 字之间的小红书风格正文"""
+    target = rnd.randint(lo, hi)
+    parts, size = [], 0
+    while size < target:
+        p = rnd.choice(_PHRASES) + rnd.choice(["，", "。", "！", "～", rnd.choice(_EMOJI) + "\n"])
+        parts.append(p)
+        size += len(p)
+    return "".join(parts)[:target] + "\n\n" + " ".join(rnd.sample(_TAGS, 3))
+
+
+class _Synth:
+    """按用户活跃度（长尾分布）生成各表的行"""
+
+    def __init__(self, users: int, days: int, seed: int):
+        self.rnd = random.Random(seed)
+        self.users = max(users, 1)
+        self.now = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.span = days * 86400
+        self.industries = list(INDUSTRIES)
+
+    def ts(self) -> str:
+        return (self.now - timedelta(seconds=self.rnd.randrange(self.span))).strftime("%Y-%m-%d %H:%M:%S")
+
+    def active_user(self) -> int:
+        # 少数重度用户贡献大部分生成和事件
+        return int(self.users * self.rnd.random() ** 3)
+
+    def user(self, i: int) -> tuple:
+        first, last = sorted((self.ts(), self.ts()))
+        return (user_phone(i), user_code(i), first, last, self.rnd.randint(1, 60))
+
+    def quota(self, i: int) -> tuple:
+        tier = self.rnd.choices(list(TIER_PLANS), weights=[80, 10, 8, 2])[0]
+        return (user_code(i), self.rnd.randrange(50), tier, self.ts())
+
+    def profile(self, industry: str) -> str:
+        rnd = self.rnd
+        data = {
+            "store_name": rnd.choice(["小满", "拾光", "青禾", "木子", "初见"]) + rnd.choice(["工作室", "小馆", "会所"]),
+            "address": rnd.choice(_CITIES[:-1]) + "市某某路" + str(rnd.randint(1, 999)) + "号",
+            "features": chinese_text(rnd, 60, 200),
+            "price_range": f"{rnd.randint(50, 300)}-{rnd.randint(300, 2000)}元",
+        }
+        if industry == "custom":
+            data["industry_name"] = rnd.choice(_CUSTOM_NAMES)
+        return json.dumps(data, ensure_ascii=False)
+
+    def history(self) -> tuple:
+        rnd = self.rnd
+        industry = rnd.choice(self.industries)
+        mode = rnd.choice(["rewrite", "original"])
+        profile = self.profile(industry)
+        input_text = chinese_text(rnd, 300, 1000) if mode == "rewrite" else chinese_text(rnd, 20, 120)
+        return (
+            user_code(self.active_user()), industry, mode,
+            chinese_text(rnd, 8, 20).split("\n")[0] if mode == "rewrite" else "",
+            utils._pack_history_text(input_text),
+            utils._pack_history_text(profile),
+            utils._pack_history_text(chinese_text(rnd, 400, 900)),
+            rnd.randint(0, 9), rnd.choice(["", "", "free", "pro"]), rnd.choice(_CITIES),
+            utils._custom_industry_name(industry, profile), self.ts(),
+        )
+
+    def event(self) -> tuple:
+        rnd = self.rnd
+        event_type = rnd.choices([e for e, _ in _EVENT_TYPES], weights=[w for _, w in _EVENT_TYPES])[0]
+        detail = "https://www.xiaohongshu.com/explore/" + "%024x" % rnd.getrandbits(96) \
+            if event_type == "extract_link" else ""
+        return (
+            user_code(self.active_user()), event_type, rnd.choice(self.industries),
+            rnd.choice(["rewrite", "original", ""]), detail, int(rnd.random() < 0.9), self.ts(),
+        )
+
+    def feedback(self) -> tuple:
+        rnd = self.rnd
+        return (
+            user_code(self.active_user()), rnd.choice(["很好用", "还不错", "一般", "需要改进"]),
+            chinese_text(rnd, 10, 120), rnd.choice(self.industries), rnd.choice(["sidebar", "form"]),
+            self.ts(),
+        )
+
+    def store_profile(self, i: int) -> tuple:
+        industry = self.rnd.choice(self.industries)
+        return (user_phone(i), industry, self.profile(industry))
+
+
+def _insert_chunked(conn, sql: str, make_row, count: int, label: str, chunk: int):
+    done = 0
+    start = time.perf_counter()
+    while done < count:
+        n = min(chunk, count - done)
+        conn.executemany(sql, [make_row(done + k) for k in range(n)])
+        conn.commit()
+        done += n
+        rate = done / max(time.perf_counter() - start, 1e-9)
+        print(f"\r  {label:<20} {done:>10,}/{count:,}  ({rate:,.0f} 行/秒)", end="", flush=True)
+    if count:
+        print()
+
+
+def seed_database(users: int, events: int, history: int, feedback: int,
+                  days: int = 90, seed: int = 7, chunk: int = 20000):
+    """向 utils.DB_PATH 写入合成数据（经过迁移和汇总表触发器，与线上写路径一致）"""
+    synth = _Synth(users, days, seed)
+    conn = utils.get_db()
+    try:
+        conn.execute("PRAGMA synchronous=OFF")  # 仅造数期间关闭，压测阶段恢复默认
+        _insert_chunked(
+            conn, "INSERT OR IGNORE INTO users "
+                  "(phone, invite_code, created_at, last_login, login_count) VALUES (?, ?, ?, ?, ?)",
+            synth.user, users, "users", chunk,
+        )
+        _insert_chunked(
+            conn, "INSERT OR IGNORE INTO quota_usage "
+                  "(invite_code, pro_gen_used, tier, updated_at) VALUES (?, ?, ?, ?)",
+            synth.quota, users, "quota_usage", chunk,
+        )
+        _insert_chunked(
+            conn, "INSERT OR IGNORE INTO store_profiles (phone, industry, profile_data) VALUES (?, ?, ?)",
+            synth.store_profile, users // 3, "store_profiles", chunk,
+        )
+        _insert_chunked(conn, _HISTORY_SQL, lambda _: synth.history(), history,
+                        "generation_history", chunk)
+        _insert_chunked(conn, _EVENT_SQL, lambda _: synth.event(), events, "event_log", chunk)
+        _insert_chunked(
+            conn, "INSERT INTO feedback "
+                  "(invite_code, rating, feedback_text, industry_id, mode, created_at) "
+                  "VALUES (?, ?, ?, ?, ?, ?)",
+            lambda _: synth.feedback(), feedback, "feedback", chunk,
+        )
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.close()
+
+
+# ═══════════════════════════════════════════════════════
+#  并发负载
+# ═══════════════════════════════════════════════════════
+
+_ADMIN_QUERIES = [(name, sql, params) for name, sql, params, _ in HOT_QUERIES
+                  if name.startswith("admin_")]
+
+
+def _admin_uncached(_ctx):
+    # 模拟看板缓存未命中：直接执行一条管理后台查询
+    _name, sql, params = random.choice(_ADMIN_QUERIES)
+    conn = utils.get_db()
+    try:
+        conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def _feedback_insert(ctx):
+    # 与 app.py 侧边栏反馈的写法一致
+    conn = utils.get_db()
+    try:
+        conn.execute(
+            "INSERT INTO feedback (invite_code, rating, feedback_text, industry_id, mode) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (ctx["code"], "还不错", chinese_text(ctx["rnd"], 10, 80), ctx["industry"], "sidebar"),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    utils.invalidate_admin_cache("feedback", "metrics")
+
+
+def _try_use_quota(ctx):
+    res = utils.reserve_pro_quota(ctx["code"])
+    if res is not None:
+        res.commit()
+
+
+# (名称, 权重, 调用)；权重大致对应线上一次会话里的调用比例
+WORKLOAD = [
+    ("log_event", 30, lambda c: utils.log_event(c["code"], "generate_text", c["industry"], "rewrite")),
+    ("get_account_snapshot", 20, lambda c: utils.get_account_snapshot(c["code"])),
+    ("get_history", 10, lambda c: utils.get_history(c["code"], 10)),
+    ("save_generation", 8, lambda c: utils.save_generation(
+        c["code"], c["industry"], "rewrite", "探店笔记",
+        chinese_text(c["rnd"], 300, 1000), c["synth"].profile(c["industry"]),
+        chinese_text(c["rnd"], 400, 900), 4, "pro", "上海")),
+    ("register_or_login", 5, lambda c: utils.register_or_login(c["phone"], c["code"])),
+    ("try_use_pro_quota", 5, _try_use_quota),
+    ("load_store_profile", 5, lambda c: utils.load_store_profile(c["phone"], c["industry"])),
+    ("save_store_profile", 2, lambda c: utils.save_store_profile(
+        c["phone"], c["industry"], json.loads(c["synth"].profile(c["industry"])))),
+    ("feedback_insert", 1, _feedback_insert),
+    ("admin_query", 4, _admin_uncached),
+    ("get_all_users", 0.2, lambda c: utils.get_all_users()),
+]
+
+
+def _worker(users: int, deadline: float, seed: int, results: dict, lock: threading.Lock):
+    rnd = random.Random(seed)
+    synth = _Synth(users, 1, seed)
+    names = [w[0] for w in WORKLOAD]
+    weights = [w[1] for w in WORKLOAD]
+    funcs = {w[0]: w[2] for w in WORKLOAD}
+    local = {n: {"lat": [], "waits": 0, "errors": 0} for n in names}
+    while time.perf_counter() < deadline:
+        name = rnd.choices(names, weights=weights)[0]
+        i = synth.active_user()
+        ctx = {"rnd": rnd, "synth": synth, "code": user_code(i), "phone": user_phone(i),
+               "industry": rnd.choice(synth.industries)}
+        waits_before = utils.get_thread_pool_waits()
+        start = time.perf_counter()
+        try:
+            funcs[name](ctx)
+        except Exception:
+            local[name]["errors"] += 1
+        local[name]["lat"].append(time.perf_counter() - start)
+        local[name]["waits"] += utils.get_thread_pool_waits() - waits_before
+    with lock:
+        for n, r in local.items():
+            agg = results.setdefault(n, {"lat": [], "waits": 0, "errors": 0})
+            agg["lat"].extend(r["lat"])
+            agg["waits"] += r["waits"]
+            agg["errors"] += r["errors"]
+
+
+def _pct(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(int(round(p / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[k]
+
+
+def run_load(users: int, threads: int, duration: float, seed: int = 11) -> dict:
+    """多线程按 WORKLOAD 权重随机调用，返回每个函数的延迟分位数 / 吞吐 / 等待次数"""
+    results: dict = {}
+    lock = threading.Lock()
+    pool_before = utils.get_db_pool_stats()
+    writers_before = utils.get_writer_stats()
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    workers = [
+        threading.Thread(target=_worker, args=(users, deadline, seed + k, results, lock),
+                         name=f"bench-{k}")
+        for k in range(threads)
+    ]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    flush_start = time.perf_counter()
+    utils.flush_pending_writes(timeout=60)
+    drain_ms = (time.perf_counter() - flush_start) * 1000
+
+    report = {"elapsed_s": round(elapsed, 2), "threads": threads, "functions": {}}
+    for name, r in sorted(results.items(), key=lambda kv: -len(kv[1]["lat"])):
+        lat = sorted(r["lat"])
+        report["functions"][name] = {
+            "calls": len(lat),
+            "p50_ms": round(_pct(lat, 50) * 1000, 3),
+            "p95_ms": round(_pct(lat, 95) * 1000, 3),
+            "p99_ms": round(_pct(lat, 99) * 1000, 3),
+            "ops_s": round(len(lat) / elapsed, 1),
+            "lock_waits": r["waits"],
+            "errors": r["errors"],
+        }
+    pool_after = utils.get_db_pool_stats()
+    writers_after = utils.get_writer_stats()
+    report["total_ops_s"] = round(sum(f["calls"] for f in report["functions"].values()) / elapsed, 1)
+    report["pool"] = {k: pool_after[k] - pool_before.get(k, 0)
+                      for k in ("checkouts", "waits", "wait_ms", "timeouts")}
+    report["writers"] = {
+        name: {k: w[k] - writers_before[name][k] for k in ("written", "dropped", "failed", "flushes")}
+        for name, w in writers_after.items()
+    }
+    report["drain_ms"] = round(drain_ms, 1)
+    return report
+
+
+def print_report(report: dict):
+    print(f"\n耗时 {report['elapsed_s']}s · {report['threads']} 线程 · "
+          f"总吞吐 {report['total_ops_s']:,} ops/s\n")
+    print(f"{'函数':<22}{'调用':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'ops/s':>10}{'锁等待':>8}{'错误':>7}")
+    for name, f in report["functions"].items():
+        print(f"{name:<22}{f['calls']:>9,}{f['p50_ms']:>10.2f}{f['p95_ms']:>10.2f}"
+              f"{f['p99_ms']:>10.2f}{f['ops_s']:>10,.1f}{f['lock_waits']:>8}{f['errors']:>7}")
+    pool = report["pool"]
+    print(f"\n连接池：借出 {pool['checkouts']:,} · 等待 {pool['waits']:,} 次 / "
+          f"{pool['wait_ms']:,.0f} ms · 超时 {pool['timeouts']}")
+    for name, w in report["writers"].items():
+        print(f"后台写入 {name}：写入 {w['written']:,} · 批次 {w['flushes']:,} · "
+              f"丢弃 {w['dropped']} · 失败 {w['failed']}")
+    print(f"压测结束后排空写入队列：{report['drain_ms']:,.0f} ms")
+
+
+def _count_rows() -> dict:
+    conn = utils.get_db()
+    try:
+        return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                for t in ("users", "generation_history", "event_log", "feedback")}
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="数据库路径（默认临时目录，用完删除）")
+    parser.add_argument("--skip-seed", action="store_true", help="不造数，直接压测已有数据库")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--history", type=int, default=None, help="默认 users × 2")
+    parser.add_argument("--feedback", type=int, default=None, help="默认 users ÷ 20")
+    parser.add_argument("--days", type=int, default=90, help="数据时间跨度（天）")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=15, help="压测时长（秒）")
+    parser.add_argument("--sync-writes", action="store_true", help="关闭后台批量写入，测同步直写")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.db:
+        utils.DB_PATH = Path(args.db)
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        utils.DB_PATH = Path(tmp.name) / "bench.db"
+    if args.sync_writes:
+        utils.set_sync_writes(True)
+
+    try:
+        if not args.skip_seed:
+            print(f"造数 → {utils.DB_PATH}")
+            seed_database(
+                args.users, args.events,
+                args.users * 2 if args.history is None else args.history,
+                args.users // 20 if args.feedback is None else args.feedback,
+                days=args.days,
+            )
+        rows = _count_rows()
+        print("数据量：" + " · ".join(f"{t} {n:,}" for t, n in rows.items()))
+        report = run_load(max(rows["users"], 1), args.threads, args.duration)
+        report["rows"] = rows
+        report["sync_writes"] = args.sync_writes
+        print_report(report)
+        if args.json:
+            Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+            print(f"结果已写入 {args.json}")
+    finally:
+        utils.flush_pending_writes()
+        if tmp:
+            tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
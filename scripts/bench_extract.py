@@ -0,0 +1,120 @@
+"""
+小红书提取离线回归 & 基准
+用 scripts/fixtures/xhs/corpus.json 的录制响应跑 api.try_extract_xhs，
+核对每个用例的提取结果（标题 / 正文长度 / 图片数 / 是否失败），
+并统计总耗时 p50 / max 和各阶段平均耗时；server 模式另报连接复用率。不访问真实站点，使用临时数据库。
+
+  --mode replay   进程内回放（ReplayTransport），只测引擎自身开销
+  --mode server   本地替身 HTTP 服务（StandinTransport），含 socket / HTTP 解析
+  --cache         开启提取缓存（默认关闭，每轮都完整走一遍提取）
+
+用法：python scripts/bench_extract.py [--mode replay] [--repeat 5] [--cache] [--json out.json]
+"""
+
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import api  # noqa: E402
+import utils  # noqa: E402
+from xhs_replay import Corpus, ReplayTransport, StandinTransport, start_standin_server  # noqa: E402
+
+STAGES = ("cache_lookup", "resolve_short", "fetch", "retry_wait", "parse_head",
+          "parse_state", "fallback", "cache_store")
+
+
+def check(case: dict, title: str, text: str, images: list) -> list[str]:
+    """对照 expect，返回不符合的项"""
+    exp, problems = case["expect"], []
+    if exp.get("fail") and text:
+        problems.append(f"应失败，实际提取到正文{len(text)}字")
+    if "title" in exp and title != exp["title"]:
+        problems.append(f"标题 {title!r} ≠ {exp['title']!r}")
+    if "text_len" in exp and len(text) != exp["text_len"]:
+        problems.append(f"正文 {len(text)}字 ≠ {exp['text_len']}字")
+    if "images" in exp and len(images) != exp["images"]:
+        problems.append(f"图片 {len(images)}张 ≠ {exp['images']}张")
+    return problems
+
+
+def run(corpus: Corpus, repeat: int, use_cache: bool) -> dict:
+    results = {}
+    for case in corpus.cases:
+        totals, stages, problems = [], {s: [] for s in STAGES}, []
+        for _ in range(repeat):
+            corpus.reset()
+            timings = {}
+            start = time.perf_counter()
+            title, text, images, _logs = api.try_extract_xhs(
+                case["input"], use_cache=use_cache, timings=timings,
+            )
+            totals.append((time.perf_counter() - start) * 1000)
+            for s in STAGES:
+                stages[s].append(timings.get(s, 0.0))
+            problems = check(case, title, text, images) or problems
+        results[case["name"]] = {
+            "ok": not problems,
+            "problems": problems,
+            "p50_ms": statistics.median(totals),
+            "max_ms": max(totals),
+            "stages_ms": {s: statistics.fmean(v) for s, v in stages.items() if any(v)},
+        }
+    return results
+
+
+def print_report(results: dict, mode: str):
+    print(f"{'用例':<32}{'结果':<6}{'p50 ms':>9}{'max ms':>9}  阶段均值 ms")
+    for name, r in results.items():
+        stages = "  ".join(f"{k}={v:.2f}" for k, v in r["stages_ms"].items())
+        print(f"{name:<32}{'OK' if r['ok'] else 'FAIL':<6}{r['p50_ms']:>9.2f}{r['max_ms']:>9.2f}  {stages}")
+        for p in r["problems"]:
+            print(f"    ✗ {p}")
+    passed = sum(r["ok"] for r in results.values())
+    print(f"\n[{mode}] 准确率 {passed}/{len(results)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=("replay", "server"), default="replay")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cache", action="store_true", help="开启提取缓存")
+    parser.add_argument("--json", help="结果另存为 JSON")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    utils.DB_PATH = str(Path(tmp.name) / "bench_extract.db")
+    utils.init_db()
+
+    corpus = Corpus()
+    server = None
+    if args.mode == "replay":
+        transport = ReplayTransport(corpus)
+    else:
+        server, base_url = start_standin_server(corpus)
+        transport = StandinTransport(base_url)
+    utils.set_replay_transport(transport)
+    try:
+        results = run(corpus, args.repeat, args.cache)
+    finally:
+        utils.set_replay_transport(None)
+        if server:
+            server.shutdown()
+
+    print_report(results, args.mode)
+    if server:
+        pool = transport.stats()["_total"]
+        print(f"连接复用：{pool['requests']} 次请求，新建 {pool['connections']} 个连接，"
+              f"复用率 {pool['reuse_rate']:.0%}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    sys.exit(0 if all(r["ok"] for r in results.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
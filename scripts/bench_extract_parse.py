@@ -0,0 +1,105 @@
+"""
+笔记页解析微基准
+对 scripts/fixtures/xhs/ 下保存的页面，比较旧的多遍正则解析与 api.py 中
+单遍 head 解析 + INITIAL_STATE 截取解析的每页 CPU 耗时。
+
+用法：python scripts/bench_extract_parse.py [--repeat 200]
+"""
+
+import re
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import api  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "xhs"
+
+
+def parse_legacy(html: str) -> dict:
+    """改造前 try_extract_xhs 的解析步骤（对照组）"""
+    title, text, images, state = "", "", [], None
+    for pat in [
+        r'<meta[^>]+property="og:title"[^>]+content="([^"]*)"',
+        r'<meta[^>]+content="([^"]*)"[^>]+property="og:title"',
+    ]:
+        t = re.search(pat, html)
+        if t:
+            title = t.group(1)
+            break
+    for pat in [
+        r'<meta[^>]+property="og:description"[^>]+content="([^"]*)"',
+        r'<meta[^>]+name="description"[^>]+content="([^"]*)"',
+        r'<meta[^>]+content="([^"]*)"[^>]+property="og:description"',
+    ]:
+        d = re.search(pat, html)
+        if d and len(d.group(1)) > len(text):
+            text = d.group(1)
+    for pat in [
+        r'<meta[^>]+property="og:image"[^>]+content="([^"]*)"',
+        r'<meta[^>]+content="([^"]*)"[^>]+property="og:image"',
+    ]:
+        for m in re.finditer(pat, html):
+            if m.group(1) and m.group(1) not in images:
+                images.append(m.group(1))
+    m = re.search(r'window\.__INITIAL_STATE__\s*=\s*(\{.+?\})\s*</script>', html, re.DOTALL)
+    if m:
+        try:
+            state = json.loads(re.sub(r":\s*undefined", ": null", m.group(1)))
+        except json.JSONDecodeError:
+            state = None
+    title_tag = re.search(r'<title[^>]*>([^<]+)</title>', html)
+    return {"og_title": title, "og_text": text, "og_images": len(images), "state": state is not None,
+            "title_tag": title_tag.group(1).strip() if title_tag else ""}
+
+
+def parse_current(html: str) -> dict:
+    head = api._parse_head(html)
+    text = ""
+    for key in ("og:description", "description"):
+        if len(head.meta.get(key, "")) > len(text):
+            text = head.meta[key]
+    try:
+        state = api._load_initial_state(html)
+    except json.JSONDecodeError:
+        state = None
+    return {"og_title": head.meta.get("og:title", ""), "og_text": text, "og_images": len(head.images),
+            "state": state is not None, "title_tag": head.title.strip()}
+
+
+def cpu_per_page(fn, html: str, repeat: int) -> float:
+    fn(html)
+    start = time.process_time()
+    for _ in range(repeat):
+        fn(html)
+    return (time.process_time() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    pages = sorted(FIXTURES.glob("*.html"))
+    print(f"{'页面':<28}{'大小':>9}{'旧 ms':>9}{'新 ms':>9}{'加速':>7}  结果差异")
+    total_old = total_new = 0.0
+    for path in pages:
+        html = path.read_text(encoding="utf-8")
+        old_ms = cpu_per_page(parse_legacy, html, args.repeat)
+        new_ms = cpu_per_page(parse_current, html, args.repeat)
+        total_old += old_ms
+        total_new += new_ms
+        old, new = parse_legacy(html), parse_current(html)
+        diff = ", ".join(f"{k}: {old[k]!r} → {new[k]!r}" for k in old if old[k] != new[k]) or "—"
+        print(f"{path.name:<28}{len(html) // 1024:>7}KB{old_ms:>9.3f}{new_ms:>9.3f}"
+              f"{old_ms / new_ms:>6.1f}x  {diff}")
+    if pages:
+        print(f"\n平均每页 CPU：旧 {total_old / len(pages):.3f} ms → 新 {total_new / len(pages):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+热点 SQL 执行计划回归检查
+在合成的大数据量库上，对 utils.py 中的热点查询（含 ADMIN_SQL 看板查询）执行
+EXPLAIN QUERY PLAN，计划中出现 SCAN（含 SCAN … USING INDEX 的整个索引遍历）且该表
+未在 allowed 中显式放行（附行数上界）时以非零状态退出；只有 SEARCH（按键定位）才算走了索引。
+
+用法：python scripts/check_query_plans.py [--users 20000] [--history 100000] [--events 200000]
+"""
+
+import sys
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import utils  # noqa: E402
+from config import ADMIN_LIST_LIMIT, LLM_CACHE_MAX_ROWS, IMAGE_STORE_MAX_BYTES  # noqa: E402
+
+_A = utils.ADMIN_SQL
+_TWO = "?, ?"
+
+# (名称, SQL, 参数, {允许 SCAN 的表/别名: 读取行数上界})
+# SQL 直接取自 utils（运行时用的同一份字符串），改查询后本检查自动覆盖新语句。
+# 放行的 SCAN 必须写明行数上界：ORDER BY … LIMIT 沿索引只读前 N 行，或汇总表
+# 行数只与天数/行业数相关，或低频维护任务本来就要遍历、且表大小有上限。
+HOT_QUERIES = [
+    ("get_history", utils._HISTORY_RECENT_SQL, ("U00042", 10), {}),
+    ("quota_ledger_load", utils._QUOTA_USED_SQL, ("U00042",), {}),
+    ("get_user_tier", utils._USER_TIER_SQL, ("U00042",), {}),
+    ("register_or_login", utils._USER_LOGIN_SQL, ("13800000042",), {}),
+    ("load_store_profile", utils._STORE_PROFILE_SQL, ("13800000042", "food"), {}),
+    ("extract_cache_lookup", utils._EXTRACT_CACHE_LOOKUP_SQL.format(marks=_TWO),
+     ("note:0123456789abcdef01234567", "url:xhslink.com/a/abc"), {}),
+    ("short_link_lookup", utils._SHORT_LINK_LOOKUP_SQL, ("xhslink.com/a/abc",), {}),
+    ("extract_cache_purge", utils._EXTRACT_CACHE_PURGE_SQL, (), {}),
+    ("short_link_purge", utils._SHORT_LINK_PURGE_SQL, (), {}),
+    ("llm_cache_lookup", utils._LLM_CACHE_LOOKUP_SQL, ("0" * 64,), {}),
+    ("llm_cache_touch", utils._LLM_CACHE_TOUCH_SQL, ("0" * 64,), {}),
+    ("llm_cache_purge", utils._LLM_CACHE_PURGE_SQL, (), {}),
+    ("llm_cache_trim", utils._LLM_CACHE_TRIM_SQL, (LLM_CACHE_MAX_ROWS,),
+     {"llm_cache": f"≤ {LLM_CACHE_MAX_ROWS} + 两次清理之间的新增行（每次清理都裁到上限）"}),
+    ("image_url_lookup", utils._IMAGE_URL_LOOKUP_SQL, ("https://sns-img.xhscdn.com/abc",), {}),
+    ("image_blob_load", utils._IMAGE_BLOB_FMT_SQL, ("0" * 64,), {}),
+    ("image_blob_touch", utils._IMAGE_BLOB_TOUCH_SQL, ("0" * 64,), {}),
+    ("image_store_total", utils._IMAGE_STORE_TOTAL_SQL, (),
+     {"image_blobs": f"≤ {IMAGE_STORE_MAX_BYTES >> 20} MB / 单图大小，每 IMAGE_STORE_EVICT_EVERY 次写入一次"}),
+    ("image_store_evict_order", utils._IMAGE_EVICT_ORDER_SQL, (),
+     {"image_blobs": "同上，只在总大小超限时执行，读到腾出 10% 空间为止"}),
+    ("image_store_evict_blobs", utils._IMAGE_EVICT_BLOBS_SQL.format(marks=_TWO), ("0" * 64, "1" * 64), {}),
+    ("image_store_evict_urls", utils._IMAGE_EVICT_URLS_SQL.format(marks=_TWO), ("0" * 64, "1" * 64), {}),
+    ("event_users_trigger", utils._EVENT_USER_SEEN_SQL.format(code="?"), ("U00042",), {}),
+    ("admin_total_users", _A["total_users"], (), {}),
+    ("admin_registered_users", _A["registered_users"], (), {}),
+    ("admin_total_gens", _A["total_gens"], (),
+     {"gen_daily_rollup": "≤ 天数 × 行业数 × 模式数 × 图片档位数"}),
+    ("admin_gens_since", _A["gens_since"], ("2026-01-01",), {}),
+    ("admin_feedback_count", _A["feedback_count"], (), {}),
+    ("admin_extract_total", _A["extract_total"], (), {}),
+    ("admin_extract_ok", _A["extract_ok"], (), {}),
+    ("admin_daily_trend", _A["daily_trend"], ("2026-01-01",), {}),
+    ("admin_quota_list", _A["quota_list"], (),
+     {"quota_usage": f"≤ {ADMIN_LIST_LIMIT}（沿 idx_quota_used 倒序 LIMIT）"}),
+    ("admin_all_users", _A["all_users"], (),
+     {"u": f"≤ {ADMIN_LIST_LIMIT}（沿 idx_users_last_login 倒序 LIMIT）"}),
+    ("admin_user_ranking", _A["user_ranking"], (),
+     {"g": "≤ 20（沿 idx_gen_user_rollup_count 倒序 LIMIT）"}),
+    ("admin_industry", _A["industry"], (),
+     {"gen_daily_rollup": "≤ 天数 × 行业数 × 模式数 × 图片档位数"}),
+    ("admin_mode", _A["mode"], (),
+     {"gen_daily_rollup": "≤ 天数 × 行业数 × 模式数 × 图片档位数"}),
+    ("admin_image_tier", _A["image_tier"], (),
+     {"gen_daily_rollup": "≤ 天数 × 行业数 × 模式数 × 图片档位数"}),
+    ("admin_custom_industry", _A["custom_industry"], (),
+     {"custom_industry_rollup": "≤ 不同自定义行业名数（每个名称一行）"}),
+    ("admin_recent_feedback", _A["recent_feedback"], (),
+     {"feedback": "≤ 15（沿 idx_feedback_created 倒序 LIMIT）"}),
+    ("admin_recent_events", _A["recent_events"], (),
+     {"e": "≤ 50（沿 idx_event_log_created 倒序 LIMIT）"}),
+    ("admin_hourly", _A["hourly"], (),
+     {"gen_hourly_rollup": "≤ 天数 × 24"}),
+]
+
+_INDUSTRIES = ["fitness", "beauty", "education", "food", "fashion", "custom"]
+
+
+def seed(conn: sqlite3.Connection, users: int, history: int, events: int):
+    """写入合成数据（只含查询计划需要的列）"""
+    rnd = random.Random(7)
+    start = datetime(2026, 1, 1)
+
+    def ts() -> str:
+        return (start + timedelta(seconds=rnd.randrange(180 * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (phone, invite_code, created_at, last_login) VALUES (?, ?, ?, ?)",
+        [(f"138{i:08d}", f"U{i:05d}", ts(), ts()) for i in range(users)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO quota_usage (invite_code, pro_gen_used) VALUES (?, ?)",
+        [(f"U{i:05d}", rnd.randrange(50)) for i in range(users)],
+    )
+    conn.executemany(
+        "INSERT INTO generation_history (invite_code, industry_id, mode, output_text, created_at) "
+        "VALUES (?, ?, ?, '', ?)",
+        [(f"U{rnd.randrange(users):05d}", rnd.choice(_INDUSTRIES),
+          rnd.choice(["rewrite", "create"]), ts()) for _ in range(history)],
+    )
+    conn.executemany(
+        "INSERT INTO event_log (invite_code, event_type, success, created_at) VALUES (?, ?, ?, ?)",
+        [(f"U{rnd.randrange(users):05d}", rnd.choice(["login", "extract_link", "generate_text"]),
+          int(rnd.random() < 0.8), ts()) for _ in range(events)],
+    )
+    conn.executemany(
+        "INSERT INTO feedback (invite_code, rating, created_at) VALUES (?, '不错', ?)",
+        [(f"U{rnd.randrange(users):05d}", ts()) for _ in range(max(users // 10, 1))],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO store_profiles (phone, industry) VALUES (?, ?)",
+        [(f"138{i:08d}", rnd.choice(_INDUSTRIES)) for i in range(users)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO extract_cache (cache_key, payload, created_at, expires_at) VALUES (?, '{}', ?, ?)",
+        [(f"note:{i:024x}", ts(), ts()) for i in range(users)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO short_link_cache (short_url, resolved_url, created_at, expires_at) "
+        "VALUES (?, '', ?, ?)",
+        [(f"xhslink.com/a/{i:x}", ts(), ts()) for i in range(users)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO llm_cache (cache_key, provider, model, response, created_at, last_access, expires_at) "
+        "VALUES (?, 'deepseek', 'deepseek-chat', '', ?, ?, ?)",
+        [(f"{i:064x}", ts(), ts(), ts()) for i in range(users)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO image_blobs (digest, fmt, size, created_at, last_access) VALUES (?, 'JPEG', ?, ?, ?)",
+        [(f"{i:064x}", rnd.randrange(50_000, 500_000), ts(), ts()) for i in range(users)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO image_url_index (url, digest) VALUES (?, ?)",
+        [(f"https://sns-img.xhscdn.com/{i:x}", f"{i:064x}") for i in range(users)],
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+
+
+def full_scans(plan: list, allowed: dict) -> list:
+    """从执行计划中找出未放行的 SCAN（整表或整个索引遍历）"""
+    bad = []
+    for row in plan:
+        detail = row["detail"]
+        if not detail.startswith("SCAN "):
+            continue
+        target = detail.split()[1]
+        if target != "CONSTANT" and target not in allowed:
+            bad.append(detail)
+    return bad
+
+
+def uncovered_admin_sql() -> list:
+    """ADMIN_SQL 里没有纳入检查的查询（新增看板查询时提醒补上）"""
+    checked = {sql for _, sql, _, _ in HOT_QUERIES}
+    return [name for name, sql in utils.ADMIN_SQL.items() if sql not in checked]
+
+
+def check(conn: sqlite3.Connection) -> int:
+    failures = 0
+    for name, sql, params, allowed in HOT_QUERIES:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        bad = full_scans(plan, allowed)
+        failures += bool(bad)
+        print(f"[{'FAIL' if bad else ' OK '}] {name}")
+        for row in plan:
+            print(f"         {row['detail']}")
+        for target, bound in allowed.items():
+            print(f"         放行 SCAN {target}：{bound}")
+    for name in uncovered_admin_sql():
+        failures += 1
+        print(f"[FAIL] ADMIN_SQL[{name!r}] 未纳入 HOT_QUERIES")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--history", type=int, default=100000)
+    parser.add_argument("--events", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        utils.DB_PATH = Path(tmp) / "plans.db"
+        conn = utils.get_db()
+        try:
+            seed(conn, args.users, args.history, args.events)
+            failures = check(conn)
+        finally:
+            conn.close()
+    print(f"\n{len(HOT_QUERIES) - failures}/{len(HOT_QUERIES)} 条查询通过")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+小红书提取离线回放
+按 scripts/fixtures/xhs/corpus.json 中录制的响应回答请求，不访问真实站点：
+- ReplayTransport：httpx transport，配合 utils.set_replay_transport() 让
+  make_async_client 创建的所有客户端走回放（进程内，无网络开销）
+- 本地替身 HTTP 服务：同一份语料通过 127.0.0.1 上的真实 HTTP 提供，路径为
+  /<原域名>/<原路径>；StandinTransport 把请求改写到替身服务，测的是真实的
+  socket / HTTP 解析开销，而调用方看到的仍是原 URL
+
+corpus.json 的 routes 以「域名/路径」（不含参数）为键，值为：
+    {"file": "og_full.html"}                 200 + fixtures 中的页面
+    {"status": 404, "body": "..."}           指定状态码和内容
+    {"status": 302, "location": "https://…"} 重定向
+    {"sequence": [route, route, ...]}        同一 URL 依次返回（循环）
+    {"timeout": true}                        回放时抛超时；替身服务直接断开连接
+*.xhscdn.com 的任何请求都返回一张小 JPEG。
+
+用法：python scripts/xhs_replay.py serve [--port 8765]
+"""
+
+import io
+import sys
+import json
+import argparse
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import httpx
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import _PooledAsyncTransport  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "xhs"
+
+
+def route_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{(parts.hostname or '').lower()}{parts.path.rstrip('/')}"
+
+
+class Corpus:
+    """录制语料：按 URL 查找响应，sequence 路由按命中次数轮换"""
+
+    def __init__(self, path: Path = FIXTURES / "corpus.json"):
+        data = json.loads(path.read_text(encoding="utf-8"))
+        self.root = path.parent
+        self.routes: dict = data["routes"]
+        self.cases: list = data["cases"]
+        self._hits: dict = defaultdict(int)
+        self._lock = threading.Lock()
+        self._files: dict[str, bytes] = {}
+        buf = io.BytesIO()
+        Image.new("RGB", (108, 144), (255, 36, 66)).save(buf, "JPEG", quality=80)
+        self._image = buf.getvalue()
+
+    def _body(self, route: dict) -> bytes:
+        if "file" in route:
+            name = route["file"]
+            if name not in self._files:
+                self._files[name] = (self.root / name).read_bytes()
+            return self._files[name]
+        return route.get("body", "").encode("utf-8")
+
+    def respond(self, url: str):
+        """返回 (状态码, headers, body)；未录制的 URL 返回 404，超时路由返回 None"""
+        key = route_key(url)
+        if key.split("/", 1)[0].endswith("xhscdn.com"):
+            return 200, {"Content-Type": "image/jpeg"}, self._image
+        route = self.routes.get(key)
+        if route is None:
+            return 404, {"Content-Type": "text/plain"}, b"not recorded"
+        if "sequence" in route:
+            with self._lock:
+                n = self._hits[key]
+                self._hits[key] += 1
+            route = route["sequence"][n % len(route["sequence"])]
+        if route.get("timeout"):
+            return None
+        headers = {"Content-Type": "text/html; charset=utf-8"}
+        if "location" in route:
+            headers["Location"] = route["location"]
+        return route.get("status", 200), headers, self._body(route)
+
+    def reset(self):
+        with self._lock:
+            self._hits.clear()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """httpx transport：请求不出进程，直接由 Corpus 回答"""
+
+    def __init__(self, corpus: Corpus):
+        self.corpus = corpus
+        self.sent = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.sent += 1
+        answer = self.corpus.respond(str(request.url))
+        if answer is None:
+            raise httpx.ReadTimeout(f"replay timeout: {request.url}", request=request)
+        status, headers, body = answer
+        return httpx.Response(status, headers=headers, request=request,
+                              content=b"" if request.method == "HEAD" else body)
+
+
+def start_standin_server(corpus: Corpus, port: int = 0):
+    """在 127.0.0.1 启动替身服务，返回 (server, base_url)；server.shutdown() 停止"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _answer(self, with_body: bool):
+            # 路径形如 /<原域名>/<原路径>
+            answer = corpus.respond("https:/" + self.path)
+            if answer is None:
+                self.close_connection = True
+                return
+            status, headers, body = answer
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if with_body:
+                self.wfile.write(body)
+
+        def do_GET(self):
+            self._answer(True)
+
+        def do_HEAD(self):
+            self._answer(False)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, name="xhs-standin", daemon=True).start()
+    return server, base_url
+
+
+def to_standin_url(url: str, base_url: str) -> str:
+    """把真实 URL 改写为指向替身服务的 URL（保留参数）"""
+    parts = urlsplit(url)
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{base_url}/{parts.hostname}{parts.path}{query}"
+
+
+class StandinTransport(_PooledAsyncTransport):
+    """把请求转发到替身服务的连接池 transport（与线上共享池同一实现，stats() 可看连接复用）；
+    响应的 url 还原为原地址"""
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        original = request.url
+        request.url = httpx.URL(to_standin_url(str(original), self.base_url))
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            request.url = original
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动小红书替身 HTTP 服务")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    serve = sub.add_parser("serve")
+    serve.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    corpus = Corpus()
+    server, base_url = start_standin_server(corpus, args.port)
+    print(f"替身服务：{base_url}")
+    for case in corpus.cases:
+        if "://" in case["input"]:
+            print(f"  {case['name']:<32} {to_standin_url(case['input'], base_url)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
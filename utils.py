@@ -6,116 +6,602 @@
 import io
 import re
 import json
+import os
+import queue
+import atexit
 import random
+import hashlib
 import sqlite3
 import tempfile
+import threading
+import time
+import zlib
 import zipfile
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
 
-import requests
+import httpx
 import streamlit as st
 from PIL import Image
 
-from config import DB_PATH, PRO_GEN_LIMIT, ADMIN_CODES, USER_AGENTS
+try:
+    import h2  # noqa: F401  装了 httpx[http2] 才启用 HTTP/2
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+from config import (
+    DB_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT,
+    DB_WRITE_BEHIND, DB_WRITE_QUEUE_SIZE, DB_WRITE_BATCH_SIZE, DB_WRITE_FLUSH_MS,
+    HISTORY_COMPRESS_MIN_BYTES, QUOTA_FLUSH_INTERVAL, ACCOUNT_SNAPSHOT_TTL,
+    ADMIN_PANEL_TTLS, ADMIN_DEFAULT_TTL, ADMIN_LIST_LIMIT,
+    EXTRACT_CACHE_PURGE_EVERY, LLM_CACHE_MAX_ROWS, IMAGE_STORE_DIR, IMAGE_STORE_MAX_BYTES, IMAGE_STORE_EVICT_EVERY,
+    IMAGE_TOUCH_INTERVAL, IMAGE_PIN_TTL,
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY,
+    LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE, LLM_KEEPALIVE_EXPIRY, LLM_TIMEOUT, LLM_CONNECT_TIMEOUT,
+    PRO_GEN_LIMIT, TIER_PLANS, ADMIN_CODES, USER_AGENTS,
+)
 
 
 # ═══════════════════════════════════════════════════════
 #  SQLite 数据库
 # ═══════════════════════════════════════════════════════
 
-def _get_db() -> sqlite3.Connection:
-    """获取数据库连接（带自动建表）"""
-    conn = sqlite3.connect(str(DB_PATH), timeout=10)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    _init_tables(conn)
-    return conn
-
-
-def _init_tables(conn: sqlite3.Connection):
-    """建表（如果不存在）"""
-    conn.executescript("""
-        CREATE TABLE IF NOT EXISTS users (
-            phone        TEXT PRIMARY KEY,
-            invite_code  TEXT NOT NULL,
-            created_at   TEXT DEFAULT (datetime('now')),
-            last_login   TEXT DEFAULT (datetime('now')),
-            login_count  INTEGER DEFAULT 1
-        );
-        CREATE INDEX IF NOT EXISTS idx_users_invite ON users(invite_code);
-        CREATE TABLE IF NOT EXISTS quota_usage (
-            invite_code  TEXT PRIMARY KEY,
-            pro_gen_used INTEGER DEFAULT 0,
-            updated_at   TEXT DEFAULT (datetime('now'))
-        );
-        CREATE TABLE IF NOT EXISTS generation_history (
-            id           INTEGER PRIMARY KEY AUTOINCREMENT,
-            invite_code  TEXT NOT NULL,
-            industry_id  TEXT NOT NULL,
-            mode         TEXT NOT NULL,
-            input_title  TEXT DEFAULT '',
-            input_text   TEXT DEFAULT '',
-            input_profile TEXT DEFAULT '',
-            output_text  TEXT DEFAULT '',
-            image_count  INTEGER DEFAULT 0,
-            image_tier   TEXT DEFAULT '',
-            city         TEXT DEFAULT '',
-            created_at   TEXT DEFAULT (datetime('now'))
-        );
-        CREATE TABLE IF NOT EXISTS feedback (
-            id           INTEGER PRIMARY KEY AUTOINCREMENT,
-            invite_code  TEXT NOT NULL,
-            rating       TEXT NOT NULL,
-            feedback_text TEXT DEFAULT '',
-            industry_id  TEXT DEFAULT '',
-            mode         TEXT DEFAULT '',
-            created_at   TEXT DEFAULT (datetime('now'))
-        );
-        CREATE TABLE IF NOT EXISTS event_log (
-            id           INTEGER PRIMARY KEY AUTOINCREMENT,
-            invite_code  TEXT NOT NULL,
-            event_type   TEXT NOT NULL,
-            industry_id  TEXT DEFAULT '',
-            mode         TEXT DEFAULT '',
-            detail       TEXT DEFAULT '',
+class _PooledConnection:
+    """连接池借出的连接：用法与 sqlite3.Connection 相同，close() 时归还连接池"""
+
+    __slots__ = ("_conn", "_pool")
+
+    def __init__(self, conn: sqlite3.Connection, pool: "_ConnectionPool"):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("连接已归还连接池")
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+
+class _ConnectionPool:
+    """进程级有界连接池：所有 Streamlit 会话共享，迁移每个进程只检查一次"""
+
+    def __init__(self, path, max_size: int, timeout: float):
+        self._path = str(path)
+        self._max_size = max_size
+        self._timeout = timeout
+        self._idle: list[sqlite3.Connection] = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._stats = {"checkouts": 0, "waits": 0, "wait_ms": 0.0, "timeouts": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path, timeout=10, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                _run_migrations(conn)
+                self._schema_ready = True
+
+    def acquire(self) -> _PooledConnection:
+        with self._cond:
+            self._stats["checkouts"] += 1
+            if not self._idle and self._open >= self._max_size:
+                self._stats["waits"] += 1
+                _thread_waits.count = getattr(_thread_waits, "count", 0) + 1
+                start = time.monotonic()
+                deadline = start + self._timeout
+                while not self._idle and self._open >= self._max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise sqlite3.OperationalError("数据库连接池已耗尽，请稍后重试")
+                    self._cond.wait(remaining)
+                self._stats["wait_ms"] += (time.monotonic() - start) * 1000
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open += 1
+        if conn is None:
+            try:
+                conn = self._connect()
+            except sqlite3.Error:
+                self._discard()
+                raise
+        try:
+            self._ensure_schema(conn)
+        except sqlite3.Error:
+            self.release(conn)
+            raise
+        return _PooledConnection(conn, self)
+
+    def release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # 连接已损坏：直接丢弃，下次借用时重建
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            self._discard()
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def _discard(self):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                **self._stats,
+                "wait_ms": round(self._stats["wait_ms"], 1),
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "max_size": self._max_size,
+            }
+
+
+_pool: _ConnectionPool | None = None
+_pool_lock = threading.Lock()
+_thread_waits = threading.local()
+
+
+def _get_pool() -> _ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _ConnectionPool(DB_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+    return _pool
+
+
+def _get_db() -> _PooledConnection:
+    """从连接池借出一个数据库连接（首次借用时自动建表），用完 close() 归还"""
+    return _get_pool().acquire()
+
+
+def get_db_pool_stats() -> dict:
+    """连接池统计：借出次数、等待次数/耗时、超时次数、打开/空闲/占用连接数"""
+    return _get_pool().stats()
+
+
+def get_thread_pool_waits() -> int:
+    """当前线程累计等待连接池的次数（压测脚本按函数归因用）"""
+    return getattr(_thread_waits, "count", 0)
+
+
+# ── Schema 迁移 ──
+# 按版本号顺序登记，每个迁移只执行一次；当前版本记录在 PRAGMA user_version，
+# 执行历史记录在 schema_version 表。已是最新版本时只需读一次 user_version。
+
+_BASELINE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        phone        TEXT PRIMARY KEY,
+        invite_code  TEXT NOT NULL,
+        created_at   TEXT DEFAULT (datetime('now')),
+        last_login   TEXT DEFAULT (datetime('now')),
+        login_count  INTEGER DEFAULT 1
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_users_invite ON users(invite_code)",
+    """CREATE TABLE IF NOT EXISTS quota_usage (
+        invite_code  TEXT PRIMARY KEY,
+        pro_gen_used INTEGER DEFAULT 0,
+        updated_at   TEXT DEFAULT (datetime('now'))
+    )""",
+    """CREATE TABLE IF NOT EXISTS generation_history (
+        id           INTEGER PRIMARY KEY AUTOINCREMENT,
+        invite_code  TEXT NOT NULL,
+        industry_id  TEXT NOT NULL,
+        mode         TEXT NOT NULL,
+        input_title  TEXT DEFAULT '',
+        input_text   TEXT DEFAULT '',
+        input_profile TEXT DEFAULT '',
+        output_text  TEXT DEFAULT '',
+        image_count  INTEGER DEFAULT 0,
+        image_tier   TEXT DEFAULT '',
+        city         TEXT DEFAULT '',
+        created_at   TEXT DEFAULT (datetime('now'))
+    )""",
+    """CREATE TABLE IF NOT EXISTS feedback (
+        id           INTEGER PRIMARY KEY AUTOINCREMENT,
+        invite_code  TEXT NOT NULL,
+        rating       TEXT NOT NULL,
+        feedback_text TEXT DEFAULT '',
+        industry_id  TEXT DEFAULT '',
+        mode         TEXT DEFAULT '',
+        created_at   TEXT DEFAULT (datetime('now'))
+    )""",
+    """CREATE TABLE IF NOT EXISTS event_log (
+        id           INTEGER PRIMARY KEY AUTOINCREMENT,
+        invite_code  TEXT NOT NULL,
+        event_type   TEXT NOT NULL,
+        industry_id  TEXT DEFAULT '',
+        mode         TEXT DEFAULT '',
+        detail       TEXT DEFAULT '',
+        success      INTEGER DEFAULT 1,
+        created_at   TEXT DEFAULT (datetime('now'))
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_event_log_type ON event_log(event_type)",
+    "CREATE INDEX IF NOT EXISTS idx_event_log_code ON event_log(invite_code)",
+    "CREATE INDEX IF NOT EXISTS idx_history_code ON generation_history(invite_code)",
+    """CREATE TABLE IF NOT EXISTS store_profiles (
+        id           INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone        TEXT NOT NULL,
+        industry     TEXT NOT NULL,
+        profile_data TEXT NOT NULL DEFAULT '{}',
+        created_at   TEXT DEFAULT (datetime('now')),
+        updated_at   TEXT DEFAULT (datetime('now')),
+        UNIQUE(phone, industry)
+    )""",
+]
+
+
+def _m001_baseline(conn: sqlite3.Connection):
+    """基础表结构（IF NOT EXISTS，兼容引入版本号之前建好的库）"""
+    for stmt in _BASELINE_SCHEMA:
+        conn.execute(stmt)
+
+
+def _m002_quota_tier(conn: sqlite3.Connection):
+    """quota_usage 增加 tier 列"""
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(quota_usage)")}
+    if "tier" not in cols:
+        conn.execute("ALTER TABLE quota_usage ADD COLUMN tier TEXT DEFAULT 'free'")
+
+
+def _m003_legacy_tmp_usage(conn: sqlite3.Connection):
+    """导入旧版 /tmp/ 下的 JSON 配额数据（如果存在）"""
+    old_dir = Path(tempfile.gettempdir()) / "xhs_agent_v5_usage"
+    if not old_dir.exists():
+        return
+    for f in old_dir.glob("*.json"):
+        try:
+            code = f.stem.upper()
+            old_val = json.loads(f.read_text()).get("pro_gen", 0)
+        except (OSError, ValueError, AttributeError):
+            continue
+        if old_val > 0:
+            conn.execute(
+                "INSERT OR IGNORE INTO quota_usage (invite_code, pro_gen_used) VALUES (?, ?)",
+                (code, old_val),
+            )
+
+
+def _m004_quota_journal_state(conn: sqlite3.Connection):
+    """配额日志检查点：记录已合并进 quota_usage 的最大日志序号"""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS quota_journal_state ("
+        " id       INTEGER PRIMARY KEY CHECK (id = 1),"
+        " last_seq INTEGER NOT NULL DEFAULT 0)"
+    )
+
+
+# 管理后台汇总表：由触发器在插入时增量维护，看板只读 O(天数) 行
+_EVENT_USER_SEEN_SQL = "SELECT 1 FROM event_users WHERE invite_code = {code}"
+_ROLLUP_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS gen_daily_rollup (
+        day          TEXT NOT NULL,
+        industry_id  TEXT NOT NULL,
+        mode         TEXT NOT NULL,
+        image_tier   TEXT NOT NULL DEFAULT '',
+        cnt          INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, industry_id, mode, image_tier)
+    )""",
+    """CREATE TABLE IF NOT EXISTS gen_hourly_rollup (
+        day          TEXT NOT NULL,
+        hour         INTEGER NOT NULL,
+        cnt          INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour)
+    )""",
+    """CREATE TABLE IF NOT EXISTS gen_user_rollup (
+        invite_code  TEXT PRIMARY KEY,
+        gen_count    INTEGER NOT NULL DEFAULT 0,
+        last_gen     TEXT NOT NULL DEFAULT ''
+    )""",
+    """CREATE TABLE IF NOT EXISTS gen_user_industry_rollup (
+        invite_code  TEXT NOT NULL,
+        industry_id  TEXT NOT NULL,
+        cnt          INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (invite_code, industry_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS custom_industry_rollup (
+        industry_name TEXT PRIMARY KEY,
+        cnt          INTEGER NOT NULL DEFAULT 0,
+        last_used    TEXT NOT NULL DEFAULT ''
+    )""",
+    """CREATE TABLE IF NOT EXISTS event_daily_rollup (
+        day          TEXT NOT NULL,
+        event_type   TEXT NOT NULL,
+        success      INTEGER NOT NULL,
+        cnt          INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, event_type, success)
+    )""",
+    """CREATE TABLE IF NOT EXISTS event_users (
+        invite_code  TEXT PRIMARY KEY,
+        first_day    TEXT NOT NULL DEFAULT ''
+    )""",
+    """CREATE TABLE IF NOT EXISTS rollup_counters (
+        name         TEXT PRIMARY KEY,
+        value        INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS trg_history_rollup AFTER INSERT ON generation_history
+    BEGIN
+        INSERT INTO gen_daily_rollup (day, industry_id, mode, image_tier, cnt)
+        VALUES (DATE(NEW.created_at), NEW.industry_id, NEW.mode, COALESCE(NEW.image_tier, ''), 1)
+        ON CONFLICT(day, industry_id, mode, image_tier) DO UPDATE SET cnt = cnt + 1;
+        INSERT INTO gen_hourly_rollup (day, hour, cnt)
+        VALUES (DATE(NEW.created_at), CAST(strftime('%H', NEW.created_at) AS INTEGER), 1)
+        ON CONFLICT(day, hour) DO UPDATE SET cnt = cnt + 1;
+        INSERT INTO gen_user_rollup (invite_code, gen_count, last_gen)
+        VALUES (NEW.invite_code, 1, NEW.created_at)
+        ON CONFLICT(invite_code) DO UPDATE SET
+            gen_count = gen_count + 1, last_gen = MAX(last_gen, excluded.last_gen);
+        INSERT INTO gen_user_industry_rollup (invite_code, industry_id, cnt)
+        VALUES (NEW.invite_code, NEW.industry_id, 1)
+        ON CONFLICT(invite_code, industry_id) DO UPDATE SET cnt = cnt + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_history_custom_rollup AFTER INSERT ON generation_history
+    WHEN NEW.custom_industry != ''
+    BEGIN
+        INSERT INTO custom_industry_rollup (industry_name, cnt, last_used)
+        VALUES (NEW.custom_industry, 1, NEW.created_at)
+        ON CONFLICT(industry_name) DO UPDATE SET
+            cnt = cnt + 1, last_used = MAX(last_used, excluded.last_used);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_event_rollup AFTER INSERT ON event_log
+    BEGIN
+        INSERT INTO event_daily_rollup (day, event_type, success, cnt)
+        VALUES (DATE(NEW.created_at), NEW.event_type, NEW.success, 1)
+        ON CONFLICT(day, event_type, success) DO UPDATE SET cnt = cnt + 1;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_event_new_user AFTER INSERT ON event_log
+    WHEN NOT EXISTS ({_EVENT_USER_SEEN_SQL.format(code="NEW.invite_code")})
+    BEGIN
+        INSERT INTO event_users (invite_code, first_day) VALUES (NEW.invite_code, DATE(NEW.created_at));
+        INSERT INTO rollup_counters (name, value) VALUES ('event_users', 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    END""",
+]
+
+_ROLLUP_BACKFILL = [
+    "INSERT INTO gen_daily_rollup (day, industry_id, mode, image_tier, cnt) "
+    "SELECT DATE(created_at), industry_id, mode, COALESCE(image_tier, ''), COUNT(*) "
+    "FROM generation_history GROUP BY 1, 2, 3, 4",
+    "INSERT INTO gen_hourly_rollup (day, hour, cnt) "
+    "SELECT DATE(created_at), CAST(strftime('%H', created_at) AS INTEGER), COUNT(*) "
+    "FROM generation_history GROUP BY 1, 2",
+    "INSERT INTO gen_user_rollup (invite_code, gen_count, last_gen) "
+    "SELECT invite_code, COUNT(*), MAX(created_at) FROM generation_history GROUP BY invite_code",
+    "INSERT INTO gen_user_industry_rollup (invite_code, industry_id, cnt) "
+    "SELECT invite_code, industry_id, COUNT(*) FROM generation_history GROUP BY 1, 2",
+    "INSERT INTO custom_industry_rollup (industry_name, cnt, last_used) "
+    "SELECT custom_industry, COUNT(*), MAX(created_at) FROM generation_history "
+    "WHERE custom_industry != '' GROUP BY custom_industry",
+    "INSERT INTO event_daily_rollup (day, event_type, success, cnt) "
+    "SELECT DATE(created_at), event_type, success, COUNT(*) FROM event_log GROUP BY 1, 2, 3",
+    "INSERT INTO event_users (invite_code, first_day) "
+    "SELECT invite_code, DATE(MIN(created_at)) FROM event_log GROUP BY invite_code",
+    "INSERT INTO rollup_counters (name, value) SELECT 'event_users', COUNT(*) FROM event_users",
+]
+
+
+def _custom_industry_name(industry_id: str, input_profile: str) -> str:
+    """自定义行业的行业名（用于汇总），非自定义行业返回空串"""
+    if industry_id != "custom" or not input_profile:
+        return ""
+    try:
+        return json.loads(input_profile).get("industry_name") or "未填写"
+    except (ValueError, TypeError, AttributeError):
+        return "未填写"
+
+
+def _m005_admin_rollups(conn: sqlite3.Connection):
+    """管理后台汇总表 + 维护触发器，并用现有数据回填"""
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(generation_history)")}
+    if "custom_industry" not in cols:
+        conn.execute("ALTER TABLE generation_history ADD COLUMN custom_industry TEXT DEFAULT ''")
+    rows = conn.execute(
+        "SELECT id, input_profile FROM generation_history "
+        "WHERE industry_id = 'custom' AND input_profile != ''"
+    ).fetchall()
+    conn.executemany(
+        "UPDATE generation_history SET custom_industry = ? WHERE id = ?",
+        [(_custom_industry_name("custom", unpack_history_text(r["input_profile"])), r["id"])
+         for r in rows],
+    )
+    for stmt in _ROLLUP_SCHEMA + _ROLLUP_BACKFILL:
+        conn.execute(stmt)
+
+
+def _m006_hot_query_indexes(conn: sqlite3.Connection):
+    """按实际查询调整索引（scripts/check_query_plans.py 校验执行计划）"""
+    for stmt in [
+        # get_history：按用户取最近 N 条，索引直接给出有序结果
+        "CREATE INDEX IF NOT EXISTS idx_history_code_created "
+        "ON generation_history(invite_code, created_at)",
+        "DROP INDEX IF EXISTS idx_history_code",
+        # 管理后台「最近事件 / 最近反馈」按时间倒序 LIMIT
+        "CREATE INDEX IF NOT EXISTS idx_event_log_created ON event_log(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_feedback_created ON feedback(created_at)",
+        # 看板统计已改读汇总表，event_log 按类型 / 邀请码的索引不再有查询使用
+        "DROP INDEX IF EXISTS idx_event_log_type",
+        "DROP INDEX IF EXISTS idx_event_log_code",
+        "CREATE INDEX IF NOT EXISTS idx_event_rollup_type "
+        "ON event_daily_rollup(event_type, success)",
+        # 排序列表：配额榜、注册用户、活跃排行
+        "CREATE INDEX IF NOT EXISTS idx_quota_used ON quota_usage(pro_gen_used)",
+        "CREATE INDEX IF NOT EXISTS idx_users_last_login ON users(last_login)",
+        "CREATE INDEX IF NOT EXISTS idx_gen_user_rollup_count ON gen_user_rollup(gen_count)",
+    ]:
+        conn.execute(stmt)
+
+
+def _m007_extract_cache(conn: sqlite3.Connection):
+    """链接提取结果缓存（笔记ID / 规范化URL → 提取结果）"""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS extract_cache (
+            cache_key    TEXT PRIMARY KEY,
+            payload      TEXT NOT NULL,
             success      INTEGER DEFAULT 1,
-            created_at   TEXT DEFAULT (datetime('now'))
-        );
-        CREATE INDEX IF NOT EXISTS idx_event_log_type ON event_log(event_type);
-        CREATE INDEX IF NOT EXISTS idx_event_log_code ON event_log(invite_code);
-        CREATE INDEX IF NOT EXISTS idx_history_code ON generation_history(invite_code);
-        CREATE TABLE IF NOT EXISTS store_profiles (
-            id           INTEGER PRIMARY KEY AUTOINCREMENT,
-            phone        TEXT NOT NULL,
-            industry     TEXT NOT NULL,
-            profile_data TEXT NOT NULL DEFAULT '{}',
             created_at   TEXT DEFAULT (datetime('now')),
-            updated_at   TEXT DEFAULT (datetime('now')),
-            UNIQUE(phone, industry)
-        );
-    """)
-    # 迁移：为 quota_usage 添加 tier 列（已有表不受影响）
+            expires_at   TEXT NOT NULL
+        )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_extract_cache_expires ON extract_cache(expires_at)")
+
+
+def _m008_short_link_cache(conn: sqlite3.Connection):
+    """xhslink 短链接 → 展开后URL"""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS short_link_cache (
+            short_url    TEXT PRIMARY KEY,
+            resolved_url TEXT NOT NULL,
+            created_at   TEXT DEFAULT (datetime('now')),
+            expires_at   TEXT NOT NULL
+        )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_short_link_expires ON short_link_cache(expires_at)")
+
+
+def _m009_image_store(conn: sqlite3.Connection):
+    """图片内容寻址存储：blob 元数据（LRU 淘汰用）+ 图片URL → blob 索引"""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS image_blobs (
+            digest      TEXT PRIMARY KEY,
+            fmt         TEXT NOT NULL,
+            size        INTEGER NOT NULL,
+            width       INTEGER DEFAULT 0,
+            height      INTEGER DEFAULT 0,
+            created_at  TEXT DEFAULT (datetime('now')),
+            last_access TEXT DEFAULT (datetime('now'))
+        )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_blobs_access ON image_blobs(last_access)")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS image_url_index (
+            url        TEXT PRIMARY KEY,
+            digest     TEXT NOT NULL,
+            created_at TEXT DEFAULT (datetime('now'))
+        )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_url_digest ON image_url_index(digest)")
+
+
+def _m010_extract_strategy_stats(conn: sqlite3.Connection):
+    """提取策略统计：累计次数 / 成功数 / 耗时 + 滑动平均（调度用）"""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS extract_strategy_stats (
+            strategy     TEXT PRIMARY KEY,
+            attempts     INTEGER DEFAULT 0,
+            successes    INTEGER DEFAULT 0,
+            total_ms     REAL DEFAULT 0,
+            ewma_success REAL DEFAULT 1,
+            ewma_ms      REAL DEFAULT 0,
+            updated_at   TEXT DEFAULT (datetime('now'))
+        )"""
+    )
+
+
+def _m011_llm_cache(conn: sqlite3.Connection):
+    """大模型响应缓存（请求参数哈希 → 响应文本）"""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key   TEXT PRIMARY KEY,
+            provider    TEXT NOT NULL,
+            model       TEXT NOT NULL,
+            response    TEXT NOT NULL,
+            created_at  TEXT DEFAULT (datetime('now')),
+            last_access TEXT DEFAULT (datetime('now')),
+            expires_at  TEXT NOT NULL
+        )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache(expires_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+
+
+def _m012_admin_counters(conn: sqlite3.Connection):
+    """注册用户数 / 反馈条数计数器（插入触发器维护），看板不再 COUNT(*) 整表"""
+    for stmt in [
+        """CREATE TRIGGER IF NOT EXISTS trg_users_counter AFTER INSERT ON users
+        BEGIN
+            INSERT INTO rollup_counters (name, value) VALUES ('users', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_feedback_counter AFTER INSERT ON feedback
+        BEGIN
+            INSERT INTO rollup_counters (name, value) VALUES ('feedback', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END""",
+        "INSERT OR REPLACE INTO rollup_counters (name, value) SELECT 'users', COUNT(*) FROM users",
+        "INSERT OR REPLACE INTO rollup_counters (name, value) SELECT 'feedback', COUNT(*) FROM feedback",
+    ]:
+        conn.execute(stmt)
+
+
+_MIGRATIONS = [
+    (1, "baseline", _m001_baseline),
+    (2, "quota_usage.tier", _m002_quota_tier),
+    (3, "legacy_tmp_usage", _m003_legacy_tmp_usage),
+    (4, "quota_journal_state", _m004_quota_journal_state),
+    (5, "admin_rollups", _m005_admin_rollups),
+    (6, "hot_query_indexes", _m006_hot_query_indexes),
+    (7, "extract_cache", _m007_extract_cache),
+    (8, "short_link_cache", _m008_short_link_cache),
+    (9, "image_store", _m009_image_store),
+    (10, "extract_strategy_stats", _m010_extract_strategy_stats),
+    (11, "llm_cache", _m011_llm_cache),
+    (12, "admin_counters", _m012_admin_counters),
+]
+
+
+def _run_migrations(conn: sqlite3.Connection):
+    """执行未应用的迁移（BEGIN IMMEDIATE 保证多进程下只有一个执行者）"""
+    target = _MIGRATIONS[-1][0]
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= target:
+        return
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        conn.execute("ALTER TABLE quota_usage ADD COLUMN tier TEXT DEFAULT 'free'")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass  # 列已存在
-    # 一次性迁移旧 /tmp/ 数据（如果存在）
-    old_dir = Path(tempfile.gettempdir()) / "xhs_agent_v5_usage"
-    if old_dir.exists():
-        for f in old_dir.glob("*.json"):
-            try:
-                code = f.stem.upper()
-                old_val = json.loads(f.read_text()).get("pro_gen", 0)
-                if old_val > 0:
-                    conn.execute(
-                        "INSERT OR IGNORE INTO quota_usage (invite_code, pro_gen_used) VALUES (?, ?)",
-                        (code, old_val),
-                    )
-            except Exception:
-                pass
+        # 拿到写锁后重新读取：其他进程可能已经完成迁移
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            " version INTEGER PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " applied_at TEXT DEFAULT (datetime('now')))"
+        )
+        for version, name, migrate in _MIGRATIONS:
+            if version <= current:
+                continue
+            migrate(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO schema_version (version, name) VALUES (?, ?)",
+                (version, name),
+            )
+        if current < target:
+            conn.execute(f"PRAGMA user_version = {target:d}")
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 
 @st.cache_resource
@@ -125,60 +611,319 @@ def init_db():
     conn.close()
 
 
+# ── 后台批量写入 ──
+
+def _utc_now() -> str:
+    """与 SQLite datetime('now') 相同格式的 UTC 时间（入队时打时间戳）"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+_STOP = object()
+
+
+class _BatchWriter:
+    """后台写入线程：有界队列攒批，每 DB_WRITE_FLUSH_MS 毫秒或 DB_WRITE_BATCH_SIZE 条
+    用一个事务 executemany 落库。队列满时短暂等待，仍满则丢弃并计数。
+    key_index 指定行中的某一列作为键，按键统计还在队列里的行数（has_pending）。"""
+
+    def __init__(self, name: str, sql: str, key_index: int | None = None):
+        self.name = name
+        self._sql = sql
+        self._key_index = key_index
+        self._queue: queue.Queue = queue.Queue(maxsize=DB_WRITE_QUEUE_SIZE)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._stats = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "flushes": 0}
+        self._pending_keys: dict = {}
+
+    def _track(self, rows: list, n: int):
+        """按键增减队列中的行数（n=1 入队，n=-1 写完或丢弃）"""
+        if self._key_index is None:
+            return
+        with self._lock:
+            for row in rows:
+                key = row[self._key_index]
+                left = self._pending_keys.get(key, 0) + n
+                if left > 0:
+                    self._pending_keys[key] = left
+                else:
+                    self._pending_keys.pop(key, None)
+
+    def has_pending(self, key) -> bool:
+        """该键是否还有未落库的行"""
+        with self._lock:
+            return key in self._pending_keys
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name=f"db-writer-{self.name}", daemon=True,
+                    )
+                    self._thread.start()
+
+    def submit(self, row: tuple) -> bool:
+        """提交一行待写入数据；返回 False 表示因队列已满被丢弃"""
+        if not _write_behind:
+            self._write([row])
+            return True
+        self._ensure_thread()
+        self._track([row], 1)  # 先计数再入队：写线程可能在 put 返回前就写完这一行
+        try:
+            self._queue.put(row, timeout=0.05)
+        except queue.Full:
+            self._track([row], -1)
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待此前提交的数据全部落库"""
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.empty()
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """停止后台线程，退出前写完队列中剩余数据"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        interval = DB_WRITE_FLUSH_MS / 1000
+        while True:
+            batch, waiters, stop = [], [], False
+            item = self._queue.get()
+            deadline = time.monotonic() + interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or waiters or len(batch) >= DB_WRITE_BATCH_SIZE:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if stop:
+                # 退出前把队列里剩余的数据一起写掉
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                    elif item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._write(batch)
+                self._track(batch, -1)
+            for w in waiters:
+                w.set()
+            if stop:
+                return
+
+    def _write(self, rows: list):
+        conn = None
+        try:
+            conn = _get_db()
+            conn.executemany(self._sql, rows)
+            conn.commit()
+            self._count("written", len(rows))
+            self._count("flushes")
+        except sqlite3.Error:
+            self._count("failed", len(rows))
+        finally:
+            if conn:
+                conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "queued": self._queue.qsize()}
+
+
+_write_behind = DB_WRITE_BEHIND
+
+_event_writer = _BatchWriter(
+    "event_log",
+    "INSERT INTO event_log "
+    "(invite_code, event_type, industry_id, mode, detail, success, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+)
+_history_writer = _BatchWriter(
+    "generation_history",
+    "INSERT INTO generation_history "
+    "(invite_code, industry_id, mode, input_title, input_text, input_profile, "
+    " output_text, image_count, image_tier, city, custom_industry, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    key_index=0,
+)
+_strategy_writer = _BatchWriter(
+    "extract_strategy_stats",
+    "INSERT INTO extract_strategy_stats "
+    "(strategy, attempts, successes, total_ms, ewma_success, ewma_ms, updated_at) "
+    "VALUES (?, 1, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(strategy) DO UPDATE SET attempts = attempts + 1, "
+    "successes = successes + excluded.successes, total_ms = total_ms + excluded.total_ms, "
+    "ewma_success = excluded.ewma_success, ewma_ms = excluded.ewma_ms, "
+    "updated_at = excluded.updated_at",
+)
+_writers = [_event_writer, _history_writer, _strategy_writer]
+
+
+def set_sync_writes(enabled: bool = True):
+    """切换为同步直写（测试用）；切换前先写完队列中的数据"""
+    global _write_behind
+    if enabled:
+        flush_pending_writes()
+    _write_behind = not enabled
+
+
+def flush_pending_writes(timeout: float = 5.0) -> bool:
+    """等待所有后台写入（含配额增量）落库（管理后台读数前调用）"""
+    return all([w.flush(timeout) for w in _writers] + [_quota_ledger.flush()])
+
+
+def get_writer_stats() -> dict:
+    """各后台写入队列统计：入队/写入/丢弃/失败条数、flush 次数、当前积压"""
+    return {w.name: w.stats() for w in _writers}
+
+
+@atexit.register
+def _shutdown_writers():
+    for w in _writers:
+        w.close()
+    _quota_ledger.flush()
+
+
 def log_event(invite_code: str, event_type: str, industry_id: str = "",
               mode: str = "", detail: str = "", success: bool = True):
-    """记录一条事件日志（埋点）"""
+    """记录一条事件日志（埋点），由后台线程批量写入，不阻塞调用方"""
+    _event_writer.submit(
+        (invite_code, event_type, industry_id, mode, detail, 1 if success else 0, _utc_now())
+    )
+
+
+def record_strategy_result(strategy: str, success: bool, elapsed_ms: float,
+                           ewma_success: float, ewma_ms: float):
+    """记录一次提取策略执行结果（累计值 + 调用方算好的滑动平均），后台批量写入"""
+    _strategy_writer.submit(
+        (strategy, 1 if success else 0, elapsed_ms, ewma_success, ewma_ms, _utc_now())
+    )
+
+
+def get_strategy_stats() -> dict:
+    """各提取策略统计：{strategy: {attempts, successes, avg_ms, ewma_success, ewma_ms}}"""
     conn = None
     try:
         conn = _get_db()
-        conn.execute(
-            "INSERT INTO event_log (invite_code, event_type, industry_id, mode, detail, success) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            (invite_code, event_type, industry_id, mode, detail, 1 if success else 0),
-        )
-        conn.commit()
+        rows = conn.execute(
+            "SELECT strategy, attempts, successes, total_ms, ewma_success, ewma_ms "
+            "FROM extract_strategy_stats"
+        ).fetchall()
     except sqlite3.Error:
-        pass
+        return {}
     finally:
         if conn:
             conn.close()
+    return {
+        r["strategy"]: {
+            "attempts": r["attempts"], "successes": r["successes"],
+            "avg_ms": r["total_ms"] / r["attempts"] if r["attempts"] else 0.0,
+            "ewma_success": r["ewma_success"], "ewma_ms": r["ewma_ms"],
+        }
+        for r in rows
+    }
+
+
+# ── 生成记录大文本压缩 ──
+# 超过 HISTORY_COMPRESS_MIN_BYTES 的文本存为 BLOB：3 字节编码标记 + 压缩数据。
+# 普通 TEXT 值原样存取，旧数据无需迁移。
+
+_ZLIB_MARKER = b"zl1"
+
+
+def _pack_history_text(text: str):
+    """按需压缩生成记录中的大文本字段"""
+    data = (text or "").encode("utf-8")
+    if len(data) < HISTORY_COMPRESS_MIN_BYTES:
+        return text or ""
+    packed = _ZLIB_MARKER + zlib.compress(data, 6)
+    return packed if len(packed) < len(data) else text
+
+
+def unpack_history_text(value) -> str:
+    """还原 _pack_history_text 存入的字段（TEXT 原样返回）"""
+    if isinstance(value, (bytes, memoryview)):
+        value = bytes(value)
+        if value.startswith(_ZLIB_MARKER):
+            try:
+                return zlib.decompress(value[len(_ZLIB_MARKER):]).decode("utf-8")
+            except (zlib.error, UnicodeDecodeError):
+                return ""
+        return value.decode("utf-8", errors="replace")
+    return value or ""
+
+
+_HISTORY_PACKED_FIELDS = ("input_text", "input_profile", "output_text")
 
 
 def save_generation(invite_code: str, industry_id: str, mode: str,
                     input_title: str, input_text: str, input_profile: str,
                     output_text: str, image_count: int = 0, image_tier: str = "",
                     city: str = ""):
-    """保存一次生成记录"""
-    conn = None
-    try:
-        conn = _get_db()
-        conn.execute(
-            "INSERT INTO generation_history "
-            "(invite_code, industry_id, mode, input_title, input_text, input_profile, "
-            " output_text, image_count, image_tier, city) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (invite_code, industry_id, mode, input_title, input_text, input_profile,
-             output_text, image_count, image_tier, city),
-        )
-        conn.commit()
-    except sqlite3.Error:
-        pass
-    finally:
-        if conn:
-            conn.close()
+    """保存一次生成记录（后台批量写入，大文本压缩存储）"""
+    _history_writer.submit((
+        invite_code, industry_id, mode, input_title,
+        _pack_history_text(input_text), _pack_history_text(input_profile),
+        _pack_history_text(output_text), image_count, image_tier, city,
+        _custom_industry_name(industry_id, input_profile), _utc_now(),
+    ))
+
+
+_HISTORY_RECENT_SQL = (
+    "SELECT * FROM generation_history WHERE invite_code = ? "
+    "ORDER BY created_at DESC LIMIT ?"
+)
 
 
 def get_history(invite_code: str, limit: int = 20) -> list:
     """获取某用户最近的生成记录"""
+    if _history_writer.has_pending(invite_code):
+        _history_writer.flush()  # 该用户刚生成的记录还在写入队列里
     conn = None
     try:
         conn = _get_db()
-        rows = conn.execute(
-            "SELECT * FROM generation_history WHERE invite_code = ? "
-            "ORDER BY created_at DESC LIMIT ?",
-            (invite_code, limit),
-        ).fetchall()
-        return [dict(r) for r in rows]
+        rows = conn.execute(_HISTORY_RECENT_SQL, (invite_code, limit)).fetchall()
+        history = []
+        for r in rows:
+            h = dict(r)
+            for field in _HISTORY_PACKED_FIELDS:
+                h[field] = unpack_history_text(h[field])
+            history.append(h)
+        return history
     except sqlite3.Error:
         return []
     finally:
@@ -187,10 +932,156 @@ def get_history(invite_code: str, limit: int = 20) -> list:
 
 
 def get_db():
-    """公开版 _get_db，供管理后台直接查询"""
+    """公开版 _get_db，供管理后台直接查询（close() 归还连接池）"""
     return _get_db()
 
 
+# ── 管理后台查询 ──
+# 看板用到的全部 SQL（app.py 与 scripts/check_query_plans.py 共用），统计类只读汇总表
+
+ADMIN_SQL = {
+    "total_users": "SELECT COALESCE(SUM(value), 0) FROM rollup_counters WHERE name = 'event_users'",
+    "registered_users": "SELECT COALESCE(SUM(value), 0) FROM rollup_counters WHERE name = 'users'",
+    "total_gens": "SELECT COALESCE(SUM(cnt), 0) FROM gen_daily_rollup",
+    "gens_since": "SELECT COALESCE(SUM(cnt), 0) FROM gen_daily_rollup WHERE day >= ?",
+    "feedback_count": "SELECT COALESCE(SUM(value), 0) FROM rollup_counters WHERE name = 'feedback'",
+    "extract_total": (
+        "SELECT COALESCE(SUM(cnt), 0) FROM event_daily_rollup WHERE event_type = 'extract_link'"
+    ),
+    "extract_ok": (
+        "SELECT COALESCE(SUM(cnt), 0) FROM event_daily_rollup "
+        "WHERE event_type = 'extract_link' AND success = 1"
+    ),
+    "daily_trend": (
+        "SELECT day, SUM(cnt) as cnt FROM gen_daily_rollup WHERE day >= ? "
+        "GROUP BY day ORDER BY day"
+    ),
+    "quota_list": (
+        "SELECT invite_code, pro_gen_used, tier, updated_at FROM quota_usage "
+        f"ORDER BY pro_gen_used DESC LIMIT {ADMIN_LIST_LIMIT}"
+    ),
+    "all_users": (
+        "SELECT u.phone, u.invite_code, u.created_at, u.last_login, u.login_count, "
+        "COALESCE(g.gen_count, 0) as gen_count, "
+        "COALESCE(g.last_gen, '') as last_gen "
+        "FROM users u "
+        "LEFT JOIN gen_user_rollup g ON u.invite_code = g.invite_code "
+        f"ORDER BY u.last_login DESC LIMIT {ADMIN_LIST_LIMIT}"
+    ),
+    "user_ranking": (
+        "SELECT g.invite_code, g.gen_count, "
+        "g.last_gen as last_active, "
+        "(SELECT COUNT(*) FROM gen_user_industry_rollup i "
+        "WHERE i.invite_code = g.invite_code) as industry_count, "
+        "COALESCE((SELECT u.phone FROM users u WHERE u.invite_code = g.invite_code LIMIT 1), '—') "
+        "as phone "
+        "FROM gen_user_rollup g "
+        "ORDER BY g.gen_count DESC LIMIT 20"
+    ),
+    "industry": (
+        "SELECT industry_id, SUM(cnt) as cnt FROM gen_daily_rollup "
+        "GROUP BY industry_id ORDER BY cnt DESC"
+    ),
+    "mode": "SELECT mode, SUM(cnt) as cnt FROM gen_daily_rollup GROUP BY mode",
+    "image_tier": (
+        "SELECT image_tier, SUM(cnt) as cnt FROM gen_daily_rollup "
+        "WHERE image_tier != '' GROUP BY image_tier ORDER BY cnt DESC"
+    ),
+    "custom_industry": (
+        "SELECT industry_name, cnt, last_used FROM custom_industry_rollup "
+        "ORDER BY cnt DESC"
+    ),
+    "recent_feedback": "SELECT * FROM feedback ORDER BY created_at DESC LIMIT 15",
+    "recent_events": (
+        "SELECT e.*, COALESCE(u.phone, '—') as phone "
+        "FROM event_log e "
+        "LEFT JOIN users u ON e.invite_code = u.invite_code "
+        "ORDER BY e.created_at DESC LIMIT 50"
+    ),
+    "hourly": (
+        "SELECT hour, SUM(cnt) as cnt "
+        "FROM gen_hourly_rollup GROUP BY hour ORDER BY hour"
+    ),
+}
+
+
+# ── 管理后台查询缓存 ──
+# 按 (面板, SQL, 参数) 缓存结果，TTL 见 ADMIN_PANEL_TTLS。过期后先返回旧结果，
+# 同时在后台线程刷新（stale-while-revalidate）；写操作调用 invalidate 使面板立即失效。
+
+class _AdminQueryCache:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[tuple, tuple[float, list]] = {}
+        self._refreshing: set[tuple] = set()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="admin-refresh")
+
+    @staticmethod
+    def _fetch(sql: str, params: tuple) -> list:
+        # 只有真正回源查询时才等后台队列落库；命中缓存的重跑直接返回，不为刷新等待
+        flush_pending_writes()
+        conn = None
+        try:
+            conn = _get_db()
+            return [dict(r) for r in conn.execute(sql, params).fetchall()]
+        finally:
+            if conn:
+                conn.close()
+
+    def _refresh(self, key: tuple):
+        try:
+            rows = self._fetch(key[1], key[2])
+            with self._lock:
+                if key in self._entries:  # 刷新期间被 invalidate 的不再写回
+                    self._entries[key] = (time.monotonic(), rows)
+        except sqlite3.Error:
+            pass  # 刷新失败：继续使用旧结果，下次访问再试
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def query(self, panel: str, sql: str, params: tuple = ()) -> list:
+        """返回缓存行的拷贝（每行一个新 dict），调用方原地修改不会污染其他会话的缓存"""
+        key = (panel, sql, tuple(params))
+        ttl = ADMIN_PANEL_TTLS.get(panel, ADMIN_DEFAULT_TTL)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() - entry[0] > ttl and key not in self._refreshing:
+                    self._refreshing.add(key)
+                    self._executor.submit(self._refresh, key)
+                return [dict(r) for r in entry[1]]
+        rows = self._fetch(sql, key[2])
+        with self._lock:
+            self._entries[key] = (time.monotonic(), rows)
+        return [dict(r) for r in rows]
+
+    def invalidate(self, panels: tuple):
+        with self._lock:
+            for key in [k for k in self._entries if not panels or k[0] in panels]:
+                del self._entries[key]
+
+
+_admin_cache = _AdminQueryCache()
+
+
+def admin_query(panel: str, sql: str, params: tuple = ()) -> list:
+    """管理后台查询（带面板级 TTL 缓存），返回 list[dict]"""
+    return _admin_cache.query(panel, sql, params)
+
+
+def admin_scalar(panel: str, sql: str, params: tuple = ()):
+    """管理后台单值查询（取第一行第一列）"""
+    rows = _admin_cache.query(panel, sql, params)
+    return next(iter(rows[0].values())) if rows else None
+
+
+def invalidate_admin_cache(*panels: str):
+    """使指定面板的缓存立即失效（不传参数时清空全部）"""
+    _admin_cache.invalidate(panels)
+
+
 # ═══════════════════════════════════════════════════════
 #  辅助函数
 # ═══════════════════════════════════════════════════════
@@ -224,20 +1115,259 @@ def img_cols(count: int) -> int:
 #  Pro 配额追踪
 # ═══════════════════════════════════════════════════════
 
+# 配额计数常驻进程内存：生成时只在内存里预留 / 结算，不再每次抢 SQLite 写锁。
+# 每次结算先追加一行到本地日志文件（<DB_PATH>.quota-journal），后台线程每
+# QUOTA_FLUSH_INTERVAL 秒把增量合并成一个事务写入 quota_usage，并记下已落库的
+# 日志序号；进程崩溃重启后，按序号把未落库的日志补进 quota_usage。
+# 假设只有一个进程写配额（Streamlit 单进程部署）。
+
+_QUOTA_UPSERT_SQL = (
+    "INSERT INTO quota_usage (invite_code, pro_gen_used, updated_at) "
+    "VALUES (?, MAX(?, 0), datetime('now')) "
+    "ON CONFLICT(invite_code) DO UPDATE SET "
+    "pro_gen_used = MAX(pro_gen_used + ?, 0), updated_at = datetime('now')"
+)
+_QUOTA_CHECKPOINT_SQL = (
+    "INSERT INTO quota_journal_state (id, last_seq) VALUES (1, ?) "
+    "ON CONFLICT(id) DO UPDATE SET last_seq = excluded.last_seq"
+)
+
+
+_QUOTA_USED_SQL = "SELECT pro_gen_used FROM quota_usage WHERE invite_code = ?"
+_USER_TIER_SQL = "SELECT tier FROM quota_usage WHERE invite_code = ?"
+
+
+class QuotaReservation:
+    """一次 Pro 配额预留：成功后 commit() 扣除，失败时 release() 退还。
+    用作 with 块时，离开时仍未 commit 的预留自动退还。"""
+
+    def __init__(self, ledger: "_QuotaLedger", code: str):
+        self.code = code
+        self._ledger = ledger
+        self._settled = False
+
+    def commit(self):
+        self._ledger.settle(self, consume=True)
+
+    def release(self):
+        self._ledger.settle(self, consume=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class _QuotaLedger:
+    """进程内配额账本：已用次数 + 未结算预留 + 未落库增量"""
+
+    def __init__(self):
+        self._lock = threading.Lock()        # 保护内存计数和日志文件
+        self._flush_lock = threading.Lock()  # 串行化落库 / 加载 / 崩溃恢复
+        self._used: dict[str, int] = {}
+        self._held: dict[str, int] = {}
+        self._pending: dict[str, int] = {}
+        self._seq = 0
+        self._journal = None
+        self._ready = False
+
+    def _ensure_ready(self):
+        if self._ready:
+            return
+        with self._flush_lock:
+            if self._ready:
+                return
+            path = Path(f"{DB_PATH}.quota-journal")
+            self._recover(path)
+            self._journal = open(path, "a", encoding="utf-8")
+            self._ready = True
+        threading.Thread(target=self._run, name="quota-ledger", daemon=True).start()
+
+    def _recover(self, path: Path):
+        """把上次进程未落库的日志补进 quota_usage"""
+        entries = []
+        if path.exists():
+            for line in path.read_text(encoding="utf-8").splitlines():
+                try:
+                    seq, code, delta = line.split("\t")
+                    entries.append((int(seq), code, int(delta)))
+                except ValueError:
+                    continue  # 崩溃时写了半行
+        conn = None
+        try:
+            conn = _get_db()
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT last_seq FROM quota_journal_state WHERE id = 1").fetchone()
+            last_seq = row["last_seq"] if row else 0
+            todo: dict[str, int] = {}
+            for seq, code, delta in entries:
+                if seq > last_seq:
+                    todo[code] = todo.get(code, 0) + delta
+            conn.executemany(_QUOTA_UPSERT_SQL, [(c, d, d) for c, d in todo.items() if d])
+            self._seq = max([last_seq] + [e[0] for e in entries])
+            conn.execute(_QUOTA_CHECKPOINT_SQL, (self._seq,))
+            conn.commit()
+        finally:
+            if conn:
+                conn.close()
+        path.write_text("", encoding="utf-8")
+
+    def _load(self, code: str):
+        """首次访问某邀请码时从数据库读取已用次数"""
+        if code in self._used:
+            return
+        with self._flush_lock:
+            if code in self._used:
+                return
+            conn = None
+            try:
+                conn = _get_db()
+                row = conn.execute(_QUOTA_USED_SQL, (code,)).fetchone()
+            finally:
+                if conn:
+                    conn.close()
+            with self._lock:
+                self._used.setdefault(code, row["pro_gen_used"] if row else 0)
+
+    def _apply_locked(self, code: str, delta: int):
+        """修改已用次数并写日志（调用方持有 self._lock）"""
+        used = self._used[code]
+        new_used = max(used + delta, 0)
+        if new_used == used:
+            return
+        self._used[code] = new_used
+        self._pending[code] = self._pending.get(code, 0) + new_used - used
+        _invalidate_account_snapshot(code)
+        self._seq += 1
+        self._journal.write(f"{self._seq}\t{code}\t{new_used - used}\n")
+        self._journal.flush()
+
+    def used(self, code: str) -> int:
+        self._ensure_ready()
+        self._load(code)
+        return self._used[code]
+
+    def reserve(self, code: str) -> QuotaReservation | None:
+        self._ensure_ready()
+        self._load(code)
+        with self._lock:
+            held = self._held.get(code, 0)
+            if self._used[code] + held >= PRO_GEN_LIMIT:
+                return None
+            self._held[code] = held + 1
+        return QuotaReservation(self, code)
+
+    def settle(self, res: QuotaReservation, consume: bool):
+        with self._lock:
+            if res._settled:
+                return
+            res._settled = True
+            self._held[res.code] -= 1
+            if consume:
+                self._apply_locked(res.code, 1)
+        if consume and not _write_behind:
+            self.flush()
+
+    def adjust(self, code: str, delta: int):
+        """直接增减已用次数（退还 / 管理员充值）"""
+        self._ensure_ready()
+        self._load(code)
+        with self._lock:
+            self._apply_locked(code, delta)
+        if not _write_behind:
+            self.flush()
+
+    def grant(self, code: str, amount: int, tier: str = ""):
+        """管理员充值：已用次数减 amount（不低于 0）并可选更新会员等级。
+        与所有未落库增量在同一个事务里写入，邀请码没有 quota_usage 行时也会建行；
+        失败时抛出异常，内存计数保持不变"""
+        self._ensure_ready()
+        self._load(code)
+        # 事务只在 _flush_lock 下执行；_lock 只在取出 / 写回内存计数时短暂持有，
+        # 充值写库期间 reserve() / settle() 不会被阻塞
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                seq = self._seq
+                used = self._used[code]
+            delta = max(used - amount, 0) - used
+            rows = dict(pending)
+            rows[code] = rows.get(code, 0) + delta
+            conn = None
+            try:
+                conn = _get_db()
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(_QUOTA_UPSERT_SQL, [(c, d, d) for c, d in rows.items() if d or c == code])
+                if tier:
+                    conn.execute("UPDATE quota_usage SET tier = ? WHERE invite_code = ?", (tier, code))
+                conn.execute(_QUOTA_CHECKPOINT_SQL, (seq,))
+                conn.commit()
+            except sqlite3.Error:
+                if conn:
+                    conn.rollback()
+                with self._lock:
+                    for c, d in pending.items():
+                        self._pending[c] = self._pending.get(c, 0) + d
+                raise
+            finally:
+                if conn:
+                    conn.close()
+            with self._lock:
+                # 事务期间结算的增量仍在 _pending 里，这里只叠加充值部分
+                self._used[code] += delta
+                if self._seq == seq:
+                    self._journal.seek(0)
+                    self._journal.truncate()
+        _invalidate_account_snapshot(code)
+
+    def flush(self) -> bool:
+        """把未落库的增量合并成一个事务写入 quota_usage"""
+        if not self._ready:
+            return True
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                seq = self._seq
+            if not pending:
+                return True
+            conn = None
+            try:
+                conn = _get_db()
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(_QUOTA_UPSERT_SQL, [(c, d, d) for c, d in pending.items() if d])
+                conn.execute(_QUOTA_CHECKPOINT_SQL, (seq,))
+                conn.commit()
+            except sqlite3.Error:
+                with self._lock:
+                    for c, d in pending.items():
+                        self._pending[c] = self._pending.get(c, 0) + d
+                return False
+            finally:
+                if conn:
+                    conn.close()
+            with self._lock:
+                if self._seq == seq:
+                    # 期间没有新的日志：已全部落库，可以清空日志文件
+                    self._journal.seek(0)
+                    self._journal.truncate()
+            return True
+
+    def _run(self):
+        while True:
+            time.sleep(QUOTA_FLUSH_INTERVAL)
+            self.flush()
+
+
+_quota_ledger = _QuotaLedger()
+
+
 def get_pro_used(code: str) -> int:
-    conn = None
     try:
-        conn = _get_db()
-        row = conn.execute(
-            "SELECT pro_gen_used FROM quota_usage WHERE invite_code = ?",
-            (code.upper(),),
-        ).fetchone()
-        return row["pro_gen_used"] if row else 0
+        return _quota_ledger.used(code.upper())
     except sqlite3.Error:
         return 0
-    finally:
-        if conn:
-            conn.close()
 
 
 def get_user_tier(code: str) -> str:
@@ -245,10 +1375,7 @@ def get_user_tier(code: str) -> str:
     conn = None
     try:
         conn = _get_db()
-        row = conn.execute(
-            "SELECT tier FROM quota_usage WHERE invite_code = ?",
-            (code.upper(),),
-        ).fetchone()
+        row = conn.execute(_USER_TIER_SQL, (code.upper(),)).fetchone()
         return row["tier"] if row and row["tier"] else "free"
     except sqlite3.Error:
         return "free"
@@ -257,90 +1384,76 @@ def get_user_tier(code: str) -> str:
             conn.close()
 
 
+_snapshot_cache: dict[str, tuple[float, dict]] = {}
+_snapshot_lock = threading.Lock()
+
+
+def _invalidate_account_snapshot(code: str):
+    with _snapshot_lock:
+        _snapshot_cache.pop(code.upper(), None)
+
+
+def get_account_snapshot(code: str) -> dict:
+    """会员等级 + 额度快照（缓存 ACCOUNT_SNAPSHOT_TTL 秒，配额变动时立即失效）
+    返回 {"tier", "plan", "used", "limit", "remaining"}，plan 为 TIER_PLANS 中的方案"""
+    code = code.upper()
+    now = time.monotonic()
+    with _snapshot_lock:
+        hit = _snapshot_cache.get(code)
+    if hit and hit[0] > now:
+        return dict(hit[1])
+    tier = get_user_tier(code)
+    used = get_pro_used(code)
+    snapshot = {
+        "tier": tier,
+        "plan": TIER_PLANS.get(tier, TIER_PLANS["free"]),
+        "used": used,
+        "limit": PRO_GEN_LIMIT,
+        "remaining": max(PRO_GEN_LIMIT - used, 0),
+    }
+    with _snapshot_lock:
+        _snapshot_cache[code] = (now + ACCOUNT_SNAPSHOT_TTL, snapshot)
+    return dict(snapshot)
+
+
 def has_pro_quota(code: str) -> bool:
     return get_pro_used(code) < PRO_GEN_LIMIT
 
 
-def try_use_pro_quota(code: str) -> bool:
-    """原子地检查+扣除1次 Pro 配额，成功返回 True"""
-    conn = None
+def reserve_pro_quota(code: str) -> QuotaReservation | None:
+    """预留1次 Pro 配额，额度不足返回 None；生成成功后 commit()，失败 release()"""
     try:
-        conn = _get_db()
-        conn.execute("BEGIN IMMEDIATE")
-        row = conn.execute(
-            "SELECT pro_gen_used FROM quota_usage WHERE invite_code = ?",
-            (code.upper(),)
-        ).fetchone()
-        used = row["pro_gen_used"] if row else 0
-        if used >= PRO_GEN_LIMIT:
-            conn.rollback()
-            return False
-        conn.execute(
-            "INSERT INTO quota_usage (invite_code, pro_gen_used, updated_at) "
-            "VALUES (?, 1, datetime('now')) "
-            "ON CONFLICT(invite_code) DO UPDATE SET "
-            "pro_gen_used = pro_gen_used + 1, updated_at = datetime('now')",
-            (code.upper(),)
-        )
-        conn.commit()
-        return True
+        return _quota_ledger.reserve(code.upper())
     except sqlite3.Error:
-        if conn:
-            try:
-                conn.rollback()
-            except sqlite3.Error:
-                pass
+        return None
+
+
+def try_use_pro_quota(code: str) -> bool:
+    """原子地检查+扣除1次 Pro 配额，成功返回 True"""
+    res = reserve_pro_quota(code)
+    if res is None:
         return False
-    finally:
-        if conn:
-            conn.close()
+    res.commit()
+    return True
 
 
 def refund_pro_quota(code: str):
     """生成失败时退回1次 Pro 配额"""
-    conn = None
     try:
-        conn = _get_db()
-        conn.execute(
-            "UPDATE quota_usage SET pro_gen_used = MAX(pro_gen_used - 1, 0) "
-            "WHERE invite_code = ?", (code.upper(),)
-        )
-        conn.commit()
-    except sqlite3.Error:
+        _quota_ledger.adjust(code.upper(), -1)
+    except (sqlite3.Error, OSError):
         pass
-    finally:
-        if conn:
-            conn.close()
 
 
 def add_pro_quota(code: str, amount: int, tier: str = "") -> bool:
     """管理员为用户增加配额（减少 pro_gen_used）并可选更新会员等级"""
-    conn = None
     try:
-        conn = _get_db()
-        if tier:
-            conn.execute(
-                "INSERT INTO quota_usage (invite_code, pro_gen_used, tier, updated_at) "
-                "VALUES (?, 0, ?, datetime('now')) "
-                "ON CONFLICT(invite_code) DO UPDATE SET "
-                "pro_gen_used = MAX(pro_gen_used - ?, 0), tier = ?, updated_at = datetime('now')",
-                (code.upper(), tier, amount, tier),
-            )
-        else:
-            conn.execute(
-                "INSERT INTO quota_usage (invite_code, pro_gen_used, updated_at) "
-                "VALUES (?, 0, datetime('now')) "
-                "ON CONFLICT(invite_code) DO UPDATE SET "
-                "pro_gen_used = MAX(pro_gen_used - ?, 0), updated_at = datetime('now')",
-                (code.upper(), amount),
-            )
-        conn.commit()
-        return True
-    except sqlite3.Error:
+        _quota_ledger.grant(code.upper(), amount, tier)
+    except (sqlite3.Error, OSError):
+        # OSError：配额日志文件打不开 / 写不进
         return False
-    finally:
-        if conn:
-            conn.close()
+    invalidate_admin_cache("quota", "metrics")
+    return True
 
 
 # ═══════════════════════════════════════════════════════
@@ -363,6 +1476,9 @@ def validate_phone(phone: str) -> bool:
     return bool(re.match(r'^1[3-9]\d{9}$', phone.strip()))
 
 
+_USER_LOGIN_SQL = "SELECT phone, invite_code, login_count FROM users WHERE phone = ?"
+
+
 def register_or_login(phone: str, invite_code: str) -> dict:
     """注册或登录用户，返回 {"ok": bool, "msg": str, "is_new": bool}"""
     phone = phone.strip()
@@ -370,10 +1486,7 @@ def register_or_login(phone: str, invite_code: str) -> dict:
     conn = None
     try:
         conn = _get_db()
-        row = conn.execute(
-            "SELECT phone, invite_code, login_count FROM users WHERE phone = ?",
-            (phone,),
-        ).fetchone()
+        row = conn.execute(_USER_LOGIN_SQL, (phone,)).fetchone()
         if row:
             # 已注册 — 更新登录信息
             conn.execute(
@@ -391,6 +1504,7 @@ def register_or_login(phone: str, invite_code: str) -> dict:
                 (phone, code),
             )
             conn.commit()
+            invalidate_admin_cache("users")
             return {"ok": True, "msg": "注册成功", "is_new": True,
                     "invite_code": code}
     except sqlite3.Error as e:
@@ -402,27 +1516,11 @@ def register_or_login(phone: str, invite_code: str) -> dict:
 
 
 def get_all_users() -> list:
-    """获取所有注册用户（管理后台用）"""
-    conn = None
+    """获取最近登录的注册用户（最多 ADMIN_LIST_LIMIT 个，管理后台用，缓存在 "users" 面板）"""
     try:
-        conn = _get_db()
-        rows = conn.execute(
-            "SELECT u.phone, u.invite_code, u.created_at, u.last_login, u.login_count, "
-            "COALESCE(g.gen_count, 0) as gen_count, "
-            "COALESCE(g.last_gen, '') as last_gen "
-            "FROM users u "
-            "LEFT JOIN ("
-            "  SELECT invite_code, COUNT(*) as gen_count, MAX(created_at) as last_gen "
-            "  FROM generation_history GROUP BY invite_code"
-            ") g ON u.invite_code = g.invite_code "
-            "ORDER BY u.last_login DESC"
-        ).fetchall()
-        return [dict(r) for r in rows]
+        return admin_query("users", ADMIN_SQL["all_users"])
     except sqlite3.Error:
         return []
-    finally:
-        if conn:
-            conn.close()
 
 
 def get_api_key(name: str) -> str:
@@ -432,23 +1530,164 @@ def get_api_key(name: str) -> str:
         return ""
 
 
-def make_session():
-    """创建伪装浏览器指纹的 requests.Session"""
-    s = requests.Session()
-    s.headers.update({
+# ── 共享 HTTP 连接池 ──
+# 抓取和大模型调用各有一个进程级 transport（连接池），都按域名统计连接复用。
+# AsyncClient 本身很轻（headers / cookies），连接池挂在进程级的一个 transport 上：
+# 每次 make_async_client() 仍是新的浏览器指纹，但同一域名的 TCP/TLS 连接（装了 h2
+# 时为 HTTP/2 连接）可以复用。请求头（UA、Referer 等）按请求发送，不影响连接池。
+# 客户端只在 api.py 的抓取事件循环里使用。
+
+class _PoolStats:
+    """transport 混入：按域名统计请求数和新建连接数（包装 httpcore 连接池的 create_connection）"""
+
+    def _init_stats(self):
+        self._counts: dict[str, list] = {}
+        self._stats_lock = threading.Lock()
+        create = self._pool.create_connection
+
+        def _create(origin):
+            self._count(origin.host.decode("ascii"), 1)
+            return create(origin)
+
+        self._pool.create_connection = _create
+
+    def _count(self, host: str, idx: int):
+        with self._stats_lock:
+            self._counts.setdefault(host, [0, 0])[idx] += 1
+
+    def stats(self) -> dict:
+        """按域名返回 {requests, connections, reuse_rate}，另含 _total 汇总"""
+        with self._stats_lock:
+            per_host = {h: list(v) for h, v in self._counts.items()}
+        result = {}
+        total_req = total_conn = 0
+        for host, (req, conn) in sorted(per_host.items()):
+            total_req += req
+            total_conn += conn
+            result[host] = {"requests": req, "connections": conn,
+                            "reuse_rate": round(1 - conn / req, 3) if req else 0.0}
+        result["_total"] = {"requests": total_req, "connections": total_conn,
+                            "reuse_rate": round(1 - total_conn / total_req, 3) if total_req else 0.0}
+        return result
+
+
+class _PooledAsyncTransport(_PoolStats, httpx.AsyncHTTPTransport):
+    """抓取用的共享异步 transport；关闭客户端时不关闭连接池"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("http2", _HTTP2)
+        kwargs.setdefault("limits", httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ))
+        super().__init__(**kwargs)
+        self._init_stats()
+
+    async def handle_async_request(self, request):
+        self._count(request.url.host, 0)
+        return await super().handle_async_request(request)
+
+    async def __aexit__(self, *exc):
+        # 各处 async with make_async_client() 退出时会关闭 transport；共享池跟随进程
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class _PooledTransport(_PoolStats, httpx.HTTPTransport):
+    """大模型 SDK 共用的同步 transport；SDK 客户端关闭时不关闭连接池"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("http2", _HTTP2)
+        kwargs.setdefault("limits", httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ))
+        super().__init__(**kwargs)
+        self._init_stats()
+
+    def handle_request(self, request):
+        self._count(request.url.host, 0)
+        return super().handle_request(request)
+
+    def __exit__(self, *exc):
+        pass
+
+    def close(self):
+        pass
+
+
+_http_transport = None
+_http_transport_lock = threading.Lock()
+_replay_transport = None  # 离线回放 transport（见 scripts/xhs_replay.py），None 表示联网
+
+
+def _shared_async_transport() -> _PooledAsyncTransport:
+    global _http_transport
+    if _http_transport is None:
+        with _http_transport_lock:
+            if _http_transport is None:
+                _http_transport = _PooledAsyncTransport()
+    return _http_transport
+
+
+def get_http_pool_stats() -> dict:
+    """共享连接池统计：各域名请求数、新建连接数、连接复用率"""
+    return _shared_async_transport().stats()
+
+
+_llm_transport = None
+
+
+def make_llm_http_client() -> httpx.Client:
+    """给 OpenAI / Anthropic SDK 用的 httpx.Client：共用一个进程级连接池，超时按配置"""
+    global _llm_transport
+    if _llm_transport is None:
+        with _http_transport_lock:
+            if _llm_transport is None:
+                _llm_transport = _PooledTransport()
+    return httpx.Client(
+        transport=_llm_transport,
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+
+
+def get_llm_pool_stats() -> dict:
+    """大模型连接池统计（同 get_http_pool_stats，按 API 域名）"""
+    return _llm_transport.stats() if _llm_transport is not None else {}
+
+
+def set_replay_transport(transport=None):
+    """让 make_async_client 创建的客户端全部走回放 transport（离线测试 / 基准用），传 None 恢复联网"""
+    global _replay_transport
+    _replay_transport = transport
+
+
+def browser_headers() -> dict:
+    """随机手机浏览器指纹的请求头（Accept-Encoding 交给 httpx 按已装的解码器填写）"""
+    return {
         "User-Agent": random.choice(USER_AGENTS),
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
         "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-        "Accept-Encoding": "gzip, deflate, br",
-        "Connection": "keep-alive",
         "Upgrade-Insecure-Requests": "1",
         "Cache-Control": "max-age=0",
         "Sec-Fetch-Dest": "document",
         "Sec-Fetch-Mode": "navigate",
         "Sec-Fetch-Site": "none",
         "Sec-Fetch-User": "?1",
-    })
-    return s
+    }
+
+
+def make_async_client(referer: str = "") -> httpx.AsyncClient:
+    """创建伪装浏览器指纹的 httpx.AsyncClient（跟随重定向），底层共用进程级连接池"""
+    headers = browser_headers()
+    if referer:
+        headers["Referer"] = referer
+    transport = _replay_transport if _replay_transport is not None else _shared_async_transport()
+    return httpx.AsyncClient(transport=transport, headers=headers, follow_redirects=True, timeout=15)
 
 
 # ═══════════════════════════════════════════════════════
@@ -469,7 +1708,7 @@ def make_zip(title: str, text: str, images: list) -> io.BytesIO:
 
 
 def make_batch_zip(batch_results: list, use_edited: bool = True) -> io.BytesIO:
-    """批量打包：每条笔记一个子目录"""
+    """批量打包：每条笔记一个子目录。images / edited_images 为图片 digest 列表（失败的位置为 None）"""
     buf = io.BytesIO()
     with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
         for idx, br in enumerate(batch_results):
@@ -482,11 +1721,12 @@ def make_batch_zip(batch_results: list, use_edited: bool = True) -> io.BytesIO:
             zf.writestr(f"{folder}/文案.txt", f"{title}\n\n{text}".encode("utf-8"))
             # 图片
             imgs = (br.get("edited_images") if use_edited else br.get("images")) or br.get("images") or []
-            for i, img in enumerate(imgs):
+            for i, digest in enumerate(imgs):
+                img = load_image(digest) if digest else None
                 if img is None:
-                    # 编辑失败的用原图替代
+                    # 编辑失败（或已从图片存储淘汰）的用原图替代
                     orig_imgs = br.get("images", [])
-                    img = orig_imgs[i] if i < len(orig_imgs) else None
+                    img = load_image(orig_imgs[i]) if i < len(orig_imgs) and orig_imgs[i] else None
                 if img is not None:
                     ib = io.BytesIO()
                     img.save(ib, format="JPEG", quality=95)
@@ -520,15 +1760,15 @@ def save_store_profile(phone: str, industry: str, profile: dict) -> bool:
             conn.close()
 
 
+_STORE_PROFILE_SQL = "SELECT profile_data FROM store_profiles WHERE phone = ? AND industry = ?"
+
+
 def load_store_profile(phone: str, industry: str) -> dict:
     """加载已保存的店铺资料，不存在时返回空 dict"""
     conn = None
     try:
         conn = _get_db()
-        row = conn.execute(
-            "SELECT profile_data FROM store_profiles WHERE phone = ? AND industry = ?",
-            (phone.strip(), industry),
-        ).fetchone()
+        row = conn.execute(_STORE_PROFILE_SQL, (phone.strip(), industry)).fetchone()
         if row and row["profile_data"]:
             return json.loads(row["profile_data"])
         return {}
@@ -537,3 +1777,379 @@ def load_store_profile(phone: str, industry: str) -> dict:
     finally:
         if conn:
             conn.close()
+
+
+# ═══════════════════════════════════════════════════════
+#  链接提取缓存 & 短链接展开缓存 & 大模型响应缓存
+# ═══════════════════════════════════════════════════════
+
+# 键由 api.py 生成（"note:<笔记ID>" / "url:<规范化URL>"），同一结果按多个键各存一行。
+# 过期行不会被读到，三张缓存表合计每写入 EXTRACT_CACHE_PURGE_EVERY 次顺带清理一次。
+
+_extract_cache_writes = 0
+_extract_cache_lock = threading.Lock()
+
+
+def _count_cache_write() -> bool:
+    """累计一次缓存写入，返回本次是否顺带清理过期行"""
+    global _extract_cache_writes
+    with _extract_cache_lock:
+        _extract_cache_writes += 1
+        return _extract_cache_writes % EXTRACT_CACHE_PURGE_EVERY == 0
+
+
+_EXTRACT_CACHE_LOOKUP_SQL = (
+    "SELECT payload, success, created_at FROM extract_cache "
+    "WHERE cache_key IN ({marks}) AND expires_at > datetime('now') "
+    "ORDER BY created_at DESC LIMIT 1"
+)
+_EXTRACT_CACHE_PURGE_SQL = "DELETE FROM extract_cache WHERE expires_at <= datetime('now')"
+_SHORT_LINK_LOOKUP_SQL = (
+    "SELECT resolved_url, (julianday(expires_at) - julianday('now')) * 86400 AS ttl_left "
+    "FROM short_link_cache WHERE short_url = ? AND expires_at > datetime('now')"
+)
+_SHORT_LINK_PURGE_SQL = "DELETE FROM short_link_cache WHERE expires_at <= datetime('now')"
+
+
+def get_extract_cache(keys: list) -> dict | None:
+    """按任一缓存键取未过期的提取结果，附带 success / created_at；未命中返回 None"""
+    keys = [k for k in keys if k]
+    if not keys:
+        return None
+    conn = None
+    try:
+        conn = _get_db()
+        row = conn.execute(
+            _EXTRACT_CACHE_LOOKUP_SQL.format(marks=",".join("?" * len(keys))), keys,
+        ).fetchone()
+        if not row:
+            return None
+        entry = json.loads(row["payload"])
+        entry["success"] = bool(row["success"])
+        entry["created_at"] = row["created_at"]
+        return entry
+    except (sqlite3.Error, json.JSONDecodeError):
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def save_extract_cache(keys: list, payload: dict, success: bool, ttl: int) -> bool:
+    """写入提取结果（覆盖同键旧值），ttl 秒后过期"""
+    keys = list(dict.fromkeys(k for k in keys if k))
+    if not keys:
+        return False
+    data = json.dumps(payload, ensure_ascii=False)
+    purge = _count_cache_write()
+    conn = None
+    try:
+        conn = _get_db()
+        conn.executemany(
+            "INSERT INTO extract_cache (cache_key, payload, success, created_at, expires_at) "
+            "VALUES (?, ?, ?, datetime('now'), datetime('now', ?)) "
+            "ON CONFLICT(cache_key) DO UPDATE SET payload = excluded.payload, "
+            "success = excluded.success, created_at = excluded.created_at, "
+            "expires_at = excluded.expires_at",
+            [(k, data, 1 if success else 0, f"+{int(ttl)} seconds") for k in keys],
+        )
+        if purge:
+            conn.execute(_EXTRACT_CACHE_PURGE_SQL)
+        conn.commit()
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_short_link(short_url: str) -> tuple | None:
+    """查询未过期的短链展开结果，返回 (展开后URL, 剩余秒数)；未命中返回 None"""
+    conn = None
+    try:
+        conn = _get_db()
+        row = conn.execute(_SHORT_LINK_LOOKUP_SQL, (short_url,)).fetchone()
+        return (row["resolved_url"], row["ttl_left"]) if row else None
+    except sqlite3.Error:
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def save_short_link(short_url: str, resolved_url: str, ttl: int) -> bool:
+    """保存短链展开结果，ttl 秒后过期"""
+    purge = _count_cache_write()
+    conn = None
+    try:
+        conn = _get_db()
+        conn.execute(
+            "INSERT INTO short_link_cache (short_url, resolved_url, created_at, expires_at) "
+            "VALUES (?, ?, datetime('now'), datetime('now', ?)) "
+            "ON CONFLICT(short_url) DO UPDATE SET resolved_url = excluded.resolved_url, "
+            "created_at = excluded.created_at, expires_at = excluded.expires_at",
+            (short_url, resolved_url, f"+{int(ttl)} seconds"),
+        )
+        if purge:
+            conn.execute(_SHORT_LINK_PURGE_SQL)
+        conn.commit()
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+_LLM_CACHE_LOOKUP_SQL = (
+    "SELECT response FROM llm_cache WHERE cache_key = ? AND expires_at > datetime('now')"
+)
+_LLM_CACHE_TOUCH_SQL = "UPDATE llm_cache SET last_access = datetime('now') WHERE cache_key = ?"
+_LLM_CACHE_PURGE_SQL = "DELETE FROM llm_cache WHERE expires_at <= datetime('now')"
+_LLM_CACHE_TRIM_SQL = (
+    "DELETE FROM llm_cache WHERE cache_key IN ("
+    " SELECT cache_key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)"
+)
+
+
+def get_llm_cache(cache_key: str) -> str | None:
+    """取未过期的大模型响应并刷新最近访问时间；未命中返回 None"""
+    conn = None
+    try:
+        conn = _get_db()
+        row = conn.execute(_LLM_CACHE_LOOKUP_SQL, (cache_key,)).fetchone()
+        if not row:
+            return None
+        conn.execute(_LLM_CACHE_TOUCH_SQL, (cache_key,))
+        conn.commit()
+        return row["response"]
+    except sqlite3.Error:
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def save_llm_cache(cache_key: str, provider: str, model: str, response: str, ttl: int) -> bool:
+    """保存大模型响应，ttl 秒后过期；顺带清理时删除过期行，并按最近访问只保留 LLM_CACHE_MAX_ROWS 行"""
+    purge = _count_cache_write()
+    conn = None
+    try:
+        conn = _get_db()
+        conn.execute(
+            "INSERT INTO llm_cache (cache_key, provider, model, response, created_at, last_access, expires_at) "
+            "VALUES (?, ?, ?, ?, datetime('now'), datetime('now'), datetime('now', ?)) "
+            "ON CONFLICT(cache_key) DO UPDATE SET response = excluded.response, "
+            "created_at = excluded.created_at, last_access = excluded.last_access, "
+            "expires_at = excluded.expires_at",
+            (cache_key, provider, model, response, f"+{int(ttl)} seconds"),
+        )
+        if purge:
+            conn.execute(_LLM_CACHE_PURGE_SQL)
+            conn.execute(_LLM_CACHE_TRIM_SQL, (LLM_CACHE_MAX_ROWS,))
+        conn.commit()
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+# ═══════════════════════════════════════════════════════
+#  图片存储（内容寻址）
+# ═══════════════════════════════════════════════════════
+# 下载的笔记图片、Imagen / Gemini 生成的图片按编码后字节的 SHA-256 存盘：
+# IMAGE_STORE_DIR/ab/cd/<digest>.<ext>。digest 即图片句柄，可以放进 session_state
+# 或数据库，需要时 load_image() 再解码。image_blobs 记录大小和最近访问时间，
+# 总大小超过 IMAGE_STORE_MAX_BYTES 时按最近访问淘汰；image_url_index 让同一个
+# CDN 图片 URL 再次下载时直接读盘。
+
+_IMAGE_EXTS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif", "HEIF": "heic"}
+_image_store_writes = 0
+_image_store_lock = threading.Lock()
+_image_seen: dict[str, float] = {}  # digest → 本进程最近一次回写 last_access 的时间（monotonic）
+
+
+def _touch_due(digest: str) -> bool:
+    """登记本进程用到了这张图；距上次回写 last_access 超过 IMAGE_TOUCH_INTERVAL 才返回 True"""
+    now = time.monotonic()
+    with _image_store_lock:
+        last = _image_seen.get(digest)
+        if last is not None and now - last < IMAGE_TOUCH_INTERVAL:
+            return False
+        _image_seen[digest] = now
+        return True
+
+
+def _pinned_images() -> set[str]:
+    """IMAGE_PIN_TTL 内用到过的图片（活跃会话的 session_state 还引用着），顺带清掉过期登记"""
+    cutoff = time.monotonic() - IMAGE_PIN_TTL
+    with _image_store_lock:
+        for digest in [d for d, t in _image_seen.items() if t < cutoff]:
+            del _image_seen[digest]
+        return set(_image_seen)
+
+
+_IMAGE_URL_LOOKUP_SQL = (
+    "SELECT b.digest, b.fmt FROM image_url_index u JOIN image_blobs b ON b.digest = u.digest "
+    "WHERE u.url = ?"
+)
+_IMAGE_BLOB_FMT_SQL = "SELECT fmt FROM image_blobs WHERE digest = ?"
+_IMAGE_BLOB_TOUCH_SQL = "UPDATE image_blobs SET last_access = datetime('now') WHERE digest = ?"
+_IMAGE_STORE_TOTAL_SQL = "SELECT COALESCE(SUM(size), 0) FROM image_blobs"
+_IMAGE_EVICT_ORDER_SQL = "SELECT digest, fmt, size FROM image_blobs ORDER BY last_access, created_at"
+_IMAGE_EVICT_BLOBS_SQL = "DELETE FROM image_blobs WHERE digest IN ({marks})"
+_IMAGE_EVICT_URLS_SQL = "DELETE FROM image_url_index WHERE digest IN ({marks})"
+
+
+def _blob_path(digest: str, fmt: str) -> Path:
+    ext = _IMAGE_EXTS.get(fmt, fmt.lower())
+    return Path(IMAGE_STORE_DIR) / digest[:2] / digest[2:4] / f"{digest}.{ext}"
+
+
+def _write_blob(path: Path, data: bytes):
+    """先写临时文件再改名，并发写同一 blob 时不会读到半个文件"""
+    if path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def put_image_bytes(data: bytes, source_url: str = "", image: Image.Image | None = None) -> str:
+    """保存已编码的图片字节，返回 digest（图片句柄）；失败返回空串。
+    image 为已解码的同一张图时直接取格式和尺寸，免得再解析一遍"""
+    if image is None:
+        try:
+            image = Image.open(io.BytesIO(data))
+        except (OSError, ValueError):
+            return ""
+    fmt = image.format or "PNG"
+    digest = hashlib.sha256(data).hexdigest()
+    try:
+        _write_blob(_blob_path(digest, fmt), data)
+    except OSError:
+        return ""
+    global _image_store_writes
+    with _image_store_lock:
+        _image_seen[digest] = time.monotonic()
+        _image_store_writes += 1
+        evict = _image_store_writes % IMAGE_STORE_EVICT_EVERY == 0
+    conn = None
+    try:
+        conn = _get_db()
+        conn.execute(
+            "INSERT INTO image_blobs (digest, fmt, size, width, height) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(digest) DO UPDATE SET last_access = datetime('now')",
+            (digest, fmt, len(data), image.width, image.height),
+        )
+        if source_url:
+            conn.execute(
+                "INSERT OR REPLACE INTO image_url_index (url, digest) VALUES (?, ?)",
+                (source_url, digest),
+            )
+        conn.commit()
+    except sqlite3.Error:
+        pass
+    finally:
+        if conn:
+            conn.close()
+    if evict:
+        evict_image_store()
+    return digest
+
+
+def put_image(image: Image.Image, source_url: str = "") -> str:
+    """保存一张没有原始字节的图片（编码为 JPEG q95，与 ZIP 打包一致），返回 digest"""
+    buf = io.BytesIO()
+    image.convert("RGB").save(buf, format="JPEG", quality=95)
+    data = buf.getvalue()
+    return put_image_bytes(data, source_url, Image.open(io.BytesIO(data)))
+
+
+def load_image(digest: str) -> Image.Image | None:
+    """按 digest 读出并解码图片（RGB），info["blob"] 为 digest；不存在返回 None"""
+    conn = None
+    try:
+        conn = _get_db()
+        row = conn.execute(_IMAGE_BLOB_FMT_SQL, (digest,)).fetchone()
+        if not row:
+            return None
+        # 每次重跑都会读图，last_access 按 IMAGE_TOUCH_INTERVAL 节流回写，读路径基本不写库
+        if _touch_due(digest):
+            conn.execute(_IMAGE_BLOB_TOUCH_SQL, (digest,))
+            conn.commit()
+        fmt = row["fmt"]
+    except sqlite3.Error:
+        return None
+    finally:
+        if conn:
+            conn.close()
+    try:
+        with open(_blob_path(digest, fmt), "rb") as f:
+            img = Image.open(io.BytesIO(f.read())).convert("RGB")
+    except (OSError, ValueError):
+        return None
+    img.info["blob"] = digest
+    return img
+
+
+def lookup_image_url(url: str) -> str:
+    """该图片 URL 之前下载过且文件仍在时返回 digest，否则返回空串"""
+    conn = None
+    try:
+        conn = _get_db()
+        row = conn.execute(_IMAGE_URL_LOOKUP_SQL, (url,)).fetchone()
+    except sqlite3.Error:
+        return ""
+    finally:
+        if conn:
+            conn.close()
+    if row and _blob_path(row["digest"], row["fmt"]).exists():
+        return row["digest"]
+    return ""
+
+
+def evict_image_store(max_bytes: int | None = None) -> int:
+    """总大小超过上限时按最近访问时间从旧到新删除，降到上限的 90%；返回删除个数。
+    本进程 IMAGE_PIN_TTL 内用到过的图片不删"""
+    limit = IMAGE_STORE_MAX_BYTES if max_bytes is None else max_bytes
+    conn = None
+    removed = []
+    try:
+        conn = _get_db()
+        total = conn.execute(_IMAGE_STORE_TOTAL_SQL).fetchone()[0]
+        if total <= limit:
+            return 0
+        target = total - int(limit * 0.9)
+        pinned = _pinned_images()
+        for row in conn.execute(_IMAGE_EVICT_ORDER_SQL):
+            if target <= 0:
+                break
+            if row["digest"] in pinned:
+                continue
+            removed.append((row["digest"], row["fmt"]))
+            target -= row["size"]
+        digests = [d for d, _ in removed]
+        for i in range(0, len(digests), 500):
+            chunk = digests[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            conn.execute(_IMAGE_EVICT_BLOBS_SQL.format(marks=marks), chunk)
+            conn.execute(_IMAGE_EVICT_URLS_SQL.format(marks=marks), chunk)
+        conn.commit()
+    except sqlite3.Error:
+        return 0
+    finally:
+        if conn:
+            conn.close()
+    for digest, fmt in removed:
+        _blob_path(digest, fmt).unlink(missing_ok=True)
+    return len(removed)